@@ -2,12 +2,39 @@
 """
 Simple UDP log server for receiving logs from iOS app.
 Run this on your Mac, then the iOS app will stream logs here.
+
+Usage:
+    python3 LogServer.py [FILTER] [--port PORT] [--rcvbuf-mb MB] [--stats-interval SECONDS]
+                         [-g REGEX]... [-l LEVEL] [-c CATEGORY]... [-o FILE [--rotate MINUTES] ...]
+
+Example:
+    python3 LogServer.py -l warning -g 'Gemini|429'        # Terminal, filtered
+    python3 LogServer.py -o /tmp/app_logs.txt -q           # Same files as log_server.py
+
+Datagrams are drained in batches from a non-blocking socket with a large
+receive buffer, classified with one precompiled regex, and printed with a
+single write per batch, so bursts from several devices don't overflow the
+kernel queue. Kernel drop counts (Linux /proc/net/udp) are reported
+periodically, so loss is no longer silent.
+
+Filters are compiled once and run on the raw datagram before any
+formatting. With --output, datagrams go through the same batched writer,
+rotation, compression and write-ahead buffer as the TCP log_server.py, in
+the same unified log format.
 """
 
-import socket
+import argparse
 import datetime
-import sys
+import os
 import re
+import select
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'log-server'))
+import log_server
 
 # ANSI colors for terminal output
 class Colors:
@@ -20,21 +47,193 @@ class Colors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
 
+# One pass over the message finds every keyword; the lowest group number
+# that matched wins, same precedence as the old chain of `in` checks
+CLASSIFIER = re.compile(
+    r'(❌|(?i:error))'
+    r'|(✅|(?i:success))'
+    r'|(⚠️|(?i:warning))'
+    r'|(Detected:|🎥)'
+    r'|(API|Gemini)'
+)
+CLASS_COLORS = [None, Colors.RED, Colors.GREEN, Colors.YELLOW, Colors.CYAN, Colors.BLUE]
+
+MAX_DATAGRAM = 65535
+# Datagrams read per wakeup before printing; bounds latency under floods
+MAX_BATCH = 1024
+# One receive buffer reused by every wakeup; datagrams are packed into it
+# back to back, and a wakeup ends early once less than MAX_DATAGRAM is left
+RECV_BUFFER_BYTES = 16 * MAX_DATAGRAM
+
+
+def classify(message):
+    """Return the color for a message, or None."""
+    best = None
+    for match in CLASSIFIER.finditer(message):
+        if best is None or match.lastindex < best:
+            best = match.lastindex
+            if best == 1:
+                break
+    return CLASS_COLORS[best] if best else None
+
 def colorize_log(message):
     """Add colors based on log content"""
-    if '❌' in message or 'error' in message.lower() or 'Error' in message:
-        return Colors.RED + message + Colors.ENDC
-    elif '✅' in message or 'success' in message.lower():
-        return Colors.GREEN + message + Colors.ENDC
-    elif '⚠️' in message or 'warning' in message.lower():
-        return Colors.YELLOW + message + Colors.ENDC
-    elif 'Detected:' in message or '🎥' in message:
-        return Colors.CYAN + message + Colors.ENDC
-    elif 'API' in message or 'Gemini' in message:
-        return Colors.BLUE + message + Colors.ENDC
-    return message
+    color = classify(message)
+    return color + message + Colors.ENDC if color else message
+
+class MessageFilter:
+    """
+    Compiled datagram filters, cheapest first.
+
+    A datagram passes if it contains the legacy substring, matches any of
+    the regexes, and parses to at least min_level in one of categories.
+    """
+
+    def __init__(self, substring=None, patterns=(), min_level=None, categories=None):
+        self.substring = substring.lower() if substring else None
+        # -g may repeat; one alternation means one regex pass per datagram
+        self.regex = re.compile('|'.join(f'(?:{p})' for p in patterns)) if patterns else None
+        self.min_rank = log_server.LEVEL_RANKS[min_level] if min_level else None
+        self.categories = set(categories) if categories else None
+
+    def parse(self, message):
+        """Return (level, category, text) for a matching message, else None."""
+        if self.substring and self.substring not in message.lower():
+            return None
+        if self.regex is not None and not self.regex.search(message):
+            return None
+        level, category, text = log_server.parse_unified_log(message)
+        if self.min_rank is not None and log_server.LEVEL_RANKS.get(level, 0) < self.min_rank:
+            return None
+        if self.categories is not None and category not in self.categories:
+            return None
+        return level, category, text
+
+    def describe(self):
+        parts = []
+        if self.substring:
+            parts.append(f"text~{self.substring!r}")
+        if self.regex is not None:
+            parts.append(f"regex /{self.regex.pattern}/")
+        if self.min_rank is not None:
+            parts.append(f"level>={list(log_server.LEVEL_RANKS)[self.min_rank]}")
+        if self.categories:
+            parts.append(f"category in {','.join(sorted(self.categories))}")
+        return ', '.join(parts)
+
+def kernel_udp_drops(port):
+    """
+    Kernel drop counter for the UDP socket bound to port, from /proc/net/udp.
+
+    Returns None where unavailable (e.g. macOS).
+    """
+    total = None
+    suffix = f":{port:04X}"
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[1].endswith(suffix):
+                        total = (total or 0) + int(fields[-1])
+        except (OSError, ValueError, StopIteration):
+            continue
+    return total
+
+def open_socket(port, rcvbuf_bytes):
+    """Bind a non-blocking UDP socket with a large receive buffer; returns (sock, granted)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf_bytes)
+    except OSError:
+        pass  # capped by the OS (net.core.rmem_max / kern.ipc.maxsockbuf)
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    sock.bind(('0.0.0.0', port))
+    sock.setblocking(False)
+    return sock, granted
+
+def drain(sock, view, limit=MAX_BATCH):
+    """
+    Read every datagram already queued (up to limit) without blocking.
+
+    Datagrams are received into view (a memoryview of the reused receive
+    buffer), so nothing is allocated per datagram. Returns (memoryview, addr)
+    pairs that stay valid only until the next drain.
+    """
+    batch = []
+    offset = 0
+    while len(batch) < limit and len(view) - offset >= MAX_DATAGRAM:
+        try:
+            nbytes, addr = sock.recvfrom_into(view[offset:offset + MAX_DATAGRAM])
+        except (BlockingIOError, InterruptedError):
+            break
+        batch.append((view[offset:offset + nbytes], addr))
+        offset += nbytes
+    return batch
+
+def make_pipeline(args):
+    """The TCP server's writer side (file, rotation, archiver, WAL), without its listener."""
+    compression = None if args.compress == 'none' else args.compress
+    pipeline = log_server.LogServer(args.port, args.output, args.quiet, args.rotate,
+                                    compression, args.retain_mb * 1024 * 1024,
+                                    int(args.retain_hours * 3600), args.rotate_mb * 1024 * 1024,
+                                    queue_policy=args.queue_policy,
+                                    wal_bytes=args.wal_mb * 1024 * 1024)
+    pipeline.running = True
+    pipeline.start_output()
+    return pipeline
 
 def main():
+    parser = argparse.ArgumentParser(description='UDP log server for V4MinimalApp')
+    parser.add_argument('filter', nargs='?', default=None,
+                        help='Only show messages containing this text (case-insensitive)')
+    parser.add_argument('-p', '--port', type=int, default=9999,
+                        help='UDP port (default: 9999)')
+    parser.add_argument('--rcvbuf-mb', type=float, default=8, metavar='MB',
+                        help='Socket receive buffer to request (default: 8)')
+    parser.add_argument('--stats-interval', type=float, default=10, metavar='SECONDS',
+                        help='Report datagram rate and kernel drops every N seconds (default: 10, 0 off)')
+
+    filters = parser.add_argument_group('filters (applied to the raw datagram, before formatting)')
+    filters.add_argument('-g', '--grep', action='append', default=[], metavar='REGEX',
+                         help='Only keep messages matching REGEX (repeatable; any may match)')
+    filters.add_argument('-l', '--level', choices=list(log_server.LEVEL_RANKS),
+                         help='Only keep messages at or above this level')
+    filters.add_argument('-c', '--category', action='append', default=[], metavar='NAME',
+                         help='Only keep messages in this category (repeatable)')
+
+    output = parser.add_argument_group('file output (same pipeline as log_server.py)')
+    output.add_argument('-o', '--output', type=str, default=None,
+                        help='Write unified-format logs to this file')
+    output.add_argument('-r', '--rotate', type=int, default=15, metavar='MINUTES',
+                        help='Rotate the output file every N minutes (default: 15, 0 to disable)')
+    output.add_argument('--rotate-mb', type=int, default=0, metavar='MB',
+                        help='Also rotate once the output file reaches this many MB')
+    output.add_argument('--compress', choices=['none', *log_server.COMPRESSION_SUFFIXES], default='none',
+                        help='Compress rotated files in the background')
+    output.add_argument('--retain-mb', type=int, default=0, metavar='MB',
+                        help='Delete oldest rotated files beyond this total size')
+    output.add_argument('--retain-hours', type=float, default=0, metavar='HOURS',
+                        help='Delete rotated files older than this')
+    output.add_argument('--queue-policy', choices=log_server.QUEUE_POLICIES, default='drop-debug',
+                        help='When the writer falls behind (default: drop-debug)')
+    output.add_argument('--wal-mb', type=int, default=0, metavar='MB',
+                        help='Keep unwritten lines in a crash-safe ring next to the output file')
+    output.add_argument('-q', '--quiet', action='store_true',
+                        help='Only write to the output file, no terminal output')
+    args = parser.parse_args()
+
+    if args.quiet and not args.output:
+        parser.error("--quiet requires --output")
+    if args.compress == 'zstd' and log_server.zstandard is None:
+        parser.error("--compress zstd requires the zstandard package (pip install zstandard)")
+    try:
+        message_filter = MessageFilter(args.filter, args.grep, args.level, args.category)
+    except re.error as e:
+        parser.error(f"bad --grep regex: {e}")
+
     # Get local IP for display
     hostname = socket.gethostname()
     try:
@@ -42,40 +241,88 @@ def main():
     except:
         local_ip = socket.gethostbyname(hostname)
 
-    port = 9999
-
-    # Create UDP socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind(('0.0.0.0', port))
+    port = args.port
+    sock, rcvbuf = open_socket(port, int(args.rcvbuf_mb * 1024 * 1024))
 
     print(f"{Colors.BOLD}{'='*60}{Colors.ENDC}")
     print(f"{Colors.GREEN}📱 iOS Log Server Started{Colors.ENDC}")
     print(f"{Colors.BOLD}{'='*60}{Colors.ENDC}")
     print(f"Listening on: {Colors.CYAN}{local_ip}:{port}{Colors.ENDC}")
+    print(f"Receive buffer: {rcvbuf / (1024 * 1024):.1f} MB")
     print(f"Waiting for logs from V4MinimalApp...")
     print(f"{Colors.BOLD}{'='*60}{Colors.ENDC}\n")
 
-    filter_pattern = sys.argv[1] if len(sys.argv) > 1 else None
-    if filter_pattern:
-        print(f"Filtering for: {filter_pattern}\n")
+    if message_filter.describe():
+        print(f"Filtering for: {message_filter.describe()}\n")
+
+    pipeline = make_pipeline(args) if args.output else None
+
+    # SIGTERM stops as cleanly as Ctrl+C, so queued lines still reach the file
+    def stop(sig, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    received = 0
+    last_received = 0
+    base_drops = kernel_udp_drops(port) or 0
+    last_drops = base_drops
+    next_report = time.monotonic() + args.stats_interval
+    recv_view = memoryview(bytearray(RECV_BUFFER_BYTES))
 
     try:
         while True:
-            data, addr = sock.recvfrom(4096)
-            message = data.decode('utf-8', errors='replace')
+            ready, _, _ = select.select([sock], [], [], 1.0)
+            batch = drain(sock, recv_view) if ready else []
+            received += len(batch)
+
+            out = []
+            records = []
+            if batch:
+                now = datetime.datetime.now()
+                timestamp = now.strftime('%H:%M:%S.%f')[:-3]
+                for data, addr in batch:
+                    message = str(data, 'utf-8', 'replace').strip()
+                    parsed = message_filter.parse(message) if message else None
+                    if parsed is None:
+                        continue
+
+                    if pipeline:
+                        records.append((now, *parsed, f"{addr[0]}:{addr[1]}"))
+                    else:
+                        out.append(f"{Colors.BOLD}[{timestamp}]{Colors.ENDC} {colorize_log(message)}\n")
 
-            # Apply filter if specified
-            if filter_pattern and filter_pattern.lower() not in message.lower():
-                continue
+            now = time.monotonic()
+            if args.stats_interval > 0 and now >= next_report:
+                elapsed = args.stats_interval + (now - next_report)
+                next_report = now + args.stats_interval
+                drops = kernel_udp_drops(port)
+                if received != last_received or (drops or 0) != last_drops:
+                    rate = (received - last_received) / elapsed
+                    if drops is None:
+                        dropped = "kernel drops n/a"
+                    else:
+                        dropped = f"kernel drops +{drops - last_drops:,} (total {drops - base_drops:,})"
+                    color = Colors.RED if drops and drops > last_drops else Colors.HEADER
+                    if not args.quiet:
+                        out.append(f"{color}[udp] {received:,} datagrams ({rate:,.0f}/s), {dropped}{Colors.ENDC}\n")
+                    if pipeline and drops and drops > last_drops:
+                        # Loss is recorded in the file too, where it lands in time
+                        records.append((datetime.datetime.now(), 'warning', 'LogServer',
+                                        f"Kernel dropped {drops - last_drops:,} datagrams", 'server'))
+                    last_drops = drops or 0
+                last_received = received
 
-            timestamp = datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]
-            colored_msg = colorize_log(message)
-            print(f"{Colors.BOLD}[{timestamp}]{Colors.ENDC} {colored_msg}")
+            if records:
+                pipeline.submit(records)
+            if out:
+                sys.stdout.write(''.join(out))
+                sys.stdout.flush()
 
     except KeyboardInterrupt:
-        print(f"\n{Colors.YELLOW}Server stopped.{Colors.ENDC}")
         sock.close()
+        if pipeline:
+            pipeline.shutdown()
+        print(f"\n{Colors.YELLOW}Server stopped.{Colors.ENDC}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+V4MinimalApp Log Server Benchmark
+
+Starts LogServer / ScreenshotServer in-process on ephemeral loopback ports and
+drives them from a separate client process, so the numbers are reproducible on
+any Linux box without a device or network access.
+
+For every scenario it reports:
+
+  * lines/s (or frames/s) and MB/s from first send to last write
+  * ingest-to-disk latency percentiles: each line carries the client's
+    CLOCK_MONOTONIC send time, compared with the moment the server's writer
+    flushed it to the output file (or stored the screenshot)
+  * server CPU per line, from getrusage() of the server process only
+
+Results can be written as JSON and compared against an earlier run.
+
+Usage:
+    python3 benchmark.py [--quick] [--only REGEX] [--json FILE] [--baseline FILE]
+
+Example:
+    python3 benchmark.py --quick                        # Short smoke run
+    python3 benchmark.py --json bench.json              # Full suite, save results
+    python3 benchmark.py --only asyncio --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from log_server import Colors, LogServer, ScreenshotServer
+from test_client import LogClient, ScreenshotClient
+
+# Tag carried by every benchmark line and screenshot timestamp
+BENCH_TAG_RE = re.compile(r'#bench c(\d+) s(\d+) t(\d+)')
+
+LOG_MESSAGE = "[INFO] [Benchmark] Detected: MacBook Pro, Coffee mug, Desk lamp"
+
+
+class Scenario:
+    """One benchmark configuration; kind is 'logs' or 'screenshots'."""
+
+    def __init__(self, kind: str, driver: str = 'threads', clients: int = 1,
+                 count: int = 0, line_bytes: int = 120, batch: int = 1,
+                 compression: str = 'none', frame_kb: int = 0, buffer_mb: int = 64,
+                 rate: int = 0):
+        self.kind = kind
+        self.driver = driver
+        self.clients = clients
+        self.count = count
+        self.line_bytes = line_bytes
+        self.batch = batch
+        self.compression = compression
+        self.frame_kb = frame_kb
+        self.buffer_mb = buffer_mb
+        # Total lines/s across clients; 0 sends flat out (latency then measures queueing)
+        self.rate = rate
+
+    @property
+    def name(self) -> str:
+        if self.kind == 'screenshots':
+            return f"screenshots/{self.clients}c/{self.frame_kb}KB"
+        name = f"logs/{self.driver}/{self.clients}c/{self.line_bytes}B"
+        if self.batch > 1:
+            name += f"/batch{self.batch}"
+        if self.compression != 'none':
+            name += f"/{self.compression}"
+        if self.rate:
+            name += f"/{self.rate}lps"
+        return name
+
+    def params(self) -> dict:
+        params = {'driver': self.driver, 'clients': self.clients, 'count': self.count}
+        if self.kind == 'screenshots':
+            params.update(frame_kb=self.frame_kb, buffer_mb=self.buffer_mb)
+        else:
+            params.update(line_bytes=self.line_bytes, batch=self.batch,
+                          compression=self.compression, rate=self.rate)
+        return params
+
+
+def build_suite(quick: bool, lines: int, frames: int):
+    """The scenario matrix: both client drivers, client counts, line and frame sizes."""
+    client_counts = (1, 4) if quick else (1, 4, 16)
+    line_sizes = (120,) if quick else (120, 1024)
+    frame_sizes = ((64, 64),) if quick else ((64, 64), (1024, 64), (8192, 4))
+
+    suite = []
+    for driver in ('threads', 'asyncio'):
+        for clients in client_counts:
+            for line_bytes in line_sizes:
+                suite.append(Scenario('logs', driver, clients, lines, line_bytes))
+    suite.append(Scenario('logs', 'threads', 4, lines, 120, batch=50))
+    suite.append(Scenario('logs', 'threads', 4, lines, 120, batch=50, compression='deflate'))
+    # Unsaturated latency: a steady device-lab-like rate for about two seconds
+    for rate in (10000,) if quick else (10000, 40000):
+        suite.append(Scenario('logs', 'threads', 4, min(lines, rate * 2), 120, rate=rate))
+    for clients in (1, 4):
+        for frame_kb, buffer_mb in frame_sizes:
+            # An 8 MB frame over a 4 MB buffer exercises the stream-to-disk path
+            suite.append(Scenario('screenshots', 'threads', clients, frames,
+                                  frame_kb=frame_kb, buffer_mb=buffer_mb))
+    return suite
+
+
+# ---------------------------------------------------------------------------
+# Client side (runs in a child process so its CPU isn't billed to the server)
+# ---------------------------------------------------------------------------
+
+def bench_line(index: int, seq: int, line_bytes: int) -> str:
+    tag = f" #bench c{index} s{seq} t{time.monotonic_ns()}"
+    pad = line_bytes - len(LOG_MESSAGE) - len(tag)
+    return LOG_MESSAGE + (' ' + 'x' * (pad - 1) if pad > 1 else '') + tag
+
+
+def drive_threads(scenario: Scenario, port: int, sent: list):
+    """One LogClient thread per connection, sending as fast as possible."""
+    per_client = scenario.count // scenario.clients
+
+    def worker(index):
+        client = LogClient('127.0.0.1', port, framed=scenario.batch > 1,
+                           batch_lines=scenario.batch, compression=scenario.compression)
+        if not client.connect():
+            return
+        interval = scenario.clients / scenario.rate if scenario.rate else 0
+        start = time.monotonic()
+        for seq in range(per_client):
+            if interval:
+                delay = start + seq * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if not client.send(bench_line(index, seq, scenario.line_bytes)):
+                break
+            sent[index] += 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(scenario.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def drive_asyncio(scenario: Scenario, port: int, sent: list):
+    """All connections multiplexed on one event loop, plain-text protocol."""
+    per_client = scenario.count // scenario.clients
+
+    async def worker(index):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for seq in range(per_client):
+            writer.write((bench_line(index, seq, scenario.line_bytes) + '\n').encode('utf-8'))
+            sent[index] += 1
+            if seq % 64 == 63:
+                await writer.drain()
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def run_all():
+        await asyncio.gather(*(worker(i) for i in range(scenario.clients)))
+
+    asyncio.run(run_all())
+
+
+def drive_screenshots(scenario: Scenario, port: int, sent: list):
+    """One legacy-protocol ScreenshotClient thread per connection."""
+    per_client = scenario.count // scenario.clients
+    image = b'\xff\xd8\xff\xe0' + os.urandom(scenario.frame_kb * 1024 - 6) + b'\xff\xd9'
+
+    def worker(index):
+        client = ScreenshotClient('127.0.0.1', port)
+        if not client.connect():
+            return
+        for seq in range(per_client):
+            if not client.send(f"#bench c{index} s{seq} t{time.monotonic_ns()}", image):
+                break
+            sent[index] += 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(scenario.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def client_process(scenario: Scenario, port: int, results):
+    sent = [0] * scenario.clients
+    start_ns = time.monotonic_ns()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if scenario.kind == 'screenshots':
+            drive_screenshots(scenario, port, sent)
+        elif scenario.driver == 'asyncio':
+            drive_asyncio(scenario, port, sent)
+        else:
+            drive_threads(scenario, port, sent)
+    results.put((start_ns, sum(sent)))
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+class WriteProbe:
+    """
+    Records when the server finished writing each batch or frame.
+
+    Wraps methods on a server object; the wrapper only appends a timestamp
+    and a reference, so tags are parsed after the run, off the hot path.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def wrap(self, owner, method: str):
+        original = getattr(owner, method)
+
+        def probed(payload, *args, **kwargs):
+            result = original(payload, *args, **kwargs)
+            done = time.monotonic_ns()
+            with self.lock:
+                self.events.append((done, payload))
+            return result
+
+        setattr(owner, method, probed)
+
+    def written(self, per_event: bool) -> int:
+        with self.lock:
+            if per_event:
+                return len(self.events)
+            return sum(len(lines) for _, lines in self.events)
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def wait_until_running(server, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not server.running:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{type(server).__name__} did not start")
+        time.sleep(0.01)
+
+
+def run_scenario(scenario: Scenario, workdir: str, queue_policy: str, settle: float) -> dict:
+    """Start a fresh server, drive it from a client process and measure."""
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    is_screenshots = scenario.kind == 'screenshots'
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if is_screenshots:
+            server = ScreenshotServer(0, os.path.join(workdir, 'shots'), quiet=True,
+                                      max_inflight_bytes=scenario.buffer_mb * 1024 * 1024,
+                                      stats_interval=0)
+            # Screenshots land through either the writer pool or the streaming path
+            probe = WriteProbe()
+            probe.wrap(server.store, 'save')
+            probe.wrap(server.store, 'add_streamed')
+        else:
+            server = LogServer(0, os.path.join(workdir, 'bench.txt'), quiet=True,
+                               queue_policy=queue_policy, drop_report_seconds=0)
+            probe = WriteProbe()
+            probe.wrap(server, '_write_lines')
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        wait_until_running(server)
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        client = context.Process(target=client_process, args=(scenario, server.port, results))
+        client.start()
+        while True:
+            try:
+                start_ns, sent = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not client.is_alive():
+                    raise RuntimeError(f"client process for {scenario.name} exited early")
+        client.join()
+
+        # Wait for the server to finish writing what it received
+        last, stalled_since = -1, time.monotonic()
+        while True:
+            written = probe.written(per_event=is_screenshots)
+            if written >= sent:
+                break
+            if written != last:
+                last, stalled_since = written, time.monotonic()
+            elif time.monotonic() - stalled_since > settle:
+                break
+            time.sleep(0.01)
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+        server.shutdown()
+        thread.join(timeout=5.0)
+        if is_screenshots:
+            server.store.close()
+
+    latencies = []
+    written = 0
+    end_ns = start_ns
+    nbytes = 0
+    for done_ns, payload in probe.events:
+        end_ns = max(end_ns, done_ns)
+        if is_screenshots:
+            # save(filepath, data, timestamp, ...) / add_streamed(filepath, ...) both
+            # get the file path first; the tag is in the file name
+            match = BENCH_TAG_RE.search(payload.replace('_', ' ').replace('-', ' '))
+            if match:
+                written += 1
+                nbytes += scenario.frame_kb * 1024
+                latencies.append((done_ns - int(match.group(3))) / 1e6)
+            continue
+        for line in payload:
+            match = BENCH_TAG_RE.search(line)
+            if match:
+                written += 1
+                nbytes += len(line) + 1
+                latencies.append((done_ns - int(match.group(3))) / 1e6)
+
+    seconds = max((end_ns - start_ns) / 1e9, 1e-9)
+    cpu = ((usage_after.ru_utime - usage_before.ru_utime) +
+           (usage_after.ru_stime - usage_before.ru_stime))
+    latencies.sort()
+    unit = 'frames' if is_screenshots else 'lines'
+    return {
+        'name': scenario.name,
+        'kind': scenario.kind,
+        'params': scenario.params(),
+        'sent': sent,
+        'written': written,
+        'lost': sent - written,
+        'seconds': round(seconds, 3),
+        f'{unit}_per_sec': round(written / seconds, 1),
+        'mb_per_sec': round(nbytes / seconds / (1024 * 1024), 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p90': round(percentile(latencies, 90), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0.0,
+        },
+        f'cpu_us_per_{unit[:-1]}': round(cpu * 1e6 / written, 2) if written else None,
+    }
+
+
+def rate_of(result: dict) -> float:
+    return result.get('lines_per_sec', result.get('frames_per_sec', 0.0))
+
+
+def print_result(result: dict, baseline: dict = None):
+    unit = 'lines/s' if result['kind'] == 'logs' else 'frames/s'
+    cpu = result.get('cpu_us_per_line', result.get('cpu_us_per_frame'))
+    latency = result['latency_ms']
+    lost = f"{Colors.RED}{result['lost']:,} lost{Colors.RESET}" if result['lost'] else 'no loss'
+    line = (f"{result['name']:<38} {rate_of(result):>11,.0f} {unit:<8} {result['mb_per_sec']:>7.2f} MB/s  "
+            f"p50 {latency['p50']:>8.2f} p99 {latency['p99']:>8.2f} ms  "
+            f"cpu {cpu if cpu is not None else 0:>7.2f} us  {lost}")
+    if baseline:
+        before = rate_of(baseline)
+        if before:
+            change = (rate_of(result) - before) / before * 100
+            color = Colors.GREEN if change >= 0 else Colors.RED
+            line += f"  {color}{change:+.1f}%{Colors.RESET}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='V4MinimalApp Log Server Benchmark - in-process throughput and latency suite',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --quick                  # Small, fast subset of the suite
+  %(prog)s --json bench.json        # Full suite, write results as JSON
+  %(prog)s --only 'logs/asyncio'    # Only scenarios whose name matches
+  %(prog)s --baseline bench.json    # Show lines/s change against an earlier run
+        """
+    )
+    parser.add_argument('--quick', action='store_true',
+                        help='Fewer scenarios and smaller counts')
+    parser.add_argument('--only', type=str, default=None, metavar='REGEX',
+                        help='Run only scenarios whose name matches')
+    parser.add_argument('--lines', type=int, default=None,
+                        help='Lines per log scenario (default: 200000, 20000 with --quick)')
+    parser.add_argument('--frames', type=int, default=None,
+                        help='Frames per screenshot scenario (default: 200, 40 with --quick)')
+    parser.add_argument('--queue-policy', type=str, default='block',
+                        help='Server ingest queue policy (default: block, lossless)')
+    parser.add_argument('--settle', type=float, default=5.0, metavar='SECONDS',
+                        help='Give up waiting for writes after this long without progress (default: 5)')
+    parser.add_argument('--json', type=str, default=None, metavar='FILE',
+                        help="Write results as JSON ('-' for stdout)")
+    parser.add_argument('--baseline', type=str, default=None, metavar='FILE',
+                        help='Earlier --json results to compare against')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Scratch directory (default: a temporary directory)')
+
+    args = parser.parse_args()
+
+    lines = args.lines or (20000 if args.quick else 200000)
+    frames = args.frames or (40 if args.quick else 200)
+    suite = build_suite(args.quick, lines, frames)
+    if args.only:
+        suite = [s for s in suite if re.search(args.only, s.name)]
+    if not suite:
+        print(f"{Colors.RED}Error: no scenarios match --only {args.only}{Colors.RESET}")
+        sys.exit(1)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['name']: r for r in json.load(f)['scenarios']}
+
+    # Keep the table off stdout when stdout carries the JSON
+    report = sys.stderr if args.json == '-' else sys.stdout
+    workroot = args.workdir or tempfile.mkdtemp(prefix='logserver-bench-')
+    results = []
+    try:
+        with contextlib.redirect_stdout(report):
+            print(f"{Colors.BOLD}Running {len(suite)} scenarios ({lines:,} lines, "
+                  f"{frames} frames each){Colors.RESET}")
+            for scenario in suite:
+                result = run_scenario(scenario, os.path.join(workroot, 'run'),
+                                      args.queue_policy, args.settle)
+                results.append(result)
+                print_result(result, baseline.get(result['name']))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workroot, ignore_errors=True)
+
+    if args.json:
+        output = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'host': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'settings': {'lines': lines, 'frames': frames, 'queue_policy': args.queue_policy},
+            'scenarios': results,
+        }
+        if args.json == '-':
+            json.dump(output, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(output, f, indent=2)
+            print(f"Results written to {args.json}")
+
+    sys.exit(1 if any(r['lost'] for r in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Example pipeline stages for log_server.py --pipeline / --stage.
+
+A stage is any callable that takes a list of parsed records, each
+(timestamp, level, category, text, client), and returns the list to pass
+on. Sinks return nothing. Stages see whole batches, so per-line Python
+call overhead is paid once per batch, not once per line.
+
+Usage:
+    python3 log_server.py -o /tmp/app_logs.txt --stage enrich=example_stages:gemini_latency
+    python3 log_server.py -o /tmp/app_logs.txt --pipeline pipeline.json
+
+pipeline.json:
+    {"stages": [
+        {"kind": "enrich", "call": "example_stages:GeminiLatency",
+         "options": {"threshold_ms": 2000, "report_seconds": 30}},
+        {"kind": "filter", "call": "example_stages:drop_heartbeats"},
+        {"kind": "sink", "call": "example_stages:JsonLinesSink",
+         "options": {"path": "/tmp/app_logs.jsonl"}, "pool": "thread"}
+    ]}
+"""
+
+import datetime
+import json
+import re
+import time
+
+# "Detected: ... (1234 ms)" and "... (retry in 1234 ms)" from GeminiService
+GEMINI_LATENCY_RE = re.compile(r'\((?:retry in )?(\d+) ms\)')
+
+
+class GeminiLatency:
+    """
+    Enrich: measure GeminiService latencies and flag slow requests.
+
+    Every "(N ms)" a GeminiService line reports is recorded. A line over
+    threshold_ms is followed by a [LatencyDetector] warning, and every
+    report_seconds a notice summarizes p50/p90/max since the last one.
+    """
+
+    def __init__(self, threshold_ms: int = 3000, report_seconds: float = 60):
+        self.threshold_ms = threshold_ms
+        self.report_seconds = report_seconds
+        self.samples = []
+        self.next_report = time.monotonic() + report_seconds
+
+    def __call__(self, records):
+        out = []
+        for record in records:
+            out.append(record)
+            timestamp, _, category, text, client = record
+            if category != 'GeminiService':
+                continue
+            match = GEMINI_LATENCY_RE.search(text)
+            if not match:
+                continue
+            ms = int(match.group(1))
+            self.samples.append(ms)
+            if ms > self.threshold_ms:
+                out.append((timestamp, 'warning', 'LatencyDetector',
+                            f"Slow Gemini request: {ms} ms (> {self.threshold_ms} ms)", client))
+
+        if self.samples and time.monotonic() >= self.next_report:
+            self.next_report = time.monotonic() + self.report_seconds
+            self.samples.sort()
+            n = len(self.samples)
+            out.append((datetime.datetime.now(), 'notice', 'LatencyDetector',
+                        f"Gemini latency over {n} requests: p50 {self.samples[n // 2]} ms, "
+                        f"p90 {self.samples[n * 9 // 10]} ms, max {self.samples[-1]} ms", 'server'))
+            self.samples = []
+        return out
+
+
+gemini_latency = GeminiLatency()
+
+
+def drop_heartbeats(records):
+    """Filter: drop keep-alive lines some app builds log every second."""
+    return [record for record in records if record[3] not in ('heartbeat', 'ping')]
+
+
+class JsonLinesSink:
+    """Sink: append every delivered record to a JSON-lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path, 'a', buffering=1024 * 1024)
+
+    def __call__(self, records):
+        self.f.write(''.join(
+            json.dumps({'time': timestamp.isoformat(timespec='milliseconds'), 'level': level,
+                        'category': category, 'text': text, 'client': client}) + '\n'
+            for timestamp, level, category, text, client in records))
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+V4MinimalApp Log Template Archive
+
+Archive format for rotated log files (.lta). Device logs repeat the same few
+hundred messages with different numbers, so each line is stored as a
+template id plus its variable parts instead of verbatim:
+
+  "2026-02-05 19:53:00.123 V4MinimalApp <Debug> [CameraManager] Frame captured: 1920x1080"
+      stamp      -> millisecond delta from the previous line
+      template   -> "V4MinimalApp <Debug> [CameraManager] Frame captured: \\0x\\0"
+      parameters -> "1920", "1080"
+
+Templates are mined online: everything after the "[Category] " prefix that
+looks like a number, hex id or UUID becomes a parameter, and each new
+template string gets the next id. Lines are grouped into blocks of
+BLOCK_LINES. Each block has a small JSON header (line count, first/last
+stamp, templates first defined in it, per-template line counts) and a
+zlib-compressed body holding the columns: stamp deltas, template ids, and
+one parameter column per template. Readers rebuild the exact original text.
+A query can skip a block's body without decompressing it when the header
+shows it is outside the time range or uses no matching template.
+
+Usage:
+    python3 log_archive.py pack FILE [FILE ...] [--remove]
+    python3 log_archive.py cat FILE.lta [--template REGEX]
+    python3 log_archive.py templates FILE.lta [--top N]
+
+log_server.py writes these with --compress template, and log_query.py reads
+them like any other rotated file.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+
+MAGIC = b'V4MLTA1\n'
+BLOCK_HEADER = struct.Struct('>II')  # header length, body length
+BLOCK_LINES = 8192
+ARCHIVE_SUFFIX = '.lta'
+
+# Variable parts of a message: UUIDs, hex ids (0x-prefixed, or 6+ hex digits
+# mixing letters and digits), then any number (so "1920x1080" and "2.5s"
+# become "<*>x<*>" and "<*>s")
+TEMPLATE_MASK = re.compile(r'[0-9A-Fa-f]{8}(?:-[0-9A-Fa-f]{4}){3}-[0-9A-Fa-f]{12}'
+                           r'|0x[0-9A-Fa-f]+'
+                           r'|\b(?=[0-9A-Fa-f]*[A-Fa-f])(?=[0-9A-Fa-f]*\d)[0-9A-Fa-f]{6,}\b'
+                           r'|\d+(?:\.\d+)?')
+# The same, capturing, so one split() yields literals and parameters alternately
+TEMPLATE_SPLIT = re.compile(f'({TEMPLATE_MASK.pattern})')
+
+# "2026-02-05 19:53:00.123 " then "V4MinimalApp <Info> [Category] ", kept literal
+LINE_RE = re.compile(r'([12]\d{3}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}) (\S+ <\w+> \[[^\]\x00]*\] )?')
+STAMP_LEN = len('2026-02-05 19:53:00.123')
+
+# Template id 0 stores a line verbatim (no stamp, or text the template scheme can't hold)
+RAW = 0
+PLACEHOLDER = '\x00'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_varints(values) -> bytes:
+    """LEB128-encode non-negative integers."""
+    out = bytearray()
+    for value in values:
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data: bytes, count: int):
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    if len(values) != count:
+        raise ValueError(f"corrupt archive block: expected {count} values, got {len(values)}")
+    return values
+
+
+def zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def template_display(template: str) -> str:
+    """A template as people read it, with <*> for each parameter."""
+    return template.replace(PLACEHOLDER, '<*>')
+
+
+def line_template(line: str):
+    """The display template of a formatted log line (as listed by `templates`), or None."""
+    match = LINE_RE.match(line)
+    if not match:
+        return None
+    return (match.group(2) or '') + TEMPLATE_MASK.sub('<*>', line[match.end():])
+
+
+class TemplateArchiveWriter:
+    """Appends lines to an archive file object; call close() to flush the last block."""
+
+    def __init__(self, fileobj, block_lines: int = BLOCK_LINES, level: int = 6):
+        self.f = fileobj
+        self.block_lines = block_lines
+        self.level = level
+        self.templates = {}  # template string -> id
+        self.new_templates = {}
+        self.second = None  # cached "YYYY-mm-dd HH:MM:SS" and its epoch milliseconds
+        self.second_ms = 0
+        self.lines_written = 0
+        self.f.write(MAGIC)
+        self._reset_block()
+
+    def _reset_block(self):
+        # Deltas restart from 0 in every block, so a reader can skip blocks
+        self.last_ms = 0
+        self.deltas = []
+        self.ids = []
+        self.params = {}  # template id -> flat list of its parameters
+        self.first = self.last = None
+
+    def _stamp_ms(self, stamp: str):
+        second = stamp[:19]
+        if second != self.second:
+            try:
+                when = datetime.datetime.strptime(second, '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                return None
+            self.second = second
+            self.second_ms = (when - EPOCH) // datetime.timedelta(milliseconds=1)
+        return self.second_ms + int(stamp[20:23])
+
+    def add(self, line: str):
+        """Add one line (without its newline)."""
+        if len(self.ids) >= self.block_lines:
+            self._flush_block()
+        match = LINE_RE.match(line)
+        ms = self._stamp_ms(match.group(1)) if match else None
+        if ms is None or PLACEHOLDER in line or '\n' in line:
+            template_id, params = RAW, [line]
+            ms = self.last_ms
+        else:
+            parts = TEMPLATE_SPLIT.split(line[match.end():])
+            template = (match.group(2) or '') + PLACEHOLDER.join(parts[0::2])
+            params = parts[1::2]
+            template_id = self.templates.get(template)
+            if template_id is None:
+                template_id = self.templates[template] = len(self.templates) + 1
+                self.new_templates[template_id] = template
+            stamp = match.group(1)
+            if self.first is None:
+                self.first = stamp
+            self.last = stamp
+
+        self.deltas.append(zigzag(ms - self.last_ms))
+        self.last_ms = ms
+        self.ids.append(template_id)
+        column = self.params.get(template_id)
+        if column is None:
+            self.params[template_id] = params
+        else:
+            column.extend(params)
+
+    def _flush_block(self, final_newline: bool = True):
+        if not self.ids:
+            return
+        used = sorted(self.params)
+        sections = [encode_varints(self.deltas), encode_varints(self.ids)]
+        sections += ['\n'.join(self.params[template_id]).encode('utf-8', 'surrogateescape')
+                     for template_id in used]
+        counts = {}
+        for template_id in self.ids:
+            counts[template_id] = counts.get(template_id, 0) + 1
+        header = {
+            'lines': len(self.ids),
+            'first': self.first,
+            'last': self.last,
+            'templates': {str(k): v for k, v in self.new_templates.items()},
+            'used': {str(k): counts[k] for k in used},
+            'sections': [len(section) for section in sections],
+        }
+        if not final_newline:
+            header['no_final_newline'] = True
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        body = zlib.compress(b''.join(sections), self.level)
+        self.f.write(BLOCK_HEADER.pack(len(header_bytes), len(body)))
+        self.f.write(header_bytes)
+        self.f.write(body)
+        self.lines_written += len(self.ids)
+        self.new_templates = {}
+        self._reset_block()
+
+    def close(self, final_newline: bool = True):
+        """Flush the last block; final_newline=False if the source didn't end with one."""
+        self._flush_block(final_newline)
+
+
+class TemplateArchiveReader:
+    """Reads an archive file object block by block."""
+
+    def __init__(self, fileobj):
+        self.f = fileobj
+        if self.f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a log template archive")
+        self.templates = {}  # id -> template string
+        self.counts = {}  # id -> lines using it, over the blocks read so far
+
+    def blocks(self):
+        """Yield (header, read_body) per block; templates are registered before the yield."""
+        while True:
+            sizes = self.f.read(BLOCK_HEADER.size)
+            if not sizes:
+                return
+            if len(sizes) < BLOCK_HEADER.size:
+                raise ValueError("truncated archive")
+            header_len, body_len = BLOCK_HEADER.unpack(sizes)
+            header = json.loads(self.f.read(header_len))
+            for template_id, template in header['templates'].items():
+                self.templates[int(template_id)] = template
+            for template_id, count in header['used'].items():
+                self.counts[int(template_id)] = self.counts.get(int(template_id), 0) + count
+            body_start = self.f.tell() if self.f.seekable() else None
+            body = None
+
+            def read_body():
+                nonlocal body
+                if body is None:
+                    if body_start is not None:
+                        self.f.seek(body_start)
+                    body = self.f.read(body_len)
+                return body
+
+            yield header, read_body
+            if body is None:
+                if body_start is not None:
+                    self.f.seek(body_start + body_len)
+                else:
+                    self.f.read(body_len)
+
+    def lines(self, since: str = None, until: str = None, template_match=None):
+        """
+        Yield the original lines (with newlines), in order.
+
+        since/until are stamp strings; blocks entirely outside them are
+        skipped, but lines inside a block are not filtered individually.
+        template_match(display_template) -> bool selects lines by template;
+        blocks using no matching template are not even decompressed.
+        """
+        wanted = {RAW: template_match is None}
+        pieces = {}
+        second = None
+        second_prefix = ''
+        for header, read_body in self.blocks():
+            used = [int(template_id) for template_id in header['used']]
+            if template_match is not None:
+                for template_id in used:
+                    if template_id not in wanted:
+                        wanted[template_id] = bool(template_match(template_display(self.templates[template_id])))
+                if not any(wanted[template_id] for template_id in used):
+                    continue
+            if since and header['last'] and header['last'] < since:
+                continue
+            if until and header['first'] and header['first'] > until:
+                continue
+
+            data = zlib.decompress(read_body())
+            sections = []
+            start = 0
+            for size in header['sections']:
+                sections.append(data[start:start + size])
+                start += size
+            count = header['lines']
+            deltas = decode_varints(sections[0], count)
+            ids = decode_varints(sections[1], count)
+            columns = {template_id: iter(section.decode('utf-8', 'surrogateescape').split('\n'))
+                       for template_id, section in zip(used, sections[2:])}
+
+            out = []
+            ms = 0
+            emitted = False  # whether the block's latest line was output
+            for delta, template_id in zip(deltas, ids):
+                ms += unzigzag(delta)
+                column = columns[template_id]
+                emitted = False
+                if template_id == RAW:
+                    line = next(column)
+                    if wanted[RAW]:
+                        out.append(line + '\n')
+                        emitted = True
+                    continue
+                parts = pieces.get(template_id)
+                if parts is None:
+                    parts = pieces[template_id] = self.templates[template_id].split(PLACEHOLDER)
+                if not wanted.get(template_id, True):
+                    for _ in range(len(parts) - 1):
+                        next(column)
+                    continue
+                if ms // 1000 != second:
+                    second = ms // 1000
+                    when = EPOCH + datetime.timedelta(seconds=second)
+                    second_prefix = when.strftime('%Y-%m-%d %H:%M:%S.')
+                text = [second_prefix, f'{ms % 1000:03d} ', parts[0]]
+                for literal in parts[1:]:
+                    text.append(next(column))
+                    text.append(literal)
+                text.append('\n')
+                out.append(''.join(text))
+                emitted = True
+            if header.get('no_final_newline') and emitted:
+                out[-1] = out[-1][:-1]
+            yield from out
+
+
+def pack_stream(src, dst, block_lines: int = BLOCK_LINES) -> int:
+    """Archive the binary line stream src into the binary file object dst; returns lines."""
+    writer = TemplateArchiveWriter(dst, block_lines)
+    final_newline = True
+    for raw in src:
+        final_newline = raw.endswith(b'\n')
+        writer.add(raw.decode('utf-8', 'surrogateescape').removesuffix('\n'))
+    writer.close(final_newline)
+    return writer.lines_written
+
+
+def pack_file(path: str, block_lines: int = BLOCK_LINES, remove: bool = False) -> str:
+    """Archive a closed log file to path + ARCHIVE_SUFFIX, keeping its mtime."""
+    target = path + ARCHIVE_SUFFIX
+    tmp_path = target + '.tmp'
+    stat = os.stat(path)
+    try:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            pack_stream(src, dst, block_lines)
+        os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if remove:
+        os.remove(path)
+    return target
+
+
+class ArchiveLineStream:
+    """Binary, iterable view of an archive's original lines, like an opened log file."""
+
+    def __init__(self, path: str, since: str = None, until: str = None, template_match=None):
+        self.f = open(path, 'rb')
+        self.reader = TemplateArchiveReader(self.f)
+        self.since = since
+        self.until = until
+        self.template_match = template_match
+
+    def __iter__(self):
+        for line in self.reader.lines(self.since, self.until, self.template_match):
+            yield line.encode('utf-8', 'surrogateescape')
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def template_regex_matcher(pattern: str, ignore_case: bool = False):
+    """template_match callable for a regex over display templates."""
+    regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    return lambda template: regex.search(template) is not None
+
+
+def print_templates(path: str, top: int = 0):
+    """List an archive's templates by line count."""
+    with open(path, 'rb') as f:
+        reader = TemplateArchiveReader(f)
+        lines = blocks = 0
+        for header, _ in reader.blocks():
+            lines += header['lines']
+            blocks += 1
+    ranked = sorted(reader.counts.items(), key=lambda item: -item[1])
+    if top:
+        ranked = ranked[:top]
+    for template_id, count in ranked:
+        template = 'raw lines' if template_id == RAW else template_display(reader.templates[template_id])
+        print(f"{count:>10,}  {template_id:>6}  {template}")
+    print(f"{lines:,} lines, {len(reader.templates):,} templates, {blocks:,} blocks", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pack V4MinimalApp log files into template archives, and read them back',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s pack /tmp/app_logs_20260205_195300.txt              # -> .txt.lta
+  %(prog)s cat /tmp/app_logs_20260205_195300.txt.lta | less
+  %(prog)s cat /tmp/app_logs_20260205_195300.txt.lta --template 'Gemini.*error'
+  %(prog)s templates /tmp/app_logs_20260205_195300.txt.lta --top 20
+        """
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help='Archive log files next to themselves (FILE.lta)')
+    pack.add_argument('files', nargs='+')
+    pack.add_argument('--remove', action='store_true',
+                      help='Delete each original after archiving it')
+    pack.add_argument('--block-lines', type=int, default=BLOCK_LINES, metavar='N',
+                      help=f'Lines per block (default: {BLOCK_LINES})')
+    cat = commands.add_parser('cat', help='Print the original lines of an archive')
+    cat.add_argument('file')
+    cat.add_argument('-t', '--template', type=str, default=None, metavar='REGEX',
+                     help='Only lines whose template (numbers shown as <*>) matches REGEX')
+    cat.add_argument('-i', '--ignore-case', action='store_true',
+                     help='Case-insensitive --template')
+    templates = commands.add_parser('templates', help='List templates by line count')
+    templates.add_argument('file')
+    templates.add_argument('-n', '--top', type=int, default=0,
+                           help='Only the N most frequent templates')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'pack':
+            for path in args.files:
+                size = os.path.getsize(path)
+                target = pack_file(path, args.block_lines, remove=args.remove)
+                packed = os.path.getsize(target)
+                print(f"{path} -> {target}: {size / 1024:,.0f} KB -> {packed / 1024:,.0f} KB "
+                      f"({size / max(packed, 1):.1f}x)", file=sys.stderr)
+        elif args.command == 'cat':
+            match = template_regex_matcher(args.template, args.ignore_case) if args.template else None
+            with ArchiveLineStream(args.file, template_match=match) as lines:
+                out = sys.stdout.buffer
+                for line in lines:
+                    out.write(line)
+        else:
+            print_templates(args.file, args.top)
+    except (BrokenPipeError, KeyboardInterrupt):
+        sys.stderr.close()
+    except (OSError, ValueError, re.error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+V4MinimalApp Log Query
+
+Searches the (rotated) log files written by log_server.py without grepping
+every file end to end:
+
+  * Rotation timestamps in the file names (app_logs_YYYYMMDD_HHMMSS.txt) pick
+    only the files that can overlap the requested time range.
+  * Inside each file, lines are time-ordered, so the start of the range is
+    found with a binary search over byte offsets instead of a linear scan.
+  * Level / category / regex filters are applied while streaming, and the
+    scan stops as soon as it passes the end of the range.
+  * Rotated files compressed by the server (.gz, .zst) are decompressed on
+    the fly; they are streamed rather than bisected. Template archives (.lta,
+    see log_archive.py) skip whole blocks by time range and by --template
+    without decompressing them.
+  * Shards written by `log_server.py --workers`, and per-connection files
+    from `--session-dir`, are merged into a single time-ordered view.
+
+Usage:
+    python3 log_query.py BASE [--since TIME] [--until TIME] [--level LEVEL]
+                              [--category NAME ...] [--grep REGEX] [--jobs N]
+
+Example:
+    python3 log_query.py /tmp/app_logs.txt --since 30m --level warning
+    python3 log_query.py /tmp/app_logs.txt --since 14:00 --until 14:05 -c GeminiService
+    python3 log_query.py /tmp/app_logs.txt --since "2026-02-05 19:00" --grep "429|timeout" -j 4
+    python3 log_query.py --screenshots-near "2026-02-05 19:03:12.450" --screenshot-dir /tmp/app_screenshots
+"""
+
+import argparse
+import collections
+import datetime
+import heapq
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from log_archive import ArchiveLineStream, line_template, template_regex_matcher
+from log_server import (Colors, LEVEL_RANKS, ScreenshotStore, colorize_log,
+                        discover_log_files, discover_shards, log_compression, open_log_for_read)
+
+# Formatted log line: "2026-02-05 19:53:00.123 V4MinimalApp <Info> [Category] text"
+LOG_LINE_RE = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}) \S+ <(\w+)> \[([^\]]*)\] ')
+
+# Every formatted line starts with a fixed-width, lexicographically sortable stamp
+STAMP_LEN = len('2026-02-05 19:53:00.123')
+
+# Screenshot manifest lines start with the server receive stamp
+MANIFEST_STAMP_PREFIX = b'{"received": "'
+
+# Below this many bytes the binary search hands over to a linear scan
+SEEK_LINEAR_BYTES = 64 * 1024
+
+# With --jobs, plain files are scanned in line-aligned ranges of about this
+# size, and each worker has at most JOB_QUEUE_DEPTH ranges queued, so a wide
+# query holds a few ranges' matches in memory rather than every file's
+JOB_CHUNK_BYTES = 8 * 1024 * 1024
+JOB_QUEUE_DEPTH = 2
+
+
+def format_stamp(when: datetime.datetime) -> bytes:
+    """Format a datetime the way log lines are stamped, for byte comparison."""
+    return when.strftime('%Y-%m-%d %H:%M:%S.%f')[:STAMP_LEN].encode('ascii')
+
+
+def parse_time_arg(value: str, now: datetime.datetime = None) -> datetime.datetime:
+    """
+    Parse a --since/--until value.
+
+    Accepts a relative age ("90s", "15m", "2h", "1d"), a time of day today
+    ("14:05", "14:05:30") or an absolute "YYYY-MM-DD[ HH:MM[:SS[.fff]]]".
+    """
+    if now is None:
+        now = datetime.datetime.now()
+
+    value = value.strip()
+    match = re.fullmatch(r'(\d+)([smhd])', value)
+    if match:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return now - datetime.timedelta(**{unit: int(match.group(1))})
+
+    if re.fullmatch(r'\d{1,2}:\d\d(:\d\d(\.\d+)?)?', value):
+        value = f"{now.date().isoformat()} {value}"
+
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r}")
+
+
+def select_files(files, since=None, until=None):
+    """
+    Keep only the files whose time span can overlap [since, until].
+
+    A rotated file covers from its own stamp up to the next file's stamp.
+    Files with an unknown start are always kept (the in-file seek is cheap).
+    """
+    selected = []
+    for i, (path, start) in enumerate(files):
+        if start is None:
+            selected.append(path)
+            continue
+        end = files[i + 1][1] if i + 1 < len(files) else None
+        if until is not None and start > until:
+            continue
+        if since is not None and end is not None and end < since:
+            continue
+        selected.append(path)
+    return selected
+
+
+def log_line_stamp(line: bytes):
+    """Stamp of a formatted log line, or None if it isn't one."""
+    match = LOG_LINE_RE.match(line)
+    return match.group(1) if match else None
+
+
+def manifest_stamp(line: bytes):
+    """Receive stamp of a screenshot manifest line, or None."""
+    if not line.startswith(MANIFEST_STAMP_PREFIX):
+        return None
+    start = len(MANIFEST_STAMP_PREFIX)
+    return line[start:start + STAMP_LEN]
+
+
+def seek_to_stamp(f, target: bytes, stamp_of=log_line_stamp) -> int:
+    """
+    Position f at the first line stamped at or after target.
+
+    Lines are appended in time order, so bisect over byte offsets: after
+    seeking to the middle, discard the partial line and compare the stamp of
+    the next complete one. Once the window is small, finish linearly.
+    """
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+
+    while hi - lo > SEEK_LINEAR_BYTES:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        f.readline()
+        line = f.readline()
+        stamp = stamp_of(line) if line else None
+        if not line or (stamp is not None and stamp >= target):
+            hi = mid
+        else:
+            lo = mid
+
+    f.seek(lo)
+    if lo:
+        f.readline()
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line:
+            return pos
+        stamp = stamp_of(line)
+        if stamp is not None and stamp >= target:
+            f.seek(pos)
+            return pos
+
+
+def find_screenshots_near(screenshot_dir: str, when: datetime.datetime, count: int = 3):
+    """
+    Return the count manifest entries received closest to when, in time order.
+
+    Bisects the append-only manifest to when, then reads just enough entries
+    on either side, so the cost doesn't grow with the number of screenshots.
+    """
+    manifest_path = os.path.join(screenshot_dir, ScreenshotStore.MANIFEST_NAME)
+    target = format_stamp(when)
+
+    def entries(lines):
+        for line in lines:
+            if manifest_stamp(line) is None:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+    with open(manifest_path, 'rb') as f:
+        pos = seek_to_stamp(f, target, manifest_stamp)
+
+        after = []
+        for entry in entries(f):
+            after.append(entry)
+            if len(after) >= count:
+                break
+
+        # Walk backwards in growing blocks until count earlier entries are found
+        back = count * 1024
+        while True:
+            start = max(0, pos - back)
+            f.seek(start)
+            if start:
+                f.readline()
+            lines = []
+            while f.tell() < pos:
+                lines.append(f.readline())
+            before = list(entries(lines))
+            if len(before) >= count or start == 0:
+                break
+            back *= 4
+
+    def distance(entry):
+        received = datetime.datetime.strptime(entry['received'], '%Y-%m-%d %H:%M:%S.%f')
+        return abs((received - when).total_seconds())
+
+    nearest = sorted(before[-count:] + after, key=distance)[:count]
+    return sorted(nearest, key=lambda entry: entry['received'])
+
+
+def print_screenshots_near(screenshot_dir: str, when: datetime.datetime, count: int):
+    """Print the screenshots received closest to when, with their offsets."""
+    for entry in find_screenshots_near(screenshot_dir, when, count):
+        received = datetime.datetime.strptime(entry['received'], '%Y-%m-%d %H:%M:%S.%f')
+        offset = (received - when).total_seconds()
+        if entry.get('path'):
+            where = os.path.join(screenshot_dir, entry['path'])
+        else:
+            where = f"(not stored: {entry.get('skipped', 'unknown')})"
+        dup = f"  (duplicate, stored as {entry['path']})" if entry.get('duplicate_of') else ''
+        print(f"{offset:+8.3f}s  {entry['received']}  {entry['client']:<21}  {where}  "
+              f"{entry['size'] / 1024:.1f} KB{dup}")
+
+
+class LogQuery:
+    """Time range and filters for a query; picklable so workers can run it."""
+
+    def __init__(self, since=None, until=None, min_level=None, categories=None,
+                 pattern=None, ignore_case=False, template=None):
+        self.since = format_stamp(since) if since else None
+        self.until = format_stamp(until) if until else None
+        self.min_rank = LEVEL_RANKS[min_level] if min_level else None
+        self.categories = {c.encode('utf-8') for c in categories} if categories else None
+        self.pattern = pattern
+        self.ignore_case = ignore_case
+        self.template = template
+        self._regex = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_regex'] = None
+        return state
+
+    def _compiled(self):
+        if self._regex is None and self.pattern:
+            self._regex = re.compile(self.pattern, re.IGNORECASE if self.ignore_case else 0)
+        return self._regex
+
+    def scan(self, path: str, chunk=None):
+        """
+        Yield (level, line) for every matching line in one file, in order.
+
+        chunk is an optional (start, end) byte range from file_chunks(): only
+        lines starting inside it are scanned (end None = to the end of file).
+        """
+        regex = self._compiled()
+        template_match = template_regex_matcher(self.template, self.ignore_case) if self.template else None
+        if log_compression(path) == 'template':
+            # The archive applies the range and template filters block by block itself
+            f = ArchiveLineStream(path, self.since and self.since.decode('ascii'),
+                                  self.until and self.until.decode('ascii'), template_match)
+            template_match = None
+        else:
+            f = open_log_for_read(path)
+        with f:
+            # Compressed files can't be bisected cheaply; stream past the start instead
+            skip_before = None
+            pos, end = chunk if chunk else (0, None)
+            if chunk:
+                # Ranges are line-aligned and already past --since
+                f.seek(pos)
+            elif self.since:
+                if log_compression(path):
+                    skip_before = self.since
+                else:
+                    seek_to_stamp(f, self.since)
+
+            for raw in f:
+                if end is not None:
+                    if pos >= end:
+                        break
+                    pos += len(raw)
+                match = LOG_LINE_RE.match(raw)
+                if not match:
+                    continue
+                if skip_before:
+                    if match.group(1) < skip_before:
+                        continue
+                    skip_before = None
+                if self.until and match.group(1) > self.until:
+                    break
+
+                level = match.group(2).lower().decode('ascii')
+                if self.min_rank is not None and LEVEL_RANKS.get(level, 0) < self.min_rank:
+                    continue
+                if self.categories is not None and match.group(3) not in self.categories:
+                    continue
+
+                line = raw.decode('utf-8', errors='replace').rstrip('\n')
+                if regex and not regex.search(line):
+                    continue
+                if template_match and not template_match(line_template(line) or ''):
+                    continue
+                yield level, line
+
+
+def file_chunks(query: LogQuery, path: str, size: int = JOB_CHUNK_BYTES):
+    """
+    Yield line-aligned (start, end) byte ranges of a plain log file that can
+    hold matches for query; the last range runs to the end of file (end None).
+
+    Compressed files can't be entered mid-stream, so they are a single None
+    chunk (the whole file).
+    """
+    if log_compression(path):
+        yield None
+        return
+    with open(path, 'rb') as f:
+        start = seek_to_stamp(f, query.since) if query.since else 0
+        f.seek(0, os.SEEK_END)
+        total = f.tell()
+        while start < total:
+            if start + size >= total:
+                yield start, None
+                return
+            f.seek(start + size)
+            f.readline()
+            end = f.tell()
+            yield start, end
+            line = f.readline()
+            stamp = log_line_stamp(line)
+            if query.until and stamp is not None and stamp > query.until:
+                return
+            start = end
+
+
+def _scan_chunk(query: LogQuery, path: str, chunk):
+    """Worker entry point for --jobs: one chunk's matches as a list."""
+    return list(query.scan(path, chunk))
+
+
+def _pooled_scan(pool, query: LogQuery, paths, depth: int):
+    """Yield (level, line) from paths in order, scanning chunks on pool with at most depth in flight."""
+    pending = collections.deque()
+    for path in paths:
+        for chunk in file_chunks(query, path):
+            pending.append(pool.submit(_scan_chunk, query, path, chunk))
+            if len(pending) >= depth:
+                yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def run_query(query: LogQuery, paths, jobs: int = 1):
+    """Yield (level, line) across files in time order, optionally in parallel."""
+    if jobs <= 1:
+        for path in paths:
+            yield from query.scan(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Results are taken in submission order, so output stays time-ordered
+        yield from _pooled_scan(pool, query, paths, jobs * JOB_QUEUE_DEPTH)
+
+
+SESSION_FILE_RE = re.compile(r'^(.+)_(\d{8}_\d{6})\.txt$')
+
+
+def discover_session_files(directory: str, devices=None):
+    """[(path, start)] of the session files in a --session-dir, oldest first."""
+    files = []
+    for name in os.listdir(directory):
+        match = SESSION_FILE_RE.match(name)
+        if not match or (devices and match.group(1) not in devices):
+            continue
+        try:
+            start = datetime.datetime.strptime(match.group(2), '%Y%m%d_%H%M%S')
+        except ValueError:
+            continue
+        files.append((os.path.join(directory, name), start))
+    return sorted(files, key=lambda entry: entry[1])
+
+
+def run_merged_query(query: LogQuery, groups, jobs: int = 1):
+    """
+    Yield (level, line) from several shards merged into one time-ordered stream.
+
+    groups holds one time-ordered path list per shard (log_server.py
+    --workers); each shard is already sorted, so a k-way merge on the
+    fixed-width line stamp is enough.
+    """
+    def stamp(item):
+        return item[1][:STAMP_LEN]
+
+    if jobs <= 1:
+        yield from heapq.merge(*(run_query(query, paths) for paths in groups), key=stamp)
+        return
+
+    # The merge pulls from every shard at once, so they share the queue depth
+    depth = max(1, jobs * JOB_QUEUE_DEPTH // len(groups))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        streams = [_pooled_scan(pool, query, paths, depth) for paths in groups]
+        yield from heapq.merge(*streams, key=stamp)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Query V4MinimalApp log files written by log_server.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Time values:
+  90s, 15m, 2h, 1d                  Relative to now
+  14:05, 14:05:30                   Time of day (today)
+  2026-02-05, "2026-02-05 14:05"    Absolute
+
+Examples:
+  %(prog)s /tmp/app_logs.txt --since 30m --level warning
+  %(prog)s /tmp/app_logs.txt --since 14:00 --until 14:05 -c GeminiService -c CameraManager
+  %(prog)s /tmp/app_logs.txt --since 1d --grep "429|timeout" -j 4
+  %(prog)s /tmp/app_logs.txt --template "Gemini.*<Error>|429"  # Fast on .lta archives
+  %(prog)s --screenshots-near "2026-02-05 14:05:03.120" -n 5
+  %(prog)s --session-dir /tmp/sessions --since 10m     # All devices, merged
+  %(prog)s /tmp/sessions/iPhone-lab3.txt --level error  # One device's sessions
+        """
+    )
+    parser.add_argument('base', type=str, nargs='?',
+                        help='The --output path given to log_server.py (e.g. /tmp/app_logs.txt)')
+    parser.add_argument('--session-dir', type=str, default=None, metavar='DIR',
+                        help='Merge the per-connection files from log_server.py --session-dir')
+    parser.add_argument('-d', '--device', type=str, action='append', default=None,
+                        help='With --session-dir, only this device (repeatable)')
+    parser.add_argument('--since', type=parse_time_arg, default=None,
+                        help='Only lines at or after this time')
+    parser.add_argument('--until', type=parse_time_arg, default=None,
+                        help='Only lines at or before this time')
+    parser.add_argument('-l', '--level', type=str.lower, choices=list(LEVEL_RANKS), default=None,
+                        help='Minimum level to show')
+    parser.add_argument('-c', '--category', action='append', default=None,
+                        help='Only this category (repeatable)')
+    parser.add_argument('-g', '--grep', type=str, default=None,
+                        help='Regex the whole line must match')
+    parser.add_argument('-t', '--template', type=str, default=None, metavar='REGEX',
+                        help='Regex the message template must match (numbers and ids shown as <*>, '
+                             'as listed by log_archive.py templates)')
+    parser.add_argument('-i', '--ignore-case', action='store_true',
+                        help='Case-insensitive --grep and --template')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Scan files in N worker processes (default: 1)')
+    parser.add_argument('--no-color', action='store_true',
+                        help='Disable colors even on a terminal')
+    parser.add_argument('--list-files', action='store_true',
+                        help='Only print the files that would be scanned')
+    parser.add_argument('--screenshots-near', type=parse_time_arg, default=None, metavar='TIME',
+                        help='Instead of logs, list the screenshots received closest to TIME')
+    parser.add_argument('--screenshot-dir', type=str, default='/tmp/app_screenshots',
+                        help='Screenshot directory for --screenshots-near (default: /tmp/app_screenshots)')
+    parser.add_argument('-n', '--count', type=int, default=3,
+                        help='How many screenshots --screenshots-near returns (default: 3)')
+
+    args = parser.parse_args()
+
+    if args.screenshots_near:
+        try:
+            print_screenshots_near(args.screenshot_dir, args.screenshots_near, args.count)
+        except FileNotFoundError:
+            print(f"{Colors.RED}Error: no screenshot manifest in {args.screenshot_dir}{Colors.RESET}",
+                  file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if not args.base and not args.session_dir:
+        parser.error("the log file base path (or --session-dir) is required")
+
+    for option, pattern in (('--grep', args.grep), ('--template', args.template)):
+        try:
+            if pattern:
+                re.compile(pattern)
+        except re.error as e:
+            parser.error(f"invalid {option} regex: {e}")
+
+    if args.session_dir:
+        # Each session file is one connection, so they may overlap: merge them all
+        shards = [[entry] for entry in discover_session_files(args.session_dir, args.device)]
+        where = args.session_dir
+    else:
+        # The base itself, plus one group per --workers shard
+        shards = [discover_log_files(base) for base in [args.base, *discover_shards(args.base)]]
+        shards = [files for files in shards if files]
+        where = args.base
+    if not shards:
+        print(f"{Colors.RED}Error: no log files found for {where}{Colors.RESET}", file=sys.stderr)
+        sys.exit(1)
+
+    groups = [select_files(files, args.since, args.until) for files in shards]
+    groups = [group for group in groups if group]
+    paths = [path for group in groups for path in group]
+    files = [entry for files in shards for entry in files]
+    if args.list_files:
+        for path in paths:
+            print(path)
+        return
+
+    query = LogQuery(args.since, args.until, args.level, args.category,
+                     args.grep, args.ignore_case, args.template)
+    color = sys.stdout.isatty() and not args.no_color
+
+    count = 0
+    try:
+        if len(groups) > 1:
+            results = run_merged_query(query, groups, args.jobs)
+        else:
+            results = run_query(query, paths, args.jobs)
+        for level, line in results:
+            sys.stdout.write((colorize_log(line, level) if color else line) + '\n')
+            count += 1
+    except (BrokenPipeError, KeyboardInterrupt):
+        sys.stderr.close()
+        return
+
+    print(f"{count} lines from {len(paths)} of {len(files)} files", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@ Example:
     python3 log_server.py -o /tmp/app_logs.txt              # Rotate every 15 min (default)
     python3 log_server.py -o /tmp/app_logs.txt --rotate 30   # Rotate every 30 min
     python3 log_server.py -o /tmp/app_logs.txt --rotate 0    # No rotation (single file)
+    python3 log_server.py -o /tmp/app_logs.txt --rotate-mb 100  # Also rotate at 100 MB
 """
 
 import socket
@@ -23,7 +24,36 @@ import os
 import signal
 import threading
 import struct
+import gzip
+import queue
+import re
+import shutil
+import time
+import io
+import zlib
+import collections
+import glob
+import hashlib
+import json
+import importlib
+import mmap
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from log_archive import ARCHIVE_SUFFIX, TEMPLATE_MASK, ArchiveLineStream, pack_stream
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 # ANSI colors for terminal output
 class Colors:
@@ -56,6 +86,9 @@ LEVEL_SYMBOLS = {
     'fault': 'F',
 }
 
+# Severity order, lowest first (used for "level >= X" filters)
+LEVEL_RANKS = {level: rank for rank, level in enumerate(LEVEL_COLORS)}
+
 
 def get_local_ip():
     """Get the Mac's local IP address for display."""
@@ -70,11 +103,8 @@ def get_local_ip():
         return "127.0.0.1"
 
 
-def format_unified_log(message: str, timestamp: datetime.datetime = None) -> str:
-    """Format a log message in Apple unified log style."""
-    if timestamp is None:
-        timestamp = datetime.datetime.now()
-
+def parse_unified_log(message: str):
+    """Split an incoming message into (level, category, text)."""
     # Parse the incoming message to extract level and category if present
     # Expected format from iOS: "[LEVEL] [Category] message" or just "message"
     level = 'info'
@@ -101,13 +131,26 @@ def format_unified_log(message: str, timestamp: datetime.datetime = None) -> str
                 category = parts[0][1:]
                 text = '] '.join(parts[1:])
 
+    return level, category, text
+
+
+def build_log_line(level: str, category: str, text: str,
+                   timestamp: datetime.datetime = None) -> str:
+    """Render parsed fields as one unified-log-style line."""
+    if timestamp is None:
+        timestamp = datetime.datetime.now()
+
     # Format timestamp like unified log
     ts_str = timestamp.strftime('%Y-%m-%d %H:%M:%S.') + f'{timestamp.microsecond // 1000:03d}'
 
     # Build the log line (unified log style)
-    log_line = f"{ts_str} V4MinimalApp <{level.capitalize()}> [{category}] {text}"
+    return f"{ts_str} V4MinimalApp <{level.capitalize()}> [{category}] {text}"
 
-    return log_line, level
+
+def format_unified_log(message: str, timestamp: datetime.datetime = None) -> str:
+    """Format a log message in Apple unified log style."""
+    level, category, text = parse_unified_log(message)
+    return build_log_line(level, category, text, timestamp), level
 
 
 def colorize_log(log_line: str, level: str) -> str:
@@ -116,27 +159,656 @@ def colorize_log(log_line: str, level: str) -> str:
     return f"{color}{log_line}{Colors.RESET}"
 
 
+# Suffix appended to a rotated log file once it has been compressed
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    # Template archive (log_archive.py): lines as template id + parameters
+    'template': ARCHIVE_SUFFIX,
+}
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def log_compression(path: str):
+    """Return the codec a log file is compressed with, or None."""
+    for codec, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return codec
+    return None
+
+
+def open_log_for_read(path: str):
+    """Open a (possibly compressed) log file for streaming binary reads."""
+    codec = log_compression(path)
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed but the zstandard module is not installed")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.BufferedReader(reader, COPY_CHUNK_BYTES)
+    if codec == 'template':
+        return ArchiveLineStream(path)
+    return open(path, 'rb')
+
+
+def discover_log_files(base: str):
+    """
+    Find the log files belonging to an --output base path.
+
+    Returns [(path, start_datetime_or_None)] in time order. Rotated files
+    (<root>_YYYYMMDD_HHMMSS<ext>, optionally compressed) come first, ordered
+    by their name stamp; an unrotated base file (a real file, not the
+    convenience symlink) is appended last with an unknown start.
+    """
+    root, ext = os.path.splitext(base)
+    suffixes = '|'.join(re.escape(s) for s in COMPRESSION_SUFFIXES.values())
+    name_re = re.compile(re.escape(os.path.basename(root)) + r'_(\d{8}_\d{6})'
+                         + re.escape(ext) + f'({suffixes})?$')
+
+    by_stamp = {}
+    for path in glob.glob(f"{glob.escape(root)}_*"):
+        match = name_re.match(os.path.basename(path))
+        if not match or os.path.islink(path):
+            continue
+        try:
+            stamp = datetime.datetime.strptime(match.group(1), '%Y%m%d_%H%M%S')
+        except ValueError:
+            continue
+        # Mid-compression both copies exist; the uncompressed one is complete
+        if stamp in by_stamp and log_compression(path):
+            continue
+        by_stamp[stamp] = path
+
+    files = [(by_stamp[stamp], stamp) for stamp in sorted(by_stamp)]
+    if os.path.isfile(base) and not os.path.islink(base):
+        files.append((base, None))
+    return files
+
+
+def shard_output_path(base: str, index: int) -> str:
+    """Output path of one --workers shard, e.g. /tmp/app_logs.txt -> /tmp/app_logs.w0.txt."""
+    root, ext = os.path.splitext(base)
+    return f"{root}.w{index}{ext}"
+
+
+def discover_shards(base: str):
+    """Output paths of the --workers shards that have files for base, in worker order."""
+    root, ext = os.path.splitext(base)
+    shard_re = re.compile(re.escape(os.path.basename(root)) + r'\.w(\d+)(?:_|' + re.escape(ext) + '$)')
+    indexes = set()
+    for path in glob.glob(f"{glob.escape(root)}.w*"):
+        match = shard_re.match(os.path.basename(path))
+        if match:
+            indexes.add(int(match.group(1)))
+    return [shard_output_path(base, index) for index in sorted(indexes)]
+
+
+def compress_log_file(path: str, codec: str) -> str:
+    """Compress a closed log file next to itself and remove the original."""
+    target = path + COMPRESSION_SUFFIXES[codec]
+    tmp_path = target + '.tmp'
+    stat = os.stat(path)
+
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        if codec == 'zstd':
+            zstandard.ZstdCompressor(level=3).copy_stream(src, dst, read_size=COPY_CHUNK_BYTES)
+        elif codec == 'template':
+            pack_stream(src, dst)
+        else:
+            with gzip.GzipFile(filename=os.path.basename(path), mode='wb', fileobj=dst,
+                               compresslevel=6) as gz:
+                shutil.copyfileobj(src, gz, COPY_CHUNK_BYTES)
+
+    # Keep the original mtime so age-based retention still sees when it was written
+    os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+    os.replace(tmp_path, target)
+    os.remove(path)
+    return target
+
+
+class LogArchiver:
+    """
+    Compresses rotated log files and enforces retention on a background thread.
+
+    The writer only hands over the path of a file it has already closed, so
+    compression and deletion never block logging.
+    """
+
+    def __init__(self, base_path: str, compression: str = None, max_total_bytes: int = 0,
+                 max_age_seconds: int = 0, quiet: bool = False):
+        self.base_path = base_path
+        self.compression = compression
+        self.max_total_bytes = max_total_bytes
+        self.max_age_seconds = max_age_seconds
+        self.quiet = quiet
+        self.active_path = None
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def start(self, active_path: str):
+        """Start the worker and queue rotated files left over from earlier runs."""
+        self.active_path = active_path
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+        for path, stamp in discover_log_files(self.base_path):
+            if stamp is not None and path != active_path and not log_compression(path):
+                self.jobs.put(path)
+        self.jobs.put('')  # retention pass even if nothing needs compressing
+
+    def submit(self, closed_path: str, active_path: str):
+        """Hand over a file the writer has just rotated away from."""
+        self.active_path = active_path
+        self.jobs.put(closed_path)
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def _run(self):
+        while True:
+            path = self.jobs.get()
+            if path is None:
+                return
+            try:
+                if path and self.compression and os.path.exists(path):
+                    target = compress_log_file(path, self.compression)
+                    if not self.quiet:
+                        print(f"{Colors.GRAY}Compressed {path} -> {target}{Colors.RESET}")
+                self._enforce_retention()
+            except Exception as e:
+                print(f"{Colors.RED}Log archiver error on {path}: {e}{Colors.RESET}")
+
+    def _enforce_retention(self):
+        """Delete the oldest rotated files beyond the age and total size limits."""
+        if not self.max_total_bytes and not self.max_age_seconds:
+            return
+
+        rotated = []
+        for path, stamp in discover_log_files(self.base_path):
+            if stamp is None or path == self.active_path:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rotated.append((path, st.st_size, st.st_mtime))
+
+        now = time.time()
+        total = sum(size for _, size, _ in rotated)
+        for path, size, mtime in rotated:  # oldest first
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            oversize = self.max_total_bytes and total > self.max_total_bytes
+            if not expired and not oversize:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                if not self.quiet:
+                    print(f"{Colors.GRAY}Retention removed {path}{Colors.RESET}")
+            except OSError:
+                continue
+            try:
+                os.remove(aggregate_dump_path(path))
+            except OSError:
+                pass
+
+
+def write_file_atomic(filepath: str, data):
+    """Write data to a .part file and rename it into place."""
+    tmp_path = filepath + '.part'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ThroughputStats:
+    """Frame and byte counters with a resettable rate window."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.window_start = time.monotonic()
+        self.window_frames = 0
+        self.window_bytes = 0
+
+    def add(self, nbytes: int):
+        self.frames += 1
+        self.bytes += nbytes
+        self.window_frames += 1
+        self.window_bytes += nbytes
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.window_start
+
+    def take_rates(self):
+        """Return (frames/s, MB/s) since the last call and start a new window."""
+        elapsed = max(self.elapsed(), 1e-6)
+        rates = (self.window_frames / elapsed, self.window_bytes / elapsed / (1024 * 1024))
+        self.window_start = time.monotonic()
+        self.window_frames = 0
+        self.window_bytes = 0
+        return rates
+
+
+def perceptual_hash(data) -> int:
+    """
+    64-bit difference hash (dHash) of an image, or None if it can't be computed.
+
+    JPEG draft mode decodes straight to a tiny grayscale image from the DCT
+    coefficients, so this costs a fraction of a full decode. Needs Pillow.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft('L', (64, 64))
+            pixels = list(img.convert('L').resize((9, 8)).getdata())
+    except Exception:
+        return None
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            i = row * 9 + col
+            bits = (bits << 1) | (pixels[i] > pixels[i + 1])
+    return bits
+
+
+# --dedup modes for ScreenshotStore
+DEDUP_MODES = ('off', 'exact', 'perceptual')
+
+# --screenshot-layout: one flat directory, or YYYYMMDD/HH shards by receive time
+SCREENSHOT_LAYOUTS = ('flat', 'hour')
+
+
+class ScreenshotStore:
+    """
+    Saves screenshots and records every received frame in manifest.jsonl.
+
+    The manifest is append-only, one JSON object per line, with "received"
+    (server clock, same format as log line stamps) as the first key. Entries
+    are appended under a lock, so "received" never goes backwards and readers
+    can binary-search the file to correlate screenshots with log lines.
+
+    With deduplication on, a frame whose SHA-256 matches an earlier one is not
+    written again; its manifest entry points at the stored copy instead. In
+    perceptual mode, a frame within phash_threshold bits of the same client's
+    previous stored frame (an idle screen with a blinking cursor, say) is
+    treated the same way.
+
+    Paths in the manifest are relative to output_dir. With the hour layout,
+    frames go into YYYYMMDD/HH shard directories so ScreenshotSweeper can
+    expire a whole hour with one directory removal. client_cap_bytes limits
+    how much each client may store per hour; frames over the cap are drained
+    from the socket and recorded as skipped.
+    """
+
+    MANIFEST_NAME = 'manifest.jsonl'
+
+    def __init__(self, output_dir: str, dedup: str = 'off', phash_threshold: int = 4,
+                 layout: str = 'flat', client_cap_bytes: int = 0):
+        self.output_dir = output_dir
+        self.dedup = dedup
+        self.phash_threshold = phash_threshold
+        self.layout = layout
+        self.client_cap_bytes = client_cap_bytes
+        self.lock = threading.Lock()
+        self.by_digest = {}      # sha256 -> stored path
+        self.last_stored = {}    # client -> (phash, stored path)
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.current_shard = None
+        self.client_bytes = collections.Counter()  # client -> bytes this hour
+        self.client_bytes_hour = None
+        self.skipped = 0
+
+        self.manifest_path = os.path.join(output_dir, self.MANIFEST_NAME)
+        if dedup != 'off':
+            self._load_manifest()
+        self.manifest = open(self.manifest_path, 'a', buffering=1)
+
+    def _load_manifest(self):
+        """Rebuild the digest index from a previous run's manifest."""
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                if entry.get('duplicate_of') is None and entry.get('sha256') and entry.get('path'):
+                    if os.path.exists(os.path.join(self.output_dir, entry['path'])):
+                        self.by_digest[entry['sha256']] = entry['path']
+
+    def path_for(self, filename: str) -> str:
+        """Full path a new frame should be written to under the current layout."""
+        if self.layout != 'hour':
+            return os.path.join(self.output_dir, filename)
+
+        now = datetime.datetime.now()
+        shard = os.path.join(now.strftime('%Y%m%d'), now.strftime('%H'))
+        if shard != self.current_shard:
+            os.makedirs(os.path.join(self.output_dir, shard), exist_ok=True)
+            self.current_shard = shard
+        return os.path.join(self.output_dir, shard, filename)
+
+    def admit(self, client: str, size: int) -> bool:
+        """Charge size to the client's hourly cap; False if it would exceed it."""
+        if not self.client_cap_bytes:
+            return True
+        hour = datetime.datetime.now().strftime('%Y%m%d%H')
+        with self.lock:
+            if hour != self.client_bytes_hour:
+                self.client_bytes.clear()
+                self.client_bytes_hour = hour
+            if self.client_bytes[client] + size > self.client_cap_bytes:
+                return False
+            self.client_bytes[client] += size
+            return True
+
+    def record_skipped(self, timestamp: str, client: str, size: int, reason: str):
+        """Note a frame that was received but deliberately not stored."""
+        with self.lock:
+            self.skipped += 1
+            self._append_entry({'ts': timestamp, 'client': client, 'size': size,
+                                'sha256': None, 'path': None, 'duplicate_of': None,
+                                'skipped': reason})
+
+    def forget_shard(self, shard: str):
+        """Drop index entries for files in a shard the sweeper just removed."""
+        prefix = shard + os.sep
+        with self.lock:
+            for digest in [d for d, path in self.by_digest.items() if path.startswith(prefix)]:
+                del self.by_digest[digest]
+            for client in [c for c, (_, path) in self.last_stored.items() if path.startswith(prefix)]:
+                del self.last_stored[client]
+
+    def _find_duplicate(self, digest: str, phash, client: str):
+        """Return (stored filename, distance) if this frame is already stored."""
+        if self.dedup == 'off':
+            return None, None
+        if digest in self.by_digest:
+            return self.by_digest[digest], 0
+        if phash is not None and client in self.last_stored:
+            last_phash, last_path = self.last_stored[client]
+            if last_phash is not None:
+                distance = bin(phash ^ last_phash).count('1')
+                if distance <= self.phash_threshold:
+                    return last_path, distance
+        return None, None
+
+    def _record(self, filename, timestamp, client, size, digest, duplicate_of, distance, phash):
+        """Update indexes and append the manifest entry. Caller holds self.lock."""
+        if duplicate_of is None:
+            if self.dedup != 'off':
+                self.by_digest.setdefault(digest, filename)
+            self.last_stored[client] = (phash, filename)
+        else:
+            self.duplicates += 1
+            self.bytes_saved += size
+
+        entry = {'ts': timestamp, 'client': client, 'size': size, 'sha256': digest,
+                 'path': duplicate_of or filename, 'duplicate_of': duplicate_of}
+        if distance:
+            entry['phash_distance'] = distance
+        self._append_entry(entry)
+
+    def _append_entry(self, entry: dict):
+        """Stamp and append one manifest line. Caller holds self.lock."""
+        received = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+        self.manifest.write(json.dumps({'received': received, **entry}) + '\n')
+
+    def save(self, filepath: str, data, timestamp: str, client: str):
+        """Persist one in-memory frame, or just reference it if it's a duplicate."""
+        digest = hashlib.sha256(data).hexdigest()
+        phash = perceptual_hash(data) if self.dedup == 'perceptual' else None
+        filename = os.path.relpath(filepath, self.output_dir)
+
+        with self.lock:
+            duplicate_of, distance = self._find_duplicate(digest, phash, client)
+            if duplicate_of is None and self.dedup != 'off':
+                # Claim the digest before writing so a concurrent twin dedups against us
+                self.by_digest[digest] = filename
+
+        if duplicate_of is None:
+            write_file_atomic(filepath, data)
+
+        with self.lock:
+            self._record(filename, timestamp, client, len(data), digest,
+                         duplicate_of, distance, phash)
+
+    def add_streamed(self, filepath: str, digest: str, size: int, timestamp: str, client: str):
+        """Register a frame that was streamed to disk; drop it if it's a duplicate."""
+        filename = os.path.relpath(filepath, self.output_dir)
+        with self.lock:
+            duplicate_of, distance = self._find_duplicate(digest, None, client)
+            if duplicate_of is not None and duplicate_of != filename:
+                try:
+                    os.remove(filepath)
+                except OSError:
+                    pass
+            else:
+                duplicate_of = None
+            self._record(filename, timestamp, client, size, digest, duplicate_of, distance, None)
+
+    def close(self):
+        with self.lock:
+            self.manifest.close()
+
+
+class ScreenshotSweeper:
+    """
+    Enforces screenshot retention for the hour layout on a background thread.
+
+    Whole YYYYMMDD/HH shards are removed, oldest first, once they are older
+    than max_age_seconds or the total exceeds max_total_bytes. The shard
+    currently being written is never removed. Sizes of closed shards are
+    cached, since nothing is added to them anymore.
+    """
+
+    def __init__(self, store: ScreenshotStore, max_total_bytes: int = 0,
+                 max_age_seconds: int = 0, interval: float = 60.0, quiet: bool = False):
+        self.store = store
+        self.max_total_bytes = max_total_bytes
+        self.max_age_seconds = max_age_seconds
+        self.interval = interval
+        self.quiet = quiet
+        self.sizes = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"{Colors.RED}Screenshot sweeper error: {e}{Colors.RESET}")
+
+    def _shards(self):
+        """Return [(shard, start_datetime)] oldest first."""
+        shards = []
+        root = self.store.output_dir
+        for day in sorted(os.listdir(root)):
+            if not re.fullmatch(r'\d{8}', day) or not os.path.isdir(os.path.join(root, day)):
+                continue
+            for hour in sorted(os.listdir(os.path.join(root, day))):
+                if not re.fullmatch(r'\d\d', hour):
+                    continue
+                try:
+                    start = datetime.datetime.strptime(day + hour, '%Y%m%d%H')
+                except ValueError:
+                    continue
+                shards.append((os.path.join(day, hour), start))
+        return shards
+
+    def _shard_size(self, shard: str, is_current: bool) -> int:
+        if not is_current and shard in self.sizes:
+            return self.sizes[shard]
+        total = 0
+        with os.scandir(os.path.join(self.store.output_dir, shard)) as entries:
+            for entry in entries:
+                try:
+                    total += entry.stat().st_size
+                except OSError:
+                    pass
+        if not is_current:
+            self.sizes[shard] = total
+        return total
+
+    def sweep(self):
+        """Remove expired shards, then the oldest ones beyond the size limit."""
+        current = self.store.current_shard
+        shards = [(shard, start) for shard, start in self._shards() if shard != current]
+        sizes = {shard: self._shard_size(shard, False) for shard, _ in shards}
+        total = sum(sizes.values())
+        if current and os.path.isdir(os.path.join(self.store.output_dir, current)):
+            total += self._shard_size(current, True)
+
+        now = datetime.datetime.now()
+        for shard, start in shards:
+            shard_end = start + datetime.timedelta(hours=1)
+            expired = self.max_age_seconds and (now - shard_end).total_seconds() > self.max_age_seconds
+            oversize = self.max_total_bytes and total > self.max_total_bytes
+            if not expired and not oversize:
+                continue
+            self._remove_shard(shard)
+            total -= sizes[shard]
+
+    def _remove_shard(self, shard: str):
+        self.store.forget_shard(shard)
+        path = os.path.join(self.store.output_dir, shard)
+        shutil.rmtree(path, ignore_errors=True)
+        self.sizes.pop(shard, None)
+        try:
+            os.rmdir(os.path.dirname(path))  # the day directory, once empty
+        except OSError:
+            pass
+        if not self.quiet:
+            print(f"{Colors.GRAY}Screenshot retention removed {path}{Colors.RESET}")
+
+
+class ScreenshotWriterPool:
+    """
+    Worker threads that persist received frames off the socket threads.
+
+    Receivers reserve a frame's size against a shared in-flight byte budget
+    before reading it, so memory stays bounded: when disks fall behind, only
+    then does a receiver wait (and TCP pushes back on the device).
+    """
+
+    def __init__(self, store: ScreenshotStore, workers: int = 2,
+                 max_inflight_bytes: int = 64 * 1024 * 1024):
+        self.store = store
+        self.max_inflight_bytes = max_inflight_bytes
+        self.inflight_bytes = 0
+        self.cond = threading.Condition()
+        self.jobs = queue.Queue()
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def reserve(self, nbytes: int):
+        """Block until nbytes fit in the in-flight budget, then claim them."""
+        with self.cond:
+            while self.inflight_bytes and self.inflight_bytes + nbytes > self.max_inflight_bytes:
+                self.cond.wait()
+            self.inflight_bytes += nbytes
+
+    def release(self, nbytes: int):
+        with self.cond:
+            self.inflight_bytes -= nbytes
+            self.cond.notify_all()
+
+    def submit(self, filepath: str, data, timestamp: str, client: str):
+        """Queue a frame (already reserved) for writing."""
+        self.jobs.put((filepath, data, timestamp, client))
+
+    def queue_depth(self) -> int:
+        return self.jobs.qsize()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            filepath, data, timestamp, client = job
+            try:
+                self.store.save(filepath, data, timestamp, client)
+            except Exception as e:
+                print(f"{Colors.RED}Screenshot write failed for {filepath}: {e}{Colors.RESET}")
+            finally:
+                self.release(len(data))
+
+    def stop(self, timeout: float = 5.0):
+        """Finish queued writes (up to timeout) and stop the workers."""
+        for _ in self.threads:
+            self.jobs.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+
 class ScreenshotServer:
     """Handles incoming screenshots on a separate port."""
 
-    def __init__(self, port: int, output_dir: str, quiet: bool = False):
+    RECV_CHUNK_BYTES = 256 * 1024
+    MAX_TIMESTAMP_BYTES = 1024
+    MAX_IMAGE_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, port: int, output_dir: str, quiet: bool = False,
+                 writers: int = 2, max_inflight_bytes: int = 64 * 1024 * 1024,
+                 stats_interval: float = 10.0, dedup: str = 'off', phash_threshold: int = 4,
+                 layout: str = 'flat', retain_bytes: int = 0, retain_seconds: int = 0,
+                 client_cap_bytes: int = 0, max_image_bytes: int = MAX_IMAGE_BYTES):
         self.port = port
         self.output_dir = output_dir
+        self.max_image_bytes = max_image_bytes
         self.quiet = quiet
         self.running = False
         self.server_socket = None
         self.clients = []
         self.lock = threading.Lock()
         self.screenshot_count = 0
+        self.stats_interval = stats_interval
+        self.total_stats = ThroughputStats()
 
         # Create output directory
         Path(output_dir).mkdir(parents=True, exist_ok=True)
 
+        self.store = ScreenshotStore(output_dir, dedup, phash_threshold, layout, client_cap_bytes)
+        self.writer = ScreenshotWriterPool(self.store, writers, max_inflight_bytes)
+        self.sweeper = None
+        if layout == 'hour' and (retain_bytes or retain_seconds):
+            self.sweeper = ScreenshotSweeper(self.store, retain_bytes, retain_seconds, quiet=quiet)
+
     def handle_client(self, client_socket, addr):
         """Handle a single screenshot client connection."""
         if not self.quiet:
             print(f"{Colors.MAGENTA}Screenshot client connected: {addr[0]}:{addr[1]}{Colors.RESET}")
 
+        client = f"{addr[0]}:{addr[1]}"
+        stats = ThroughputStats()
         try:
             while self.running:
                 try:
@@ -151,6 +823,8 @@ class ScreenshotServer:
                     if not ts_len_data:
                         break
                     ts_len = struct.unpack('>Q', ts_len_data)[0]
+                    if ts_len > self.MAX_TIMESTAMP_BYTES:
+                        raise ValueError(f"bad timestamp length {ts_len} (stream out of sync?)")
 
                     # Read timestamp
                     ts_data = self._recv_exact(client_socket, ts_len)
@@ -163,26 +837,12 @@ class ScreenshotServer:
                     if not img_len_data:
                         break
                     img_len = struct.unpack('>Q', img_len_data)[0]
+                    if img_len > self.max_image_bytes:
+                        raise ValueError(f"image of {img_len} bytes exceeds --screenshot-max-mb")
 
-                    # Read image data
-                    img_data = self._recv_exact(client_socket, img_len)
-                    if not img_data:
+                    if self.receive_image(client_socket, timestamp, img_len, addr, stats) is None:
                         break
 
-                    # Save the screenshot
-                    safe_ts = timestamp.replace(':', '-').replace(' ', '_').replace('.', '-')
-                    filename = f"screenshot_{safe_ts}.jpg"
-                    filepath = os.path.join(self.output_dir, filename)
-
-                    with open(filepath, 'wb') as f:
-                        f.write(img_data)
-
-                    self.screenshot_count += 1
-
-                    if not self.quiet:
-                        size_kb = len(img_data) / 1024
-                        print(f"{Colors.MAGENTA}[Screenshot #{self.screenshot_count}] {filename} ({size_kb:.1f} KB){Colors.RESET}")
-
                 except socket.timeout:
                     continue
                 except Exception as e:
@@ -195,24 +855,158 @@ class ScreenshotServer:
             with self.lock:
                 if client_socket in self.clients:
                     self.clients.remove(client_socket)
+            if stats.window_frames:
+                self._report_stats(addr, stats)
             if not self.quiet:
                 print(f"{Colors.YELLOW}Screenshot client disconnected: {addr[0]}:{addr[1]}{Colors.RESET}")
 
-    def _recv_exact(self, sock, n):
-        """Receive exactly n bytes from socket."""
-        data = b''
-        while len(data) < n:
+    def receive_image(self, sock, timestamp: str, img_len: int, addr, stats: ThroughputStats,
+                      client: str = None):
+        """
+        Receive one image payload of img_len bytes from sock and persist it.
+
+        sock only needs recv_into(), so the multiplexed log connection can
+        hand over its own reader, and its label for the client (the HELLO
+        device, if any). Returns the file path the frame was saved to, '' if
+        it was deliberately not stored, or None if the connection ended
+        mid-frame.
+        """
+        client = client or f"{addr[0]}:{addr[1]}"
+        safe_ts = timestamp.replace(':', '-').replace(' ', '_').replace('.', '-')
+        filename = f"screenshot_{safe_ts}.jpg"
+        filepath = self.store.path_for(filename)
+
+        if not self.store.admit(client, img_len):
+            # Over this client's hourly cap: drain the frame, don't store it
+            if not self._recv_discard(sock, img_len):
+                return None
+            self.store.record_skipped(timestamp, client, img_len, 'client-cap')
+            return ''
+
+        if img_len <= self.writer.max_inflight_bytes:
+            # Receive into memory and let the writer pool persist it
+            self.writer.reserve(img_len)
             try:
-                chunk = sock.recv(n - len(data))
-                if not chunk:
-                    return None
-                data += chunk
+                img_data = self._recv_exact(sock, img_len)
+            except BaseException:
+                # A reset mid-frame must not leak the reservation
+                self.writer.release(img_len)
+                raise
+            if img_data is None:
+                self.writer.release(img_len)
+                return None
+            self.writer.submit(filepath, img_data, timestamp, client)
+        else:
+            # Larger than the whole budget: stream straight to disk
+            digest = hashlib.sha256()
+            if not self._recv_to_file(sock, img_len, filepath, digest):
+                return None
+            self.store.add_streamed(filepath, digest.hexdigest(), img_len, timestamp, client)
+
+        with self.lock:
+            self.screenshot_count += 1
+            self.total_stats.add(img_len)
+        stats.add(img_len)
+
+        if not self.quiet:
+            size_kb = img_len / 1024
+            print(f"{Colors.MAGENTA}[Screenshot #{self.screenshot_count}] {filename} ({size_kb:.1f} KB){Colors.RESET}")
+
+        if self.stats_interval > 0 and stats.elapsed() >= self.stats_interval:
+            self._report_stats(addr, stats)
+
+        return filepath
+
+    def _report_stats(self, addr, stats: ThroughputStats):
+        """Print one client's screenshot throughput since its last report."""
+        fps, mbps = stats.take_rates()
+        if self.quiet:
+            return
+        inflight_mb = self.writer.inflight_bytes / (1024 * 1024)
+        dedup = ''
+        if self.store.dedup != 'off':
+            dedup = (f", {self.store.duplicates} duplicates "
+                     f"({self.store.bytes_saved / (1024 * 1024):.1f} MB saved)")
+        print(f"{Colors.MAGENTA}[Screenshots {addr[0]}:{addr[1]}] {fps:.1f} frames/s, {mbps:.2f} MB/s, "
+              f"write queue {self.writer.queue_depth()} ({inflight_mb:.1f} MB in flight), "
+              f"{stats.frames} frames total{dedup}{Colors.RESET}")
+
+    def _recv_into(self, sock, view) -> bool:
+        """Fill a memoryview completely from the socket; False on disconnect/shutdown."""
+        got = 0
+        while got < len(view):
+            try:
+                count = sock.recv_into(view[got:])
+                if not count:
+                    return False
+                got += count
             except socket.timeout:
                 if not self.running:
-                    return None
+                    return False
                 continue
+        return True
+
+    def _recv_exact(self, sock, n):
+        """Receive exactly n bytes from socket."""
+        data = bytearray(n)
+        if not self._recv_into(sock, memoryview(data)):
+            return None
         return data
 
+    def _recv_discard(self, sock, n) -> bool:
+        """Read and throw away n bytes, keeping the stream in sync."""
+        chunk = memoryview(bytearray(min(n, self.RECV_CHUNK_BYTES)))
+        remaining = n
+        while remaining:
+            view = chunk[:min(remaining, len(chunk))]
+            if not self._recv_into(sock, view):
+                return False
+            remaining -= len(view)
+        return True
+
+    def _recv_to_file(self, sock, n, filepath, digest=None) -> bool:
+        """
+        Stream exactly n bytes from the socket into filepath.
+
+        Data goes through one reused chunk buffer into a .part file that is
+        atomically renamed once complete, so a full-resolution frame is never
+        held in memory and readers never see a truncated image.
+        """
+        tmp_path = filepath + '.part'
+        chunk = memoryview(bytearray(min(n, self.RECV_CHUNK_BYTES)))
+        complete = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                remaining = n
+                while remaining:
+                    view = chunk[:min(remaining, len(chunk))]
+                    if not self._recv_into(sock, view):
+                        return False
+                    f.write(view)
+                    if digest is not None:
+                        digest.update(view)
+                    remaining -= len(view)
+            os.replace(tmp_path, filepath)
+            complete = True
+            return True
+        finally:
+            if not complete:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def start(self):
+        """
+        Start taking frames (and retention) without a listener of its own.
+
+        run() calls this once bound; a --workers process calls it directly,
+        since its screenshots only arrive on framed log connections.
+        """
+        self.running = True
+        if self.sweeper:
+            self.sweeper.start()
+
     def run(self):
         """Run the screenshot server."""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -222,12 +1016,12 @@ class ScreenshotServer:
             self.server_socket.bind(('0.0.0.0', self.port))
             self.server_socket.listen(5)
             self.server_socket.settimeout(1.0)
+            self.port = self.server_socket.getsockname()[1]  # resolves port 0
         except OSError as e:
             print(f"{Colors.RED}Error: Could not bind screenshot server to port {self.port}: {e}{Colors.RESET}")
             return
 
-        self.running = True
-
+        self.start()
         while self.running:
             try:
                 client_socket, addr = self.server_socket.accept()
@@ -248,6 +1042,8 @@ class ScreenshotServer:
     def shutdown(self):
         """Shutdown the screenshot server."""
         self.running = False
+        if self.sweeper:
+            self.sweeper.stop()
 
         with self.lock:
             for client in self.clients:
@@ -263,57 +1059,1558 @@ class ScreenshotServer:
             except:
                 pass
 
+        # Flush frames still waiting in the writer pool
+        self.writer.stop()
+        self.store.close()
+
+
+# Framed protocol, optional on the log port. A connection whose first bytes
+# are FRAME_MAGIC carries typed frames instead of newline-terminated text, so
+# one connection per device can carry logs and screenshots in order. Each
+# frame is FRAME_HEADER (type, payload length) followed by the payload:
+#   MSG_LOG_LINE    one UTF-8 log line
+#   MSG_LOG_BATCH   UTF-8 log lines separated by "\n"
+#   MSG_SCREENSHOT  SCREENSHOT_HEADER (timestamp length), timestamp, JPEG bytes
+#   MSG_HEARTBEAT   empty; keeps idle connections alive
+#   MSG_LOG_BATCH_DEFLATE / MSG_LOG_BATCH_ZSTD
+#                   a MSG_LOG_BATCH payload, zlib- or zstd-compressed
+FRAME_MAGIC = b'\x00V4M'
+FRAME_HEADER = struct.Struct('>BI')
+SCREENSHOT_HEADER = struct.Struct('>H')
+MSG_LOG_LINE = 1
+MSG_LOG_BATCH = 2
+MSG_SCREENSHOT = 3
+MSG_HEARTBEAT = 4
+MSG_LOG_BATCH_DEFLATE = 5
+MSG_LOG_BATCH_ZSTD = 6
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+
+def decompress_batch(msg_type: int, payload) -> bytes:
+    """Inflate a compressed log batch, refusing output beyond MAX_FRAME_BYTES."""
+    if msg_type == MSG_LOG_BATCH_DEFLATE:
+        inflater = zlib.decompressobj()
+        data = inflater.decompress(payload, MAX_FRAME_BYTES)
+        if inflater.unconsumed_tail:
+            raise ValueError("compressed log batch expands beyond the frame limit")
+        return data
+    if zstandard is None:
+        raise ValueError("zstd log batch received but the zstandard module is not installed")
+    return zstandard.ZstdDecompressor().decompress(payload, max_output_size=MAX_FRAME_BYTES)
+
+
+class PrefixedSocket:
+    """Socket stand-in that replays bytes already read before reading more."""
+
+    def __init__(self, sock, pending: bytes):
+        self.sock = sock
+        self.pending = memoryview(bytes(pending))
+
+    def recv_into(self, view, nbytes: int = 0) -> int:
+        if self.pending:
+            count = min(nbytes or len(view), len(self.pending))
+            view[:count] = self.pending[:count]
+            self.pending = self.pending[count:]
+            return count
+        return self.sock.recv_into(view, nbytes)
+
+
+class TailFilter:
+    """
+    Server-side filter for a tail subscriber.
+
+    Parsed from the first line a subscriber sends, e.g.:
+        level=warning category=GeminiService,CameraManager history=200 grep=429|timeout
+    grep= takes the rest of the line so the regex may contain spaces.
+    """
+
+    def __init__(self, min_level: str = None, categories=None, pattern: str = None,
+                 history: int = 0, color: bool = False):
+        self.min_rank = LEVEL_RANKS[min_level] if min_level else None
+        self.categories = set(categories) if categories else None
+        self.regex = re.compile(pattern) if pattern else None
+        self.history = history
+        self.color = color
+
+    @classmethod
+    def parse(cls, spec: str):
+        """Build a filter from a spec line; raises ValueError on bad input."""
+        options = {}
+        spec = spec.strip()
+        while spec:
+            if spec.startswith('grep='):
+                options['grep'] = spec[len('grep='):]
+                break
+            token, _, spec = spec.partition(' ')
+            spec = spec.lstrip()
+            key, sep, value = token.partition('=')
+            if not sep:
+                raise ValueError(f"expected key=value, got {token!r}")
+            options[key] = value
+
+        unknown = set(options) - {'level', 'category', 'grep', 'history', 'color'}
+        if unknown:
+            raise ValueError(f"unknown option(s): {', '.join(sorted(unknown))}")
+
+        level = options.get('level', '').lower() or None
+        if level and level not in LEVEL_RANKS:
+            raise ValueError(f"unknown level {level!r}")
+        categories = [c for c in options.get('category', '').split(',') if c]
+        try:
+            pattern = options.get('grep') or None
+            return cls(level, categories, pattern, int(options.get('history', 0)),
+                       options.get('color', '0') not in ('0', 'false', 'no'))
+        except re.error as e:
+            raise ValueError(f"bad grep regex: {e}")
+
+    def matches(self, level: str, category: str, log_line: str) -> bool:
+        if self.min_rank is not None and LEVEL_RANKS.get(level, 0) < self.min_rank:
+            return False
+        if self.categories is not None and category not in self.categories:
+            return False
+        if self.regex is not None and not self.regex.search(log_line):
+            return False
+        return True
+
+
+class LogTailServer:
+    """
+    Live tail endpoint: viewers attach over TCP and receive filtered lines.
+
+    Ingestion only stores each line in a fixed-size ring buffer and wakes the
+    subscriber threads; filtering and sending happen on each subscriber's own
+    thread. A subscriber that falls more than a ring's worth behind skips
+    ahead and is told how many lines it missed, and one that stops reading
+    altogether is disconnected. Neither ever slows down ingestion.
+    """
+
+    FILTER_WAIT_SECONDS = 2.0
+    SEND_TIMEOUT_SECONDS = 5.0
+
+    def __init__(self, port: int, buffer_lines: int = 10000, quiet: bool = False):
+        self.port = port
+        self.capacity = buffer_lines
+        self.quiet = quiet
+        self.running = False
+        self.server_socket = None
+        self.clients = []
+        self.lock = threading.Lock()
+        # Ring buffer of (level, category, log_line); entry n lives at n % capacity
+        self.ring = [None] * buffer_lines
+        self.next_seq = 0
+        self.cond = threading.Condition()
+
+    def publish(self, level: str, category: str, log_line: str):
+        """Record a line for subscribers. O(1), never blocks on a subscriber."""
+        with self.cond:
+            self.ring[self.next_seq % self.capacity] = (level, category, log_line)
+            self.next_seq += 1
+            if self.clients:
+                self.cond.notify_all()
+
+    def _read_filter(self, client_socket):
+        """Read the optional filter line a subscriber sends right after connecting."""
+        client_socket.settimeout(self.FILTER_WAIT_SECONDS)
+        data = b''
+        try:
+            while b'\n' not in data and len(data) < 4096:
+                chunk = client_socket.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.timeout:
+            pass
+        return TailFilter.parse(data.split(b'\n', 1)[0].decode('utf-8', errors='replace'))
+
+    def handle_client(self, client_socket, addr):
+        """Stream matching lines to one subscriber until it disconnects or stalls."""
+        try:
+            try:
+                tail_filter = self._read_filter(client_socket)
+            except ValueError as e:
+                client_socket.sendall(f"error: {e}\n".encode('utf-8'))
+                return
+
+            if not self.quiet:
+                print(f"{Colors.BLUE}Tail subscriber connected: {addr[0]}:{addr[1]}{Colors.RESET}")
+            client_socket.settimeout(self.SEND_TIMEOUT_SECONDS)
+
+            with self.cond:
+                cursor = max(0, self.next_seq - min(tail_filter.history, self.capacity))
+
+            while self.running:
+                with self.cond:
+                    while self.running and cursor == self.next_seq:
+                        self.cond.wait(1.0)
+                    end = self.next_seq
+                    oldest = max(0, end - self.capacity)
+                    skipped = max(0, oldest - cursor)
+                    cursor = max(cursor, oldest)
+                    entries = [self.ring[seq % self.capacity] for seq in range(cursor, end)]
+                    cursor = end
+
+                out = []
+                if skipped:
+                    out.append(f"... {skipped:,} lines skipped (subscriber too slow)")
+                for level, category, log_line in entries:
+                    if tail_filter.matches(level, category, log_line):
+                        out.append(colorize_log(log_line, level) if tail_filter.color else log_line)
+                if out:
+                    client_socket.sendall(('\n'.join(out) + '\n').encode('utf-8'))
+
+        except (socket.timeout, OSError):
+            pass  # stalled or gone; dropping it is the point
+        finally:
+            client_socket.close()
+            with self.cond:
+                if client_socket in self.clients:
+                    self.clients.remove(client_socket)
+            if not self.quiet:
+                print(f"{Colors.YELLOW}Tail subscriber disconnected: {addr[0]}:{addr[1]}{Colors.RESET}")
+
+    def run(self):
+        """Accept tail subscribers."""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        try:
+            self.server_socket.bind(('0.0.0.0', self.port))
+            self.server_socket.listen(5)
+            self.server_socket.settimeout(1.0)
+        except OSError as e:
+            print(f"{Colors.RED}Error: Could not bind tail server to port {self.port}: {e}{Colors.RESET}")
+            return
+
+        self.running = True
+
+        while self.running:
+            try:
+                client_socket, addr = self.server_socket.accept()
+                with self.cond:
+                    self.clients.append(client_socket)
+
+                thread = threading.Thread(target=self.handle_client, args=(client_socket, addr))
+                thread.daemon = True
+                thread.start()
+
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"{Colors.RED}Tail server error: {e}{Colors.RESET}")
+
+    def shutdown(self):
+        """Shutdown the tail server."""
+        self.running = False
+
+        with self.cond:
+            self.cond.notify_all()
+            for client in self.clients:
+                try:
+                    client.close()
+                except:
+                    pass
+            self.clients.clear()
+
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+
+
+# What IngestQueue.put does when the queue is full
+QUEUE_POLICIES = ('block', 'drop-oldest', 'drop-debug')
+
+
+class WriteAheadRing:
+    """
+    mmap-backed ring of received records not yet known to be in the log file.
+
+    IngestQueue appends every record it accepts, under its own lock, so ring
+    order is queue order. The output thread commits up to the last record it
+    has written and flushed. The mapping lives in the page cache, so if the
+    process is killed, whatever was received but not yet written survives
+    in the ring file, and recover() returns it on the next start. A writer
+    that falls a whole ring behind makes the oldest uncommitted records get
+    overwritten.
+    """
+
+    MAGIC = b'V4MWAL2\0'
+    HEADER_BYTES = 64
+    # Header: magic, capacity, then logical byte offsets head, tail, committed
+    HEADER = struct.Struct('>8sQQQQ')
+    FIELD = struct.Struct('>Q')
+    HEAD_OFFSET, TAIL_OFFSET, COMMITTED_OFFSET = 16, 24, 32
+    # Record: body length, timestamp; body is the byte lengths of level,
+    # category and client, then those three and text. Length-prefixed, since
+    # category and text come from the client and may contain any character
+    RECORD = struct.Struct('>Id')
+    FIELD_LENGTHS = struct.Struct('>III')
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        self.file = open(path, 'w+b')
+        self.file.truncate(self.HEADER_BYTES + capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.HEADER_BYTES + capacity)
+        self.ring = memoryview(self.map)[self.HEADER_BYTES:]
+        self.head = self.tail = self.committed = 0
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, capacity, 0, 0, 0)
+
+    @classmethod
+    def recover(cls, path: str):
+        """Records left uncommitted in an existing ring file ([] if none)."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        if len(data) < cls.HEADER_BYTES:
+            return []
+        magic, capacity, head, tail, committed = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or len(data) != cls.HEADER_BYTES + capacity:
+            return []
+
+        ring = data[cls.HEADER_BYTES:]
+        records = []
+        pos = max(tail, committed)
+        while pos + cls.RECORD.size <= head:
+            length, timestamp = cls.RECORD.unpack(cls._read(ring, capacity, pos, cls.RECORD.size))
+            if pos + cls.RECORD.size + length > head:
+                break
+            body = cls._read(ring, capacity, pos + cls.RECORD.size, length)
+            fields = cls._split_body(body)
+            if fields is None:
+                break  # torn or corrupt; everything before it is still good
+            level, category, client, text = fields
+            records.append((datetime.datetime.fromtimestamp(timestamp), level, category, text, client))
+            pos += cls.RECORD.size + length
+        return records
+
+    @classmethod
+    def _split_body(cls, body: bytes):
+        """(level, category, client, text) from a record body, or None if malformed."""
+        if len(body) < cls.FIELD_LENGTHS.size:
+            return None
+        lengths = cls.FIELD_LENGTHS.unpack_from(body)
+        pos = cls.FIELD_LENGTHS.size
+        if pos + sum(lengths) > len(body):
+            return None
+        fields = []
+        for n in lengths:
+            fields.append(body[pos:pos + n].decode('utf-8', errors='replace'))
+            pos += n
+        fields.append(body[pos:].decode('utf-8', errors='replace'))
+        return fields
+
+    @staticmethod
+    def _read(ring, capacity: int, pos: int, n: int) -> bytes:
+        start = pos % capacity
+        if start + n <= capacity:
+            return bytes(ring[start:start + n])
+        return bytes(ring[start:]) + bytes(ring[:n - (capacity - start)])
+
+    def _write(self, pos: int, data: bytes):
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.ring[start:start + first] = data[:first]
+        if first < len(data):
+            self.ring[:len(data) - first] = data[first:]
+
+    def append(self, record) -> int:
+        """Copy one record into the ring; returns its end offset. Caller serializes."""
+        timestamp, level, category, text, client = record
+        level, category, client, text = (field.encode('utf-8', errors='replace')
+                                          for field in (level, category, client, text))
+        body = b''.join((self.FIELD_LENGTHS.pack(len(level), len(category), len(client)),
+                         level, category, client, text))
+        data = self.RECORD.pack(len(body), timestamp.timestamp()) + body
+        if len(data) > self.capacity:
+            return self.head  # bigger than the whole ring; not crash-safe
+
+        # The writer is a whole ring behind: give up the oldest records
+        while self.head + len(data) - self.tail > self.capacity:
+            length, _ = self.RECORD.unpack(self._read(self.ring, self.capacity, self.tail, self.RECORD.size))
+            self.tail += self.RECORD.size + length
+        self.FIELD.pack_into(self.map, self.TAIL_OFFSET, self.tail)
+
+        # Data first, then head: a kill in between just loses this record
+        self._write(self.head, data)
+        self.head += len(data)
+        self.FIELD.pack_into(self.map, self.HEAD_OFFSET, self.head)
+        return self.head
+
+    def commit(self, offset: int):
+        """Everything before offset is in the log file. Output thread only."""
+        if offset > self.committed:
+            self.committed = offset
+            self.FIELD.pack_into(self.map, self.COMMITTED_OFFSET, offset)
+
+    def close(self):
+        self.ring.release()
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+class IngestQueue:
+    """
+    Bounded queue between the socket threads and the output thread.
+
+    Records are (timestamp, level, category, text, client). When full:
+      block        put() waits for room (backpressure onto the device)
+      drop-oldest  the oldest queued record is discarded
+      drop-debug   the oldest queued debug record is discarded, or the
+                   incoming one if it is debug; falls back to drop-oldest
+    Debug and other records sit in separate deques tagged with a sequence
+    number, so the oldest debug record can be evicted in O(1) while get_batch
+    still returns everything in arrival order. Drops are counted per client.
+    With a WriteAheadRing, accepted records are also copied into it, and
+    last_wal_end is the ring offset just past the last record get_batch
+    returned.
+    """
+
+    def __init__(self, capacity: int = 50000, policy: str = 'drop-debug', wal=None):
+        self.capacity = capacity
+        self.policy = policy
+        self.wal = wal
+        self.last_wal_end = 0
+        self.debug = collections.deque()
+        self.other = collections.deque()
+        self.seq = 0
+        self.closed = False
+        self.dropped = collections.Counter()
+        self.dropped_total = 0
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.debug) + len(self.other)
+
+    def put(self, record) -> bool:
+        """Queue a record; returns False if it was dropped instead."""
+        is_debug = record[1] == 'debug'
+        with self.cond:
+            if len(self) >= self.capacity:
+                if self.policy == 'block':
+                    while len(self) >= self.capacity and not self.closed:
+                        self.cond.wait(1.0)
+                elif self.policy == 'drop-debug' and is_debug:
+                    self.dropped[record[4]] += 1
+                    self.dropped_total += 1
+                    return False
+                else:
+                    victims = self.debug if self.policy == 'drop-debug' and self.debug else None
+                    if victims is None:
+                        victims = self._oldest_deque()
+                    self.dropped[victims.popleft()[1][4]] += 1
+                    self.dropped_total += 1
+
+            if self.closed:
+                return False
+            wal = self.wal
+            wal_end = wal.append(record) if wal else 0
+            (self.debug if is_debug else self.other).append((self.seq, record, wal_end))
+            self.seq += 1
+            self.cond.notify_all()
+            return True
+
+    def _oldest_deque(self):
+        if not self.debug:
+            return self.other
+        if not self.other:
+            return self.debug
+        return self.debug if self.debug[0][0] < self.other[0][0] else self.other
+
+    def get_batch(self, max_records: int = 1000, timeout: float = 1.0):
+        """Wait for records and return up to max_records of them in arrival order."""
+        with self.cond:
+            if not len(self) and not self.closed:
+                self.cond.wait(timeout)
+            batch = []
+            while len(self) and len(batch) < max_records:
+                _, record, self.last_wal_end = self._oldest_deque().popleft()
+                batch.append(record)
+            if batch:
+                self.cond.notify_all()  # wake blocked producers
+            return batch
+
+    def take_dropped(self):
+        """Return and reset the per-client drop counters."""
+        with self.cond:
+            dropped, self.dropped = self.dropped, collections.Counter()
+            return dropped
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class IngestLimiter:
+    """
+    Per-category/level sampling and token-bucket rate limits on parsed records.
+
+    Applied by the socket threads right after parsing, so suppressed lines
+    never cost formatting, queueing or I/O. Rules are keyed by
+    "Category:level", "Category", "level" or "*"; the most specific matching
+    rule wins, and every category gets its own bucket (debug=200 lets each
+    category log 200 debug lines/s). Errors and faults always pass.
+    Suppressed lines are counted per (category, level) for the periodic report.
+    Past MAX_BUCKETS categories, new ones share an "(other)" bucket per rule.
+    """
+
+    ALWAYS_RANK = LEVEL_RANKS['error']
+    MAX_CACHED = 10000
+    MAX_BUCKETS = 1024  # per-category buckets (and suppression counters) before "(other)"
+
+    def __init__(self, limits=None, samples=None):
+        # key (category or None, level or None) -> lines/s, or fraction kept
+        self.limits = dict(limits or {})
+        self.samples = dict(samples or {})
+        self.rules = {}  # (category, level) -> (fraction, rate, bucket key)
+        self.buckets = {}  # bucket key -> [tokens, last refill]
+        self.suppressed = collections.Counter()
+        self.suppressed_total = 0
+        self.lock = threading.Lock()
+        self.random = random.Random()
+
+    @staticmethod
+    def parse_rule(spec: str, kind: str):
+        """Parse "KEY=VALUE" into ((category, level), value); raises ValueError."""
+        key, sep, value = spec.partition('=')
+        if not sep or not key:
+            raise ValueError(f"expected KEY=VALUE, got {spec!r}")
+        value = float(value.removesuffix('/s'))
+        if kind == 'sample' and not 0 <= value <= 1:
+            raise ValueError(f"sample fraction must be between 0 and 1, got {value:g}")
+        if kind == 'limit' and value < 0:
+            raise ValueError(f"rate must not be negative, got {value:g}")
+
+        category, _, level = key.rpartition(':')
+        if not category and key.lower() in LEVEL_RANKS:
+            category, level = None, key
+        elif not category:
+            category, level = key, None
+        if level is not None:
+            level = level.lower()
+            if level not in LEVEL_RANKS:
+                raise ValueError(f"unknown level {level!r}")
+        return (None if category == '*' else category, level), value
+
+    def _lookup(self, table, category: str, level: str):
+        for key in ((category, level), (category, None), (None, level), (None, None)):
+            if key in table:
+                return key, table[key]
+        return None, None
+
+    def _resolve(self, category: str, level: str):
+        """Find (fraction, rate, bucket key) for a category/level pair, cached."""
+        rule = self.rules.get((category, level))
+        if rule is None:
+            if len(self.rules) >= self.MAX_CACHED:
+                self.rules.clear()
+            _, fraction = self._lookup(self.samples, category, level)
+            key, rate = self._lookup(self.limits, category, level)
+            rule = (fraction, rate, (key, category))
+            self.rules[(category, level)] = rule
+        return rule
+
+    def admit(self, records):
+        """Return the records that pass, in order."""
+        kept = []
+        now = time.monotonic()
+        with self.lock:
+            for record in records:
+                level, category = record[1], record[2]
+                if LEVEL_RANKS.get(level, 0) >= self.ALWAYS_RANK:
+                    kept.append(record)
+                    continue
+                fraction, rate, bucket_key = self._resolve(category, level)
+                if fraction is not None and self.random.random() >= fraction:
+                    self._suppress(category, level)
+                    continue
+                if rate is not None:
+                    bucket = self.buckets.get(bucket_key)
+                    if bucket is None and len(self.buckets) >= self.MAX_BUCKETS:
+                        bucket_key = (bucket_key[0], '(other)')
+                        bucket = self.buckets.get(bucket_key)
+                    if bucket is None:
+                        # Start full: one second's worth of burst
+                        bucket = self.buckets[bucket_key] = [max(rate, 1.0), now]
+                    else:
+                        bucket[0] = min(max(rate, 1.0), bucket[0] + (now - bucket[1]) * rate)
+                        bucket[1] = now
+                    if bucket[0] < 1.0:
+                        self._suppress(category, level)
+                        continue
+                    bucket[0] -= 1.0
+                kept.append(record)
+        return kept
+
+    def _suppress(self, category: str, level: str):
+        if (category, level) not in self.suppressed and len(self.suppressed) >= self.MAX_BUCKETS:
+            category = '(other)'
+        self.suppressed[(category, level)] += 1
+        self.suppressed_total += 1
+
+    def take_suppressed(self):
+        """Return and reset the per-(category, level) suppression counters."""
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, collections.Counter()
+            return suppressed
+
+    def describe(self) -> str:
+        def key_name(key):
+            category, level = key
+            if category is None:
+                return level or '*'
+            return f"{category}:{level}" if level else category
+        rules = [f"{key_name(k)} {v:g}/s" for k, v in self.limits.items()]
+        rules += [f"{key_name(k)} sample {v:g}" for k, v in self.samples.items()]
+        return ', '.join(rules)
+
+
+def message_template(text: str) -> str:
+    """Mask the variable parts of a message, e.g. "took 12ms" -> "took <*>ms"."""
+    return TEMPLATE_MASK.sub('<*>', text)
+
+
+def aggregate_dump_path(log_path: str) -> str:
+    """Where the aggregates for a log file go, e.g. app_logs_20260205_195300.agg.json."""
+    for suffix in COMPRESSION_SUFFIXES.values():
+        log_path = log_path.removesuffix(suffix)
+    return os.path.splitext(log_path)[0] + '.agg.json'
+
+
+class HeavyHitters:
+    """
+    Misra-Gries frequent-items counter in fixed memory.
+
+    Keeps at most capacity keys. A new key arriving when full is offset
+    against the table instead: every counter, and the new key's n, drop by
+    the smallest count until the key fits or its n is used up. Any key
+    counted more than total / (capacity + 1) times is guaranteed to be kept,
+    and each count undercounts by at most the total of those decrements
+    (self.error). Adding a known key, or one that fits, is O(1); a miss on a
+    full table walks it, O(capacity), but each such pass removes at least
+    capacity + 1 from the total, so there are at most total / (capacity + 1).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def add(self, key, n: int = 1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+            return
+        while n > 0 and len(counts) >= self.capacity:
+            step = min(n, min(counts.values()))
+            self.error += step
+            n -= step
+            for k in list(counts):
+                if counts[k] <= step:
+                    del counts[k]
+                else:
+                    counts[k] -= step
+        if n > 0:
+            counts[key] = n
+
+
+class AggregateBucket:
+    """Counts for one time bucket: per (level, category), plus template heavy hitters."""
+
+    MAX_KEYS = 512  # distinct (level, category) pairs before folding into "(other)"
+
+    def __init__(self, index: int, top_capacity: int):
+        self.index = index
+        self.counts = collections.Counter()
+        self.templates = HeavyHitters(top_capacity)
+
+    def add(self, level: str, category: str, text: str):
+        key = (level, category)
+        if key not in self.counts and len(self.counts) >= self.MAX_KEYS:
+            key = (level, '(other)')
+        self.counts[key] += 1
+        self.templates.add((level, category, message_template(text)))
+
+
+class LogAggregates:
+    """
+    Rolling, fixed-memory aggregates of ingested lines.
+
+    Lines are counted into fixed-width time buckets (the last `buckets` of
+    them are kept): totals per level and category, the most frequent message
+    templates (numbers and ids masked, via HeavyHitters), and error rates
+    over trailing windows. Updated by the socket threads once per batch;
+    snapshot() serves /aggregates, and the writer dumps the buckets covering
+    each log file next to it when the file is rotated or closed.
+    """
+
+    ERROR_RANK = LEVEL_RANKS['error']
+    WINDOWS = (60, 300, 900)
+    BUCKET_TOP = 5  # templates listed per bucket in snapshots
+
+    def __init__(self, bucket_seconds: int = 60, buckets: int = 60, top: int = 50):
+        self.bucket_seconds = bucket_seconds
+        self.top = top
+        self.buckets = collections.deque(maxlen=buckets)
+        self.lock = threading.Lock()
+
+    def add(self, records):
+        """Count a batch of (timestamp, level, category, text, client) records."""
+        with self.lock:
+            stamp = bucket = None
+            for timestamp, level, category, text, _ in records:
+                if timestamp is not stamp:
+                    stamp = timestamp
+                    bucket = self._bucket(int(timestamp.timestamp() // self.bucket_seconds))
+                if bucket is not None:
+                    bucket.add(level, category, text)
+
+    def _bucket(self, index: int):
+        """The bucket for a bucket index, creating it if it is the newest; None if expired."""
+        buckets = self.buckets
+        if not buckets or index > buckets[-1].index:
+            buckets.append(AggregateBucket(index, self.top * 4))
+            return buckets[-1]
+        for bucket in reversed(buckets):
+            if bucket.index == index:
+                return bucket
+            if bucket.index < index:
+                break
+        return None  # a gap or older than everything kept
+
+    def snapshot(self, since: float = None, top: int = None) -> dict:
+        """JSON-ready aggregates for buckets ending after `since` (epoch seconds; None for all)."""
+        width = self.bucket_seconds
+        with self.lock:
+            buckets = [(b.index, dict(b.counts), dict(b.templates.counts), b.templates.error)
+                       for b in self.buckets if since is None or (b.index + 1) * width > since]
+
+        def stamp(index):
+            return datetime.datetime.fromtimestamp(index * width).isoformat(timespec='seconds')
+
+        def error_rate(errors, total):
+            return round(errors / total, 4) if total else 0.0
+
+        series = []
+        levels = collections.Counter()
+        categories = collections.defaultdict(collections.Counter)
+        templates = collections.Counter()
+        for index, counts, template_counts, error in buckets:
+            bucket_levels = collections.Counter()
+            for (level, category), n in counts.items():
+                bucket_levels[level] += n
+                categories[category][level] += n
+            levels.update(bucket_levels)
+            templates.update(template_counts)
+            total = sum(bucket_levels.values())
+            errors = sum(n for level, n in bucket_levels.items() if LEVEL_RANKS.get(level, 0) >= self.ERROR_RANK)
+            series.append({
+                'start': stamp(index),
+                'total': total,
+                'errors': errors,
+                'error_rate': error_rate(errors, total),
+                'levels': dict(bucket_levels),
+                'top_templates': [[f"{level} [{category}] {template}", n] for (level, category, template), n
+                                  in collections.Counter(template_counts).most_common(self.BUCKET_TOP)],
+                'template_undercount': error,
+            })
+
+        # Error rate over trailing windows ending at the newest bucket
+        windows = {}
+        if buckets:
+            newest = buckets[-1][0]
+            for seconds in self.WINDOWS:
+                first = newest - max(1, seconds // width) + 1
+                picked = [entry for entry, (index, *_) in zip(series, buckets) if index >= first]
+                total = sum(entry['total'] for entry in picked)
+                errors = sum(entry['errors'] for entry in picked)
+                windows[f"{seconds // 60}m" if seconds >= 60 else f"{seconds}s"] = error_rate(errors, total)
+
+        return {
+            'bucket_seconds': width,
+            'from': stamp(buckets[0][0]) if buckets else None,
+            'to': stamp(buckets[-1][0] + 1) if buckets else None,
+            'levels': dict(levels),
+            'categories': {category: dict(counts) for category, counts in
+                           sorted(categories.items(), key=lambda item: -sum(item[1].values()))},
+            'error_rate': windows,
+            'top_templates': [{'level': level, 'category': category, 'template': template, 'count': n}
+                              for (level, category, template), n in templates.most_common(top or self.top)],
+            'buckets': series,
+        }
+
+    def dump(self, path: str, since: float = None):
+        """Write snapshot(since) as JSON to path."""
+        data = json.dumps(self.snapshot(since), indent=1).encode('utf-8')
+        write_file_atomic(path, data)
+
+
+class TerminalRenderer:
+    """
+    Terminal output, decoupled from the output thread.
+
+    submit() only appends (level, line) pairs to a pending list. A render
+    thread wakes once per frame, colorizes everything pending and writes it
+    with a single sys.stdout.write, so a slow terminal (e.g. over SSH) costs
+    the server one syscall per frame instead of one blocking print per line.
+
+    Above max_rate lines/s, a frame keeps every warning and worse plus an
+    even sample of the rest up to the frame's budget, and says how many
+    lines of each level it left out. Only the terminal view is thinned; the
+    log file still gets every line.
+    """
+
+    FRAME_SECONDS = 0.05
+    MAX_PENDING = 100000
+
+    def __init__(self, max_rate: int = 2000, stream=None):
+        self.max_rate = max_rate
+        self.stream = stream
+        self.pending = []
+        self.overflow = collections.Counter()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.always_rank = LEVEL_RANKS['warning']
+
+    def submit(self, entries):
+        """Queue (level, line) pairs for the next frame. Never blocks on the terminal."""
+        with self.lock:
+            room = self.MAX_PENDING - len(self.pending)
+            if room >= len(entries):
+                self.pending.extend(entries)
+                return
+            # The terminal is hopelessly behind: keep what fits, count the rest
+            self.pending.extend(entries[:max(room, 0)])
+            for level, _ in entries[max(room, 0):]:
+                self.overflow[level] += 1
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Render whatever is still pending, then stop."""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2.0)
+        self._flush()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.FRAME_SECONDS)
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            entries, self.pending = self.pending, []
+            suppressed, self.overflow = self.overflow, collections.Counter()
+        if not entries and not suppressed:
+            return
+
+        budget = int(self.max_rate * self.FRAME_SECONDS) if self.max_rate > 0 else 0
+        if budget and len(entries) > budget:
+            entries = self._sample(entries, budget, suppressed)
+
+        out = [colorize_log(line, level) for level, line in entries]
+        if suppressed:
+            counts = ', '.join(f"{count:,} {level}" for level, count in suppressed.most_common())
+            out.append(f"{Colors.GRAY}... {counts} lines suppressed (over {self.max_rate:,} lines/s; "
+                       f"all of them are in the log file){Colors.RESET}")
+        stream = self.stream or sys.stdout
+        try:
+            stream.write('\n'.join(out) + '\n')
+            stream.flush()
+        except (OSError, ValueError):
+            pass  # terminal gone; the file output is what matters
+
+    def _sample(self, entries, budget: int, suppressed):
+        """Keep warnings and worse, plus an evenly spaced sample of the rest."""
+        rest = [i for i, (level, _) in enumerate(entries) if LEVEL_RANKS.get(level, 0) < self.always_rank]
+        room = max(budget - (len(entries) - len(rest)), 0)
+        if len(rest) <= room:
+            return entries
+        keep = set(range(len(entries))) - set(rest)
+        if room:
+            step = len(rest) / room
+            keep.update(rest[int(i * step)] for i in range(room))
+        kept = []
+        for i, entry in enumerate(entries):
+            if i in keep:
+                kept.append(entry)
+            else:
+                suppressed[entry[0]] += 1
+        return kept
+
+
+class TimingHistogram:
+    """
+    Durations in power-of-two microsecond buckets.
+
+    add() is a bit_length and two increments, cheap enough for the hot path.
+    Each histogram has a single writer thread, so it takes no lock; readers
+    may see a sample or two in flight, which is fine for monitoring.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound, in microseconds, of the bucket holding the pct-th sample."""
+        target = self.count * pct / 100
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return float(1 << bucket)
+        return 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_us': round(self.total / self.count * 1e6, 1) if self.count else 0.0,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'max_us': round(self.max * 1e6, 1),
+        }
+
+
+class ClientCounters:
+    """Per-connection receive counters, written only by that connection's thread."""
+
+    __slots__ = ('lines', 'bytes', 'connected', 'last_lines', 'device')
+
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.connected = time.monotonic()
+        self.last_lines = 0
+        self.device = None  # from a HELLO line
+
+
+def format_us(us: float) -> str:
+    return f"{us / 1000:.1f}ms" if us >= 1000 else f"{us:.0f}us"
+
+
+class ServerStats:
+    """
+    Self-instrumentation for LogServer: counters, timings and rates.
+
+    Socket threads bump their own ClientCounters; the output thread records
+    written lines and format/write timings. A sampler thread turns the
+    counters into per-interval rates and optionally prints a one-line
+    summary. With stats off, LogServer.stats is None and the hot path pays a
+    single attribute test.
+    """
+
+    def __init__(self, interval: float = 10.0, print_summary: bool = True, name: str = ''):
+        self.interval = interval
+        self.print_summary = print_summary
+        self.name = name
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.clients = {}
+        # Totals of clients that have disconnected
+        self.closed_lines = 0
+        self.closed_bytes = 0
+        # Written by the output thread only
+        self.lines_written = 0
+        self.bytes_written = 0
+        self.format_time = TimingHistogram()  # format, tail fan-out and print, per batch
+        self.write_time = TimingHistogram()   # file write + flush, per batch
+        self.rates = {}
+        self.server = None
+        self.running = False
+        self.thread = None
+        self._last = None
+
+    def client_connected(self, client: str) -> ClientCounters:
+        counters = ClientCounters()
+        with self.lock:
+            self.clients[client] = counters
+        return counters
+
+    def client_disconnected(self, client: str):
+        with self.lock:
+            counters = self.clients.pop(client, None)
+            if counters:
+                self.closed_lines += counters.lines
+                self.closed_bytes += counters.bytes
+
+    def received(self):
+        """(lines, bytes) received since start, across all clients."""
+        with self.lock:
+            lines = self.closed_lines + sum(c.lines for c in self.clients.values())
+            nbytes = self.closed_bytes + sum(c.bytes for c in self.clients.values())
+        return lines, nbytes
+
+    def start(self, server):
+        self.server = server
+        self.running = True
+        self._last = (time.monotonic(), *self.received(), self.lines_written, self.bytes_written)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            if not self.running:
+                return
+            self.sample()
+            if self.print_summary:
+                print(f"{Colors.BLUE}{self.summary_line()}{Colors.RESET}")
+
+    def sample(self):
+        """Compute rates over the time since the previous sample."""
+        now = time.monotonic()
+        lines_in, bytes_in = self.received()
+        lines_out, bytes_out = self.lines_written, self.bytes_written
+        then, last_lines_in, last_bytes_in, last_lines_out, last_bytes_out = self._last
+        elapsed = max(now - then, 1e-9)
+        self._last = (now, lines_in, bytes_in, lines_out, bytes_out)
+
+        client_rates = {}
+        with self.lock:
+            for client, counters in self.clients.items():
+                client_rates[client] = (counters.lines - counters.last_lines) / elapsed
+                counters.last_lines = counters.lines
+
+        self.rates = {
+            'window_seconds': round(elapsed, 2),
+            'lines_in_per_sec': round((lines_in - last_lines_in) / elapsed, 1),
+            'mb_in_per_sec': round((bytes_in - last_bytes_in) / elapsed / (1024 * 1024), 3),
+            'lines_out_per_sec': round((lines_out - last_lines_out) / elapsed, 1),
+            'mb_out_per_sec': round((bytes_out - last_bytes_out) / elapsed / (1024 * 1024), 3),
+            'clients': {client: round(rate, 1) for client, rate in client_rates.items()},
+        }
+
+    def snapshot(self) -> dict:
+        """Everything the stats endpoint serves, as a JSON-able dict."""
+        server = self.server
+        lines_in, bytes_in = self.received()
+        rates = self.rates
+        now = time.monotonic()
+        with self.lock:
+            clients = {
+                client: {
+                    'lines': counters.lines,
+                    'bytes': counters.bytes,
+                    'lines_per_sec': rates.get('clients', {}).get(client, 0.0),
+                    'connected_seconds': round(now - counters.connected, 1),
+                    'device': counters.device,
+                }
+                for client, counters in self.clients.items()
+            }
+        snapshot = {
+            'uptime_seconds': round(now - self.started, 1),
+            'threads': threading.active_count(),
+            'received': {'lines': lines_in, 'bytes': bytes_in},
+            'written': {'lines': self.lines_written, 'bytes': self.bytes_written},
+            'rates': {k: v for k, v in rates.items() if k != 'clients'},
+            'timing': {'format': self.format_time.snapshot(), 'write': self.write_time.snapshot()},
+            'clients': clients,
+        }
+        if server is not None:
+            snapshot['queue'] = {
+                'depth': len(server.ingest),
+                'capacity': server.ingest.capacity,
+                'policy': server.ingest.policy,
+                'dropped': server.ingest.dropped_total,
+            }
+            if server.limiter is not None:
+                snapshot['limited'] = server.limiter.suppressed_total
+            if server.pipeline is not None:
+                snapshot['stages'] = server.pipeline.snapshot()
+            if server.screenshots is not None:
+                snapshot['screenshots'] = {
+                    'frames': server.screenshots.screenshot_count,
+                    'bytes': server.screenshots.total_stats.bytes,
+                    'write_queue': server.screenshots.writer.queue_depth(),
+                }
+        return snapshot
+
+    def summary_line(self) -> str:
+        rates = self.rates
+        ingest = self.server.ingest
+        with self.lock:
+            clients = len(self.clients)
+        label = f"[Stats {self.name}]" if self.name else "[Stats]"
+        limiter = self.server.limiter
+        limited = f"limited {limiter.suppressed_total:,}, " if limiter else ""
+        return (f"{label} in {rates.get('lines_in_per_sec', 0):,.0f} lines/s "
+                f"({rates.get('mb_in_per_sec', 0):.2f} MB/s), "
+                f"out {rates.get('lines_out_per_sec', 0):,.0f} lines/s, "
+                f"queue {len(ingest):,}/{ingest.capacity:,}, dropped {ingest.dropped_total:,}, "
+                f"{limited}format p99 {format_us(self.format_time.percentile(99))}, "
+                f"write p99 {format_us(self.write_time.percentile(99))}, "
+                f"{clients} clients, {threading.active_count()} threads")
+
+
+class StatsServer:
+    """HTTP endpoint serving ServerStats.snapshot() as JSON at /stats, and LogAggregates at /aggregates."""
+
+    def __init__(self, port: int, stats: ServerStats):
+        self.port = port
+        self.stats = stats
+        self.httpd = None
+
+    def run(self):
+        stats = self.stats
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                aggregates = stats.server.aggregates if stats.server else None
+                if url.path in ('/', '/stats'):
+                    data = stats.snapshot()
+                elif url.path == '/aggregates' and aggregates:
+                    # ?minutes=N limits to the trailing N minutes, ?top=K the template count
+                    query = parse_qs(url.query)
+                    try:
+                        minutes = float(query['minutes'][0]) if 'minutes' in query else None
+                        top = int(query['top'][0]) if 'top' in query else None
+                    except ValueError:
+                        self.send_error(400, 'minutes and top must be numbers')
+                        return
+                    since = time.time() - minutes * 60 if minutes else None
+                    data = aggregates.snapshot(since, top)
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(data, indent=2).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # no per-request noise in the log terminal
+
+        try:
+            self.httpd = ThreadingHTTPServer(('0.0.0.0', self.port), Handler)
+            self.httpd.daemon_threads = True
+            self.port = self.httpd.server_address[1]
+        except OSError as e:
+            print(f"{Colors.RED}Error: Could not bind stats server to port {self.port}: {e}{Colors.RESET}")
+            return
+        self.httpd.serve_forever(poll_interval=1.0)
+
+    def shutdown(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+# Optional first line of a connection naming the device, e.g. "HELLO iPhone-15-lab3"
+HELLO_RE = re.compile(r'^HELLO\s+(?:device=)?([A-Za-z0-9._-]{1,64})\s*$')
+
+
+class SessionFile:
+    """
+    One connection's own log file (--session-dir).
+
+    Written only by that connection's thread, so devices never wait on a
+    shared lock or interleave in one file. Named <device>_<YYYYMMDD_HHMMSS>.txt,
+    the same shape as rotated logs, so log_query.py reads one device's
+    sessions with <dir>/<device>.txt as the base. The device is the name from
+    a HELLO first line, or the client IP. The file is opened on the first
+    write, so a HELLO line can still rename it.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = re.sub(r'[^A-Za-z0-9._-]', '-', name)
+        self.path = None
+        self.file = None
+        self.last_stamp = datetime.datetime.min
+
+    def hello(self, line: str) -> bool:
+        """Take the device name from a HELLO line sent before any log line."""
+        match = HELLO_RE.match(line) if self.file is None else None
+        if match:
+            self.name = match.group(1)
+        return match is not None
+
+    def _open(self):
+        now = datetime.datetime.now()
+        while True:
+            self.path = os.path.join(self.directory, f"{self.name}_{now.strftime('%Y%m%d_%H%M%S')}.txt")
+            try:
+                # 'x' so reconnects within a second (or other workers) never share a file
+                self.file = open(self.path, 'x', buffering=256 * 1024)
+                return
+            except FileExistsError:
+                now += datetime.timedelta(seconds=1)
+
+    def write(self, records):
+        if self.file is None:
+            self._open()
+        out = []
+        for timestamp, level, category, text, client in records:
+            if timestamp < self.last_stamp:
+                timestamp = self.last_stamp
+            else:
+                self.last_stamp = timestamp
+            out.append(build_log_line(level, category, text, timestamp))
+        self.file.write('\n'.join(out) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+# Custom stages run after parsing, in this order, each over a whole batch
+# of (timestamp, level, category, text, client) records; see StagePipeline
+STAGE_KINDS = ('enrich', 'filter', 'sample', 'sink')
+STAGE_POOLS = ('thread', 'process')
+
+
+def load_callable(spec: str):
+    """
+    Resolve "module:attr" or "path/to/file.py:attr".
+
+    A file's directory is put on sys.path and the file imported by name, so
+    process-pool workers can import it again.
+    """
+    target, sep, attr = spec.rpartition(':')
+    if not sep or not target or not attr:
+        raise ValueError(f"expected MODULE:NAME or FILE.py:NAME, got {spec!r}")
+    if target.endswith('.py'):
+        directory, filename = os.path.split(os.path.abspath(target))
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        target = filename[:-len('.py')]
+    obj = importlib.import_module(target)
+    for part in attr.split('.'):
+        obj = getattr(obj, part)
+    if not callable(obj):
+        raise ValueError(f"{spec} is not callable")
+    return obj
+
+
+class PipelineStage:
+    """
+    One configured stage: a callable taking a list of records.
+
+    enrich/filter/sample stages return the list to pass on (new, fewer or
+    rewritten records); a sink's return value is ignored. In-process stages
+    are never called concurrently with themselves. With a pool, the batch is
+    handed to a worker: transform stages wait for its result (a process pool
+    moves CPU-heavy work off the GIL), sinks don't, up to MAX_PENDING batches
+    per worker. A stage that raises passes its batch through unchanged and
+    the error is reported at most once per ERROR_REPORT_SECONDS.
+    """
+
+    MAX_PENDING = 4
+    ERROR_REPORT_SECONDS = 10.0
+
+    def __init__(self, kind: str, func, name: str, pool: str = None, workers: int = 1):
+        if kind not in STAGE_KINDS:
+            raise ValueError(f"unknown stage kind {kind!r} (expected one of {', '.join(STAGE_KINDS)})")
+        if pool not in (None, *STAGE_POOLS):
+            raise ValueError(f"unknown pool {pool!r} (expected thread or process)")
+        self.kind = kind
+        self.func = func
+        self.name = name
+        self.pool_kind = pool
+        self.workers = max(1, workers)
+        self.executor = None
+        self.pending = threading.BoundedSemaphore(self.MAX_PENDING * self.workers) if pool else None
+        self.lock = threading.Lock()
+        self.time = TimingHistogram()
+        self.records_in = 0
+        self.records_out = 0
+        self.errors = 0
+        self.next_error_report = 0.0
+
+    def start(self):
+        """Create the worker pool; called after any fork (--workers)."""
+        if self.pool_kind == 'thread':
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix=f"stage-{self.name}")
+        elif self.pool_kind == 'process':
+            self.executor = ProcessPoolExecutor(self.workers)
+
+    def __call__(self, records):
+        started = time.perf_counter()
+        try:
+            if self.executor is None:
+                with self.lock:
+                    result = self.func(records)
+            elif self.kind == 'sink':
+                self.pending.acquire()
+                future = self.executor.submit(self.func, records)
+                future.add_done_callback(self._sink_done)
+                result = None
+            else:
+                result = self.executor.submit(self.func, records).result()
+        except Exception as e:
+            self._report_error(e)
+            result = None
+        if self.kind == 'sink' or result is None:
+            result = records
+        with self.lock:
+            self.time.add(time.perf_counter() - started)
+            self.records_in += len(records)
+            self.records_out += len(result)
+        return result
+
+    def _sink_done(self, future):
+        self.pending.release()
+        if future.exception() is not None:
+            self._report_error(future.exception())
+
+    def _report_error(self, error):
+        with self.lock:
+            self.errors += 1
+            now = time.monotonic()
+            if now < self.next_error_report:
+                return
+            self.next_error_report = now + self.ERROR_REPORT_SECONDS
+        print(f"{Colors.RED}Pipeline stage {self.name} ({self.kind}) failed, batch passed through: "
+              f"{type(error).__name__}: {error}{Colors.RESET}")
+
+    def close(self):
+        """Wait for pooled work, then let the callable clean up (close() if it has one)."""
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        close = getattr(self.func, 'close', None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                print(f"{Colors.RED}Pipeline stage {self.name} close failed: {e}{Colors.RESET}")
+
+    def snapshot(self) -> dict:
+        return {
+            'kind': self.kind,
+            'pool': self.pool_kind,
+            'records_in': self.records_in,
+            'records_out': self.records_out,
+            'errors': self.errors,
+            'time': self.time.snapshot(),
+        }
+
+
+class StagePipeline:
+    """
+    Custom processing stages between parsing and delivery.
+
+    The socket threads run every batch of parsed records through the enrich,
+    filter and sample stages (the built-in --rate-limit/--sample limiter runs
+    first among the samplers), deliver what is left, then hand it to the
+    sink stages. Configured from a JSON file:
+
+        {"stages": [
+            {"kind": "enrich", "call": "example_stages:GeminiLatency",
+             "options": {"threshold_ms": 3000}},
+            {"kind": "sink", "call": "example_stages:JsonLinesSink",
+             "options": {"path": "/tmp/app_logs.jsonl"}, "pool": "thread"}
+        ]}
+
+    "call" names a stage callable, or with "options" a factory called with
+    them that returns one. "name", "pool" (thread/process) and "workers"
+    are optional. Under --workers each process builds its own stages after
+    the fork, and a "path" option gets that worker's .wN suffix, like its
+    log shard, so no two processes write one file.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    @classmethod
+    def from_specs(cls, config: dict = None, quick=(), build: bool = True, shard: int = None):
+        """
+        Build from a parsed config and/or "KIND=MODULE:NAME" strings; raises ValueError.
+
+        build=False resolves the callables but calls no factory, to check a
+        config without opening anything. shard is the --workers index.
+        """
+        entries = list((config or {}).get('stages', []))
+        for spec in quick:
+            kind, sep, call = spec.partition('=')
+            if not sep:
+                raise ValueError(f"expected KIND=MODULE:NAME, got {spec!r}")
+            entries.append({'kind': kind, 'call': call})
+
+        stages = []
+        for entry in entries:
+            unknown = set(entry) - {'kind', 'call', 'options', 'name', 'pool', 'workers'}
+            if unknown or 'kind' not in entry or 'call' not in entry:
+                raise ValueError(f"bad stage entry {entry!r}: needs kind and call, "
+                                 f"may have options, name, pool, workers")
+            options = entry.get('options')
+            if options is not None and not isinstance(options, dict):
+                raise ValueError(f"stage {entry['call']}: options must be an object")
+            try:
+                func = load_callable(entry['call'])
+                if options is not None and build:
+                    if shard is not None and 'path' in options:
+                        options = {**options, 'path': shard_output_path(options['path'], shard)}
+                    func = func(**options)
+            except (ImportError, AttributeError, TypeError, OSError) as e:
+                raise ValueError(f"stage {entry['call']}: {e}")
+            stages.append(PipelineStage(entry['kind'], func, entry.get('name', entry['call']),
+                                        entry.get('pool'), int(entry.get('workers', 1))))
+        # Stable sort: kinds run in STAGE_KINDS order, config order within a kind
+        stages.sort(key=lambda stage: STAGE_KINDS.index(stage.kind))
+        return cls(stages)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def run(self, records, kinds):
+        """Pass records through the stages of the given kinds; returns what is left."""
+        for stage in self.stages:
+            if not records:
+                break
+            if stage.kind in kinds:
+                records = stage(records)
+        return records
+
+    def sink(self, records):
+        if records:
+            self.run(records, ('sink',))
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
+
+    def describe(self) -> str:
+        return ' -> '.join(f"{stage.kind}:{stage.name}" + (f" ({stage.pool_kind} x{stage.workers})"
+                                                            if stage.pool_kind else '')
+                           for stage in self.stages)
+
+    def snapshot(self) -> dict:
+        return {stage.name: stage.snapshot() for stage in self.stages}
+
 
 class LogServer:
     def __init__(self, port: int, output_file: str = None, quiet: bool = False,
-                 rotate_minutes: int = 0):
+                 rotate_minutes: int = 0, compression: str = None,
+                 retain_bytes: int = 0, retain_seconds: int = 0, rotate_bytes: int = 0,
+                 tail=None, queue_size: int = 50000, queue_policy: str = 'drop-debug',
+                 drop_report_seconds: float = 10.0, screenshots=None, stats=None,
+                 reuse_port: bool = False, terminal_rate: int = 2000, session_dir: str = None,
+                 wal_bytes: int = 0, drain_seconds: float = 5.0, limiter=None, aggregates=None,
+                 pipeline=None):
         self.port = port
         self.output_file = output_file
         self.quiet = quiet
         self.rotate_minutes = rotate_minutes
+        self.rotate_bytes = rotate_bytes
+        self.rotating = rotate_minutes > 0 or rotate_bytes > 0
+        self.archiver = None
+        if output_file and self.rotating and (compression or retain_bytes or retain_seconds):
+            self.archiver = LogArchiver(output_file, compression, retain_bytes,
+                                        retain_seconds, quiet)
         self.running = False
         self.server_socket = None
         self.out_file = None
         self.clients = []
         self.lock = threading.Lock()
-        self.rotation_timer = None
         self.current_log_path = None
+        # Rotation is checked inline by the writer, under self.lock
+        self.current_bytes = 0
+        self.rotate_deadline = None
+        self.tail = tail
+        # Socket threads only parse and enqueue; one output thread formats,
+        # writes and prints, so slow disks/terminals never stall a device
+        self.ingest = IngestQueue(queue_size, queue_policy)
+        self.drop_report_seconds = drop_report_seconds
+        self.output_thread = None
+        # ScreenshotServer that framed connections hand screenshot frames to
+        self.screenshots = screenshots
+        # ServerStats, or None when instrumentation is off
+        self.stats = stats
+        # Share the port with sibling worker processes (--workers)
+        self.reuse_port = reuse_port
+        # Log lines reach the terminal through their own batched, rate-limited consumer
+        self.terminal = None if quiet else TerminalRenderer(terminal_rate)
+        # Per-connection session files, written by each connection's own thread
+        self.session_dir = session_dir
+        if session_dir:
+            Path(session_dir).mkdir(parents=True, exist_ok=True)
+        # Whether anything consumes the shared queue (combined file, tail, terminal)
+        self.shared_output = bool(output_file or tail or self.terminal)
+        # Crash-safe ring of received-but-unwritten lines, next to the output file
+        self.wal_bytes = wal_bytes if output_file else 0
+        self.wal_path = f"{output_file}.wal" if output_file else None
+        # How long shutdown waits for queued lines to reach the file
+        self.drain_seconds = drain_seconds
+        # IngestLimiter applied to parsed lines before delivery, or None
+        self.limiter = limiter
+        # LogAggregates counting every parsed line (before limits), or None
+        self.aggregates = aggregates
+        # StagePipeline of custom enrich/filter/sample/sink stages, or None
+        self.pipeline = pipeline
+        self.current_log_started = None
 
     def handle_client(self, client_socket, addr):
         """Handle a single client connection."""
         if not self.quiet:
             print(f"{Colors.GREEN}Client connected: {addr[0]}:{addr[1]}{Colors.RESET}")
 
+        client = f"{addr[0]}:{addr[1]}"
+        counters = self.stats.client_connected(client) if self.stats else None
+        session = SessionFile(self.session_dir, addr[0]) if self.session_dir else None
+        label = client  # becomes "<device>@<ip>:<port>" after a HELLO line
+        greeted = False
         buffer = ""
         try:
             while self.running:
                 try:
-                    data = client_socket.recv(4096)
+                    data = client_socket.recv(65536)
                     if not data:
                         break
 
-                    buffer += data.decode('utf-8', errors='replace')
-
-                    # Process complete lines
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.strip()
-
-                        if not line:
-                            continue
+                    # A framed client announces itself with FRAME_MAGIC up front
+                    if not buffer and data[:len(FRAME_MAGIC)] == FRAME_MAGIC[:len(data)]:
+                        data = self._await_magic(client_socket, data)
+                        if data is None:
+                            break
+                        if data.startswith(FRAME_MAGIC):
+                            self._handle_framed(PrefixedSocket(client_socket, data[len(FRAME_MAGIC):]),
+                                                addr, counters, session)
+                            break
 
-                        # Format the log
-                        log_line, level = format_unified_log(line)
+                    buffer += data.decode('utf-8', errors='replace')
 
-                        # Write to file (plain text)
-                        if self.out_file:
-                            with self.lock:
-                                self.out_file.write(log_line + '\n')
-                                self.out_file.flush()
+                    # Process complete lines; the last piece is a partial line (or "")
+                    *lines, buffer = buffer.split('\n')
+                    if not greeted:
+                        lines, label, greeted = self._hello(lines, label, counters, session)
+                    self._ingest_lines(lines, label, session)
 
-                        # Print to terminal (with colors)
-                        if not self.quiet:
-                            print(colorize_log(log_line, level))
+                    if counters:
+                        counters.lines += len(lines)
+                        counters.bytes += len(data)
 
                 except socket.timeout:
                     continue
@@ -324,35 +2621,371 @@ class LogServer:
 
         finally:
             client_socket.close()
+            if session:
+                session.close()
             with self.lock:
                 if client_socket in self.clients:
                     self.clients.remove(client_socket)
+            if self.stats:
+                self.stats.client_disconnected(client)
             if not self.quiet:
                 print(f"{Colors.YELLOW}Client disconnected: {addr[0]}:{addr[1]}{Colors.RESET}")
 
-    def _make_rotated_path(self):
-        """Generate a log file path with timestamp for rotation."""
+    def _await_magic(self, sock, data: bytes):
+        """Read until data is long enough to tell framed from text (None on EOF)."""
+        while len(data) < len(FRAME_MAGIC) and FRAME_MAGIC.startswith(data):
+            try:
+                more = sock.recv(65536)
+            except socket.timeout:
+                if not self.running:
+                    return None
+                continue
+            if not more:
+                return None
+            data += more
+        return data
+
+    def _recv_exact(self, sock, n: int):
+        """Receive exactly n bytes via recv_into; None on disconnect/shutdown."""
+        data = bytearray(n)
+        view = memoryview(data)
+        got = 0
+        while got < n:
+            try:
+                count = sock.recv_into(view[got:])
+            except socket.timeout:
+                if not self.running:
+                    return None
+                continue
+            if not count:
+                return None
+            got += count
+        return data
+
+    def _handle_framed(self, sock, addr, counters=None, session=None):
+        """Read typed frames from one multiplexed connection until it closes."""
+        client = f"{addr[0]}:{addr[1]}"
+        stats = ThroughputStats()
+        greeted = False
+        if not self.quiet:
+            print(f"{Colors.GREEN}Client {client} using framed protocol{Colors.RESET}")
+
+        while self.running:
+            header = self._recv_exact(sock, FRAME_HEADER.size)
+            if header is None:
+                break
+            msg_type, length = FRAME_HEADER.unpack(header)
+            if length > MAX_FRAME_BYTES:
+                raise ValueError(f"frame of {length} bytes exceeds limit (stream out of sync?)")
+
+            if msg_type == MSG_SCREENSHOT:
+                if not self._handle_screenshot_frame(sock, length, addr, client, stats, counters, session):
+                    break
+                continue
+
+            payload = self._recv_exact(sock, length)
+            if payload is None:
+                break
+            if counters:
+                counters.bytes += FRAME_HEADER.size + length
+
+            if msg_type in (MSG_LOG_LINE, MSG_LOG_BATCH, MSG_LOG_BATCH_DEFLATE, MSG_LOG_BATCH_ZSTD):
+                if msg_type in (MSG_LOG_LINE, MSG_LOG_BATCH):
+                    text = payload.decode('utf-8', errors='replace')
+                else:
+                    try:
+                        text = decompress_batch(msg_type, payload).decode('utf-8', errors='replace')
+                    except (ValueError, zlib.error) as e:
+                        if not self.quiet:
+                            print(f"{Colors.RED}Bad log batch from {client}: {e}{Colors.RESET}")
+                        continue
+                batch = text.split('\n')
+                if not greeted:
+                    batch, client, greeted = self._hello(batch, client, counters, session)
+                lines = self._ingest_lines(batch, client, session)
+            else:
+                lines = 0
+                if msg_type != MSG_HEARTBEAT and not self.quiet:
+                    print(f"{Colors.YELLOW}Ignoring unknown frame type {msg_type} from {client}{Colors.RESET}")
+            if counters:
+                counters.lines += lines
+
+    def _hello(self, lines, client: str, counters=None, session=None):
+        """
+        Consume a HELLO line sent before a connection's first log line.
+
+        It is never logged: the device name labels the connection's records
+        ("<device>@<ip>:<port>") and its stats entry, and names its session
+        file. Returns (lines left, client label, whether the first line has
+        arrived).
+        """
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if not line:
+                continue
+            match = HELLO_RE.match(line)
+            if not match:
+                return lines[i:], client, True
+            device = match.group(1)
+            if session:
+                session.hello(line)
+            if counters:
+                counters.device = device
+            if not self.quiet:
+                print(f"{Colors.GREEN}Client {client} is {device}{Colors.RESET}")
+            return lines[i + 1:], f"{device}@{client}", True
+        return [], client, False
+
+    def _ingest_lines(self, lines, client: str, session=None) -> int:
+        """Parse and deliver every non-empty line; returns how many there were."""
+        now = datetime.datetime.now()
+        records = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            # Parse here (cheap) so the queue can prefer dropping debug
+            level, category, text = parse_unified_log(line)
+            records.append((now, level, category, text, client))
+        received = len(records)
+        if records:
+            self._process(records, session)
+        return received
+
+    def _process(self, records, session=None):
+        """Run parsed records through aggregation, stages and limits, then deliver them."""
+        if self.aggregates:
+            self.aggregates.add(records)
+        if self.pipeline:
+            records = self.pipeline.run(records, ('enrich', 'filter'))
+        if self.limiter and records:
+            records = self.limiter.admit(records)
+        if self.pipeline:
+            records = self.pipeline.run(records, ('sample',))
+        self._deliver(records, session)
+        if self.pipeline:
+            self.pipeline.sink(records)
+
+    def _deliver(self, records, session=None):
+        """Write records to the connection's session file and/or the shared queue."""
+        if session and records:
+            session.write(records)
+        if self.shared_output:
+            for record in records:
+                self.ingest.put(record)
+
+    def _handle_screenshot_frame(self, sock, length: int, addr, client: str, stats,
+                                 counters=None, session=None) -> bool:
+        """Pass a screenshot frame to the screenshot server and mark it in the log."""
+        ts_header = self._recv_exact(sock, SCREENSHOT_HEADER.size)
+        if ts_header is None:
+            return False
+        ts_len = SCREENSHOT_HEADER.unpack(ts_header)[0]
+        if SCREENSHOT_HEADER.size + ts_len > length:
+            raise ValueError(f"screenshot timestamp of {ts_len} bytes overruns its {length} byte frame")
+        img_len = length - SCREENSHOT_HEADER.size - ts_len
+        max_image_bytes = self.screenshots.max_image_bytes if self.screenshots else ScreenshotServer.MAX_IMAGE_BYTES
+        if img_len > max_image_bytes:
+            raise ValueError(f"image of {img_len} bytes exceeds --screenshot-max-mb")
+        ts_data = self._recv_exact(sock, ts_len)
+        if ts_data is None:
+            return False
+        timestamp = ts_data.decode('utf-8', errors='replace')
+
+        if self.screenshots is None:
+            filepath = '' if self._recv_exact(sock, img_len) is not None else None
+        else:
+            filepath = self.screenshots.receive_image(sock, timestamp, img_len, addr, stats, client)
+        if filepath is None:
+            return False
+        if counters:
+            counters.bytes += FRAME_HEADER.size + length
+        if self.screenshots is None:
+            return True
+
+        # Same queue as the log lines around it, so the log shows exactly where it landed
+        saved = os.path.relpath(filepath, self.screenshots.output_dir) if filepath else 'not stored'
+        self._deliver([(datetime.datetime.now(), 'info', 'Screenshot',
+                        f"{timestamp} -> {saved} ({img_len / 1024:.1f} KB)", client)], session)
+        return True
+
+    def _output_loop(self):
+        """Drain the ingest queue: format, write, publish and print each batch."""
+        next_report = time.monotonic() + self.drop_report_seconds
+        last_stamp = datetime.datetime.min
+        while True:
+            batch = self.ingest.get_batch()
+            if not batch and self.ingest.closed:
+                if self.drop_report_seconds > 0:
+                    self._report_drops()  # whatever was lost since the last report
+                return
+
+            started = time.perf_counter() if self.stats else 0.0
+            log_lines = []
+            shown = []
+            for timestamp, level, category, text, client in batch:
+                # Socket threads stamp lines before queueing, so lines from
+                # different clients can arrive a hair out of order; keep the
+                # file's stamps non-decreasing so it can be bisected and merged
+                if timestamp < last_stamp:
+                    timestamp = last_stamp
+                else:
+                    last_stamp = timestamp
+                log_line = build_log_line(level, category, text, timestamp)
+                log_lines.append(log_line)
+
+                # Fan out to live tail subscribers
+                if self.tail:
+                    self.tail.publish(level, category, log_line)
+
+                if self.terminal:
+                    shown.append((level, log_line))
+
+            # Colorized and printed by the terminal renderer's own thread
+            if shown:
+                self.terminal.submit(shown)
+
+            if self.stats and batch:
+                self.stats.format_time.add(time.perf_counter() - started)
+
+            # Write to file (plain text), then mark it durable in the write-ahead ring
+            if self.output_file and log_lines:
+                self._write_lines(log_lines, self.ingest.last_wal_end)
+
+            if self.drop_report_seconds > 0 and time.monotonic() >= next_report:
+                next_report = time.monotonic() + self.drop_report_seconds
+                self._report_drops()
+
+    def _report_drops(self):
+        """Log lines lost to a full queue (per client) or to rate limits (per category)."""
+        reports = []
+        dropped = self.ingest.take_dropped()
+        if dropped:
+            summary = ', '.join(f"{client}={count:,}" for client, count in dropped.most_common())
+            reports.append(('warning', f"Ingest queue full ({self.ingest.policy}), dropped lines: {summary}"))
+        suppressed = self.limiter.take_suppressed() if self.limiter else None
+        if suppressed:
+            summary = ', '.join(f"{category}:{level}={count:,}"
+                                for (category, level), count in suppressed.most_common())
+            reports.append(('notice', f"Rate limited/sampled out in the last "
+                                      f"{self.drop_report_seconds:g}s: {summary}"))
+        if not reports:
+            return
+        log_lines = [build_log_line(level, 'LogServer', text) for level, text in reports]
+        if self.output_file:
+            self._write_lines(log_lines)
+        if self.terminal:
+            self.terminal.submit([(level, line) for (level, _), line in zip(reports, log_lines)])
+
+    def _write_lines(self, log_lines, wal_end: int = 0) -> bool:
+        """
+        Append lines, rotating first if the current file is full or too old.
+
+        With wal_end, the write-ahead ring is committed up to it in the same
+        critical section, so shutdown can't close the ring in between.
+        """
+        rotated_from = None
+        with self.lock:
+            if self.out_file is None:
+                return False
+            if self._rotation_due():
+                rotated_started = self.current_log_started
+                rotated_from = self._rotate_log()
+            # Encoded here so --rotate-mb counts bytes, not characters
+            chunk = ('\n'.join(log_lines) + '\n').encode('utf-8', errors='replace')
+            started = time.perf_counter() if self.stats else 0.0
+            self.out_file.write(chunk)
+            self.out_file.flush()
+            self.current_bytes += len(chunk)
+            wal = self.ingest.wal
+            if wal and wal_end:
+                wal.commit(wal_end)
+            if self.stats:
+                self.stats.write_time.add(time.perf_counter() - started)
+                self.stats.lines_written += len(log_lines)
+                self.stats.bytes_written += len(chunk)
+
+        if rotated_from and not self.quiet:
+            print(f"{Colors.CYAN}Log rotated: {rotated_from} -> {self.current_log_path}{Colors.RESET}")
+        if rotated_from and self.aggregates:
+            self._dump_aggregates(rotated_from, rotated_started)
+        return True
+
+    def _dump_aggregates(self, log_path: str, since: float):
+        """Save the aggregates covering a finished log file next to it."""
+        path = aggregate_dump_path(log_path)
+        try:
+            self.aggregates.dump(path, since)
+        except OSError as e:
+            print(f"{Colors.RED}Could not write aggregates to {path}: {e}{Colors.RESET}")
+
+    def _recover_wal(self):
+        """
+        Save lines a killed predecessor received but never wrote, then start a fresh ring.
+
+        Called before the output file is opened. With rotation, the lines go
+        to a file of their own stamped with the first of them, so
+        log_query.py --since/--until, which prunes files by name stamp,
+        still finds them. Returns the lines for the new output file.
+        """
+        records = WriteAheadRing.recover(self.wal_path)
+        self.ingest.wal = WriteAheadRing(self.wal_path, self.wal_bytes)
+        if not records:
+            return []
+
+        lines = [build_log_line(level, category, text, timestamp)
+                 for timestamp, level, category, text, _ in records]
+        notice = (f"Recovered {len(records):,} lines received before an unclean shutdown "
+                  f"(write-ahead buffer)")
+        print(f"{Colors.YELLOW}Recovered {len(records):,} unwritten lines from {self.wal_path}{Colors.RESET}")
+        if not self.rotating:
+            return [build_log_line('warning', 'LogServer', notice)] + lines
+
+        path = self._make_rotated_path(min(record[0] for record in records))
+        with open(path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+        return [build_log_line('warning', 'LogServer', f"{notice}, saved to {path}")]
+
+    def _rotation_due(self) -> bool:
+        """Whether the next write should go to a new file. Caller holds self.lock."""
+        if self.rotate_bytes > 0 and self.current_bytes >= self.rotate_bytes:
+            return True
+        if self.rotate_deadline is not None and time.monotonic() >= self.rotate_deadline:
+            return True
+        return False
+
+    def _make_rotated_path(self, now: datetime.datetime = None):
+        """Generate a log file path with timestamp (default now) for rotation."""
         base = self.output_file
-        ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        now = now or datetime.datetime.now()
         # e.g. /tmp/app_logs.txt -> /tmp/app_logs_20260205_195300.txt
         root, ext = os.path.splitext(base)
-        return f"{root}_{ts}{ext}"
+        path = f"{root}_{now.strftime('%Y%m%d_%H%M%S')}{ext}"
+        # Size-based rotation can fire twice within a second; keep names unique and ordered
+        while any(os.path.exists(path + suffix) for suffix in ('', *COMPRESSION_SUFFIXES.values())):
+            now += datetime.timedelta(seconds=1)
+            path = f"{root}_{now.strftime('%Y%m%d_%H%M%S')}{ext}"
+        return path
 
     def _open_log_file(self):
         """Open the log output file, with timestamped name if rotation is enabled."""
         if not self.output_file:
             return
 
-        if self.rotate_minutes > 0:
+        if self.rotating:
             rotated_path = self._make_rotated_path()
             self.current_log_path = rotated_path
         else:
             self.current_log_path = self.output_file
 
-        self.out_file = open(self.current_log_path, 'a', buffering=1)
+        self.out_file = open(self.current_log_path, 'ab')
+        self.current_bytes = self.out_file.tell()
+        self.current_log_started = time.time()
+        if self.rotate_minutes > 0:
+            self.rotate_deadline = time.monotonic() + self.rotate_minutes * 60
 
         # If rotating, also maintain a symlink at the base path for easy access
-        if self.rotate_minutes > 0:
+        if self.rotating:
             try:
                 if os.path.islink(self.output_file) or os.path.exists(self.output_file):
                     os.remove(self.output_file)
@@ -363,27 +2996,59 @@ class LogServer:
         print(f"{Colors.CYAN}Writing logs to: {self.current_log_path}{Colors.RESET}")
 
     def _rotate_log(self):
-        """Rotate the log file: close current, open new with fresh timestamp."""
-        if not self.running or not self.output_file:
-            return
+        """
+        Rotate the log file: close current, open new with fresh timestamp.
+
+        Called by the writer with self.lock held, so the close and reopen are
+        atomic with respect to every other client's writes. Returns the path
+        rotated away from.
+        """
+        old_path = self.current_log_path
+        self.out_file.close()
+        self._open_log_file()
+
+        if self.archiver:
+            self.archiver.submit(old_path, self.current_log_path)
 
+        return old_path
+
+    def start_output(self):
+        """
+        Start the writing side: output file, output thread, archiver, terminal.
+
+        run() calls this before accepting; other receivers (the UDP
+        LogServer.py) call it directly and feed records through submit().
+        """
+        # Recover first, so a file of recovered lines sorts before the new one
+        recovered = self._recover_wal() if self.wal_bytes else []
+
+        # Open output file if specified (later rotations happen inline in _write_lines)
         with self.lock:
-            old_path = self.current_log_path
-            if self.out_file:
-                self.out_file.close()
             self._open_log_file()
+        if recovered:
+            self._write_lines(recovered)
 
-        if not self.quiet:
-            print(f"{Colors.CYAN}Log rotated: {old_path} -> {self.current_log_path}{Colors.RESET}")
+        # Compress/expire rotated files in the background
+        if self.archiver:
+            self.archiver.start(self.current_log_path)
 
-        self._schedule_rotation()
+        if self.terminal:
+            self.terminal.start()
 
-    def _schedule_rotation(self):
-        """Schedule the next log rotation."""
-        if self.rotate_minutes > 0 and self.running:
-            self.rotation_timer = threading.Timer(self.rotate_minutes * 60, self._rotate_log)
-            self.rotation_timer.daemon = True
-            self.rotation_timer.start()
+        self.output_thread = threading.Thread(target=self._output_loop)
+        self.output_thread.daemon = True
+        self.output_thread.start()
+
+        if self.pipeline:
+            self.pipeline.start()
+
+        if self.stats:
+            self.stats.start(self)
+
+    def submit(self, records):
+        """Queue already-parsed (timestamp, level, category, text, client) records."""
+        if records:
+            self._process(records)
 
     def run(self):
         """Run the TCP log server."""
@@ -392,22 +3057,21 @@ class LogServer:
         # Create TCP socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Every worker listens on the same port; the kernel spreads connections
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         try:
             self.server_socket.bind(('0.0.0.0', self.port))
             self.server_socket.listen(5)
             self.server_socket.settimeout(1.0)  # Allow checking for shutdown
+            self.port = self.server_socket.getsockname()[1]  # resolves port 0
         except OSError as e:
             print(f"{Colors.RED}Error: Could not bind to port {self.port}: {e}{Colors.RESET}")
             sys.exit(1)
 
         self.running = True
-
-        # Open output file if specified
-        self._open_log_file()
-
-        # Start rotation timer if enabled
-        self._schedule_rotation()
+        self.start_output()
 
         # Main accept loop
         while self.running:
@@ -433,9 +3097,10 @@ class LogServer:
         print(f"\n{Colors.YELLOW}Shutting down...{Colors.RESET}")
         self.running = False
 
-        # Cancel rotation timer
-        if self.rotation_timer:
-            self.rotation_timer.cancel()
+        if self.archiver:
+            self.archiver.stop()
+        if self.stats:
+            self.stats.stop()
 
         # Close all client connections
         with self.lock:
@@ -453,12 +3118,202 @@ class LogServer:
             except:
                 pass
 
-        # Close output file
-        if self.out_file:
+        # Sinks finish their pooled batches; stages may flush what they buffered
+        if self.pipeline:
+            self.pipeline.close()
+
+        # Let the output thread drain what was already received, for a bounded time
+        self.ingest.close()
+        if self.output_thread:
+            self.output_thread.join(timeout=self.drain_seconds)
+            if self.output_thread.is_alive():
+                kept = " (kept in the write-ahead buffer for the next start)" if self.ingest.wal else ""
+                print(f"{Colors.YELLOW}Drain timed out after {self.drain_seconds:g}s; "
+                      f"{len(self.ingest):,} queued lines not written{kept}{Colors.RESET}")
+        if self.terminal:
+            self.terminal.stop()
+
+        # Close output file; anything the output thread still tries to write is
+        # refused (and left uncommitted in the write-ahead ring)
+        with self.lock:
+            if self.out_file:
+                try:
+                    self.out_file.close()
+                except:
+                    pass
+                self.out_file = None
+                if self.aggregates:
+                    self._dump_aggregates(self.current_log_path, self.current_log_started)
+            # Detached under the queue's lock too, so no put() is mid-append
+            with self.ingest.cond:
+                wal, self.ingest.wal = self.ingest.wal, None
+            if wal:
+                wal.close()
+
+
+def make_stats(args, name: str = ''):
+    """ServerStats for the --stats-* options, or None when they are off."""
+    if not (args.stats_interval > 0 or args.stats_port):
+        return None
+    # Rates for the endpoint are sampled every 5 s unless a summary interval is set
+    return ServerStats(args.stats_interval or 5.0, print_summary=args.stats_interval > 0, name=name)
+
+
+def make_limiter(args):
+    """IngestLimiter for --rate-limit/--sample, or None; raises ValueError on a bad rule."""
+    if not (args.rate_limit or args.sample):
+        return None
+    limits = dict(IngestLimiter.parse_rule(spec, 'limit') for spec in args.rate_limit)
+    samples = dict(IngestLimiter.parse_rule(spec, 'sample') for spec in args.sample)
+    return IngestLimiter(limits, samples)
+
+
+def make_stage_pipeline(args, build: bool = True, shard: int = None):
+    """StagePipeline for --pipeline/--stage, or None; raises ValueError on a bad config."""
+    if not (args.pipeline or args.stage):
+        return None
+    config = None
+    if args.pipeline:
+        try:
+            with open(args.pipeline) as f:
+                config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ValueError(f"could not read {args.pipeline}: {e}")
+    return StagePipeline.from_specs(config, args.stage, build, shard)
+
+
+def make_aggregates(args):
+    """LogAggregates for --aggregate-window, or None when it is off."""
+    if not args.aggregate_window:
+        return None
+    buckets = max(1, int(args.aggregate_window * 60 // args.aggregate_bucket))
+    return LogAggregates(args.aggregate_bucket, buckets, args.aggregate_top)
+
+
+def make_screenshot_server(args, dedup: str, output_dir: str, port: int):
+    return ScreenshotServer(port, output_dir, args.quiet,
+                            args.screenshot_writers,
+                            args.screenshot_buffer_mb * 1024 * 1024,
+                            dedup=dedup, phash_threshold=args.phash_threshold,
+                            layout=args.screenshot_layout,
+                            retain_bytes=args.screenshot_retain_mb * 1024 * 1024,
+                            retain_seconds=int(args.screenshot_retain_hours * 3600),
+                            client_cap_bytes=args.screenshot_client_cap_mb * 1024 * 1024,
+                            max_image_bytes=args.screenshot_max_mb * 1024 * 1024)
+
+
+def make_log_server(args, compression: str, output: str, tail_server, screenshot_server,
+                    stats, pipeline, reuse_port: bool = False):
+    return LogServer(args.port, output, args.quiet, args.rotate,
+                     compression, args.retain_mb * 1024 * 1024,
+                     int(args.retain_hours * 3600), args.rotate_mb * 1024 * 1024,
+                     tail_server, args.queue_size, args.queue_policy,
+                     screenshots=screenshot_server, stats=stats, reuse_port=reuse_port,
+                     terminal_rate=args.terminal_rate, session_dir=args.session_dir,
+                     wal_bytes=args.wal_mb * 1024 * 1024, drain_seconds=args.drain_seconds,
+                     limiter=make_limiter(args), aggregates=make_aggregates(args),
+                     pipeline=pipeline)
+
+
+def run_worker(args, compression: str, dedup: str, index: int):
+    """Body of one forked --workers process; never returns."""
+    # The parent coordinates Ctrl+C; workers stop on its SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    output = shard_output_path(args.output, index) if args.output else None
+    # Screenshots arriving on framed connections get a per-worker store, so
+    # no two processes ever append to the same manifest
+    screenshots = make_screenshot_server(args, dedup, os.path.join(args.screenshot_dir, f"w{index}"), 0)
+    stats = make_stats(args, f"w{index}")
+    stats_server = StatsServer(args.stats_port + index, stats) if args.stats_port else None
+    # Stages are built here, after the fork, so sinks never share a buffer or file
+    try:
+        pipeline = make_stage_pipeline(args, shard=index)
+    except ValueError as e:
+        print(f"{Colors.RED}Error: worker {index}: bad --pipeline/--stage: {e}{Colors.RESET}")
+        os._exit(1)
+    log_server = make_log_server(args, compression, output, None, screenshots, stats, pipeline,
+                                 reuse_port=True)
+
+    def signal_handler(sig, frame):
+        log_server.shutdown()
+        screenshots.shutdown()
+        if stats_server:
+            stats_server.shutdown()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    # No legacy port here, but framed receives and retention need it running
+    screenshots.start()
+
+    if stats_server:
+        stats_thread = threading.Thread(target=stats_server.run)
+        stats_thread.daemon = True
+        stats_thread.start()
+
+    try:
+        log_server.run()
+    except SystemExit as e:
+        os._exit(e.code if isinstance(e.code, int) else 1)
+    os._exit(0)
+
+
+def run_workers(args, compression: str, dedup: str):
+    """
+    Run args.workers LogServer processes sharing the log port via SO_REUSEPORT.
+
+    The kernel spreads incoming connections across the workers, so parsing,
+    formatting and writing scale with cores instead of one GIL. Each worker
+    writes its own shard (<root>.wN<ext>, rotated independently); log_query.py
+    merges the shards by timestamp on read. The parent only serves the
+    screenshot port and supervises.
+    """
+    # Fork before any threads exist in this process
+    children = []
+    for index in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(args, compression, dedup, index)
+        children.append(pid)
+
+    screenshot_server = make_screenshot_server(args, dedup, args.screenshot_dir, args.screenshot_port)
+    stopping = False
+
+    def signal_handler(sig, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
             try:
-                self.out_file.close()
-            except:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
                 pass
+        screenshot_server.shutdown()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    screenshot_thread = threading.Thread(target=screenshot_server.run)
+    screenshot_thread.daemon = True
+    screenshot_thread.start()
+
+    # Supervise: report workers that die; stop once none are left
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid in children:
+            children.remove(pid)
+        if not stopping:
+            print(f"{Colors.RED}Worker process {pid} exited "
+                  f"(status {os.waitstatus_to_exitcode(status)}){Colors.RESET}")
+    screenshot_server.shutdown()
 
 
 def main():
@@ -472,7 +3327,17 @@ Examples:
   %(prog)s -o /tmp/app_logs.txt     # Write logs to file (rotate every 15 min)
   %(prog)s -o /tmp/logs.txt -r 30   # Rotate every 30 minutes
   %(prog)s -o /tmp/logs.txt -r 0    # No rotation (single file)
+  %(prog)s -o /tmp/logs.txt -r 0 --rotate-mb 100
+                                    # Rotate by size only, every 100 MB
   %(prog)s -o /tmp/logs.txt -q      # Write to file only (quiet mode)
+  %(prog)s -t 9997                  # Live tail subscribers on port 9997
+  %(prog)s -o /tmp/logs.txt -w 4    # 4 worker processes, one log shard each
+  %(prog)s --session-dir /tmp/sessions -q
+                                    # One file per device connection, no shared file
+  %(prog)s --stats-interval 10 --stats-port 9996
+                                    # Print stats every 10 s, serve JSON on :9996/stats
+  %(prog)s -o /tmp/logs.txt --compress gzip --retain-mb 2048
+                                    # Gzip rotated files, keep at most 2 GB
         """
     )
     parser.add_argument('-p', '--port', type=int, default=9999,
@@ -481,19 +3346,139 @@ Examples:
                         help='TCP port for screenshots (default: 9998)')
     parser.add_argument('-o', '--output', type=str, default=None,
                         help='Output file to write logs (for Claude Code to read)')
+    parser.add_argument('--session-dir', type=str, default=None, metavar='DIR',
+                        help='Also write each connection to its own file in DIR (per device)')
     parser.add_argument('--screenshot-dir', type=str, default='/tmp/app_screenshots',
                         help='Directory to save screenshots (default: /tmp/app_screenshots)')
+    parser.add_argument('--screenshot-writers', type=int, default=2, metavar='N',
+                        help='Threads writing screenshots to disk (default: 2)')
+    parser.add_argument('--screenshot-buffer-mb', type=int, default=64, metavar='MB',
+                        help='Max screenshot bytes received but not yet written (default: 64)')
+    parser.add_argument('--screenshot-max-mb', type=int, default=32, metavar='MB',
+                        help='Largest single screenshot accepted; bigger frames drop the '
+                             'connection (default: 32)')
+    parser.add_argument('--dedup', type=str, choices=DEDUP_MODES, default='off',
+                        help='Store identical (exact) or near-identical (perceptual, needs Pillow) '
+                             'screenshots once (default: off)')
+    parser.add_argument('--phash-threshold', type=int, default=4, metavar='BITS',
+                        help='Max differing bits for a perceptual duplicate (default: 4)')
+    parser.add_argument('--screenshot-layout', type=str, choices=SCREENSHOT_LAYOUTS, default='flat',
+                        help='flat: one directory; hour: YYYYMMDD/HH subdirectories (default: flat)')
+    parser.add_argument('--screenshot-retain-mb', type=int, default=0, metavar='MB',
+                        help='Delete oldest hour shards beyond this total size (hour layout only)')
+    parser.add_argument('--screenshot-retain-hours', type=float, default=0, metavar='HOURS',
+                        help='Delete hour shards older than this (hour layout only)')
+    parser.add_argument('--screenshot-client-cap-mb', type=int, default=0, metavar='MB',
+                        help='Max screenshot MB stored per client per hour (default: 0, no cap)')
+    parser.add_argument('-w', '--workers', type=int, default=1, metavar='N',
+                        help='Log worker processes sharing the port, each writing its own shard '
+                             '(default: 1)')
     parser.add_argument('-q', '--quiet', action='store_true',
                         help='Quiet mode - only write to file, no terminal output')
+    parser.add_argument('--terminal-rate', type=int, default=2000, metavar='LINES_PER_SEC',
+                        help='Above this rate, show warnings and a sample of other lines in the '
+                             'terminal (file keeps all; default: 2000, 0 for no limit)')
     parser.add_argument('-r', '--rotate', type=int, default=15, metavar='MINUTES',
                         help='Rotate log file every N minutes (default: 15, 0 to disable)')
+    parser.add_argument('--rotate-mb', type=int, default=0, metavar='MB',
+                        help='Also rotate once the current file reaches N MB (default: 0, disabled)')
+    parser.add_argument('--queue-size', type=int, default=50000, metavar='LINES',
+                        help='Lines buffered between receiving and writing (default: 50000)')
+    parser.add_argument('--queue-policy', type=str, choices=QUEUE_POLICIES, default='drop-debug',
+                        help='What to do when the queue is full (default: drop-debug)')
+    parser.add_argument('--wal-mb', type=int, default=0, metavar='MB',
+                        help='Keep received-but-unwritten lines in an mmap ring (<output>.wal) that '
+                             'survives a crash and is replayed on the next start (default: 0, off)')
+    parser.add_argument('--drain-seconds', type=float, default=5.0, metavar='SECONDS',
+                        help='On shutdown, wait this long for queued lines to be written (default: 5)')
+    parser.add_argument('--rate-limit', action='append', default=[], metavar='KEY=LINES_PER_SEC',
+                        help='Token-bucket limit per category; KEY is Category:level, Category, '
+                             'level or * (repeatable, most specific wins; errors always pass)')
+    parser.add_argument('--sample', action='append', default=[], metavar='KEY=FRACTION',
+                        help='Keep only this fraction of matching lines, e.g. CameraManager:debug=0.01 '
+                             '(repeatable; errors always pass)')
+    parser.add_argument('--aggregate-window', type=float, default=0, metavar='MINUTES',
+                        help='Keep rolling per-level/category counts, top message templates and error '
+                             'rates for this long; served at /aggregates on --stats-port and saved '
+                             'next to each log file (default: 0, off)')
+    parser.add_argument('--aggregate-bucket', type=int, default=60, metavar='SECONDS',
+                        help='Width of one aggregate time bucket (default: 60)')
+    parser.add_argument('--aggregate-top', type=int, default=50, metavar='N',
+                        help='Message templates reported by the aggregates (default: 50)')
+    parser.add_argument('--pipeline', type=str, default=None, metavar='FILE',
+                        help='JSON file of custom enrich/filter/sample/sink stages run on each '
+                             'batch after parsing (see StagePipeline)')
+    parser.add_argument('--stage', action='append', default=[], metavar='KIND=MODULE:NAME',
+                        help='Add one stage without a config file, e.g. '
+                             'enrich=example_stages:gemini_latency (repeatable)')
+    parser.add_argument('-t', '--tail-port', type=int, default=0, metavar='PORT',
+                        help='TCP port for live tail subscribers (default: 0, disabled)')
+    parser.add_argument('--tail-buffer', type=int, default=10000, metavar='LINES',
+                        help='Lines kept in memory for tail subscribers (default: 10000)')
+    parser.add_argument('--stats-interval', type=float, default=0, metavar='SECONDS',
+                        help='Print a one-line throughput/latency summary every N seconds (default: 0, off)')
+    parser.add_argument('--stats-port', type=int, default=0, metavar='PORT',
+                        help='Serve server stats as JSON over HTTP at /stats (default: 0, off)')
+    parser.add_argument('--compress', type=str, choices=['none', *COMPRESSION_SUFFIXES], default='none',
+                        help='Compress rotated log files in the background; "template" is the '
+                             'log_archive.py format (default: none)')
+    parser.add_argument('--retain-mb', type=int, default=0, metavar='MB',
+                        help='Delete oldest rotated files beyond this total size (default: 0, keep all)')
+    parser.add_argument('--retain-hours', type=float, default=0, metavar='HOURS',
+                        help='Delete rotated files older than this (default: 0, keep all)')
 
     args = parser.parse_args()
 
-    if args.quiet and not args.output:
-        print(f"{Colors.RED}Error: --quiet requires --output{Colors.RESET}")
+    if args.quiet and not (args.output or args.session_dir):
+        print(f"{Colors.RED}Error: --quiet requires --output or --session-dir{Colors.RESET}")
+        sys.exit(1)
+
+    compression = None if args.compress == 'none' else args.compress
+    if compression == 'zstd' and zstandard is None:
+        print(f"{Colors.YELLOW}Warning: zstandard module not installed, compressing with gzip{Colors.RESET}")
+        compression = 'gzip'
+
+    if args.wal_mb and not args.output:
+        print(f"{Colors.RED}Error: --wal-mb requires --output{Colors.RESET}")
+        sys.exit(1)
+
+    try:
+        limiter = make_limiter(args)
+    except ValueError as e:
+        print(f"{Colors.RED}Error: bad --rate-limit/--sample rule: {e}{Colors.RESET}")
+        sys.exit(1)
+
+    try:
+        # With --workers, only check it here; each worker builds its own
+        stage_pipeline = make_stage_pipeline(args, build=args.workers <= 1)
+    except ValueError as e:
+        print(f"{Colors.RED}Error: bad --pipeline/--stage: {e}{Colors.RESET}")
+        sys.exit(1)
+
+    if args.aggregate_window and not (args.output or args.stats_port):
+        print(f"{Colors.RED}Error: --aggregate-window needs --output or --stats-port to report to{Colors.RESET}")
+        sys.exit(1)
+    if args.aggregate_bucket < 1 or args.aggregate_top < 1:
+        print(f"{Colors.RED}Error: --aggregate-bucket and --aggregate-top must be positive{Colors.RESET}")
         sys.exit(1)
 
+    if (args.screenshot_retain_mb or args.screenshot_retain_hours) and args.screenshot_layout != 'hour':
+        print(f"{Colors.RED}Error: screenshot retention requires --screenshot-layout hour{Colors.RESET}")
+        sys.exit(1)
+
+    if args.workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+            print(f"{Colors.RED}Error: --workers needs SO_REUSEPORT and fork (Linux/macOS){Colors.RESET}")
+            sys.exit(1)
+        if args.tail_port:
+            print(f"{Colors.RED}Error: --tail-port is not supported with --workers{Colors.RESET}")
+            sys.exit(1)
+
+    dedup = args.dedup
+    if dedup == 'perceptual' and Image is None:
+        print(f"{Colors.YELLOW}Warning: Pillow not installed, deduplicating exact matches only{Colors.RESET}")
+        dedup = 'exact'
+
     local_ip = get_local_ip()
 
     # Print startup banner
@@ -503,26 +3488,87 @@ Examples:
     print(f"  Log server:        {Colors.CYAN}{local_ip}:{args.port}{Colors.RESET}")
     print(f"  Screenshot server: {Colors.MAGENTA}{local_ip}:{args.screenshot_port}{Colors.RESET}")
     print(f"  Screenshot dir:    {Colors.MAGENTA}{args.screenshot_dir}{Colors.RESET}")
-    if args.output:
+    if dedup != 'off':
+        print(f"  Screenshot dedup:  {Colors.MAGENTA}{dedup}{Colors.RESET}")
+    if args.tail_port:
+        print(f"  Live tail:         {Colors.BLUE}{local_ip}:{args.tail_port}{Colors.RESET}")
+    if args.stats_port:
+        ports = str(args.stats_port)
+        if args.workers > 1:
+            ports += f"-{args.stats_port + args.workers - 1} (one per worker)"
+        print(f"  Stats endpoint:    {Colors.BLUE}http://{local_ip}:{ports}/stats{Colors.RESET}")
+    if args.workers > 1:
+        print(f"  Workers:           {Colors.CYAN}{args.workers} processes (SO_REUSEPORT){Colors.RESET}")
+    if args.output and args.workers > 1:
+        shards = f"{shard_output_path(args.output, 0)} .. {shard_output_path(args.output, args.workers - 1)}"
+        print(f"  Log shards:        {Colors.CYAN}{shards}{Colors.RESET}")
+    elif args.output:
         print(f"  Log file:          {Colors.CYAN}{args.output}{Colors.RESET}")
-    if args.rotate > 0:
-        print(f"  Log rotation:      {Colors.CYAN}every {args.rotate} minutes{Colors.RESET}")
+    if args.session_dir:
+        print(f"  Session files:     {Colors.CYAN}{args.session_dir}{Colors.RESET}")
+    if args.wal_mb:
+        print(f"  Write-ahead ring:  {Colors.CYAN}{args.wal_mb} MB ({args.output}.wal){Colors.RESET}")
+    rotating = args.rotate > 0 or args.rotate_mb > 0
+    if rotating:
+        triggers = []
+        if args.rotate > 0:
+            triggers.append(f"every {args.rotate} minutes")
+        if args.rotate_mb > 0:
+            triggers.append(f"at {args.rotate_mb} MB")
+        print(f"  Log rotation:      {Colors.CYAN}{' or '.join(triggers)}{Colors.RESET}")
     else:
         print(f"  Log rotation:      {Colors.GRAY}disabled{Colors.RESET}")
+    if rotating and compression:
+        print(f"  Compression:       {Colors.CYAN}{compression}{Colors.RESET}")
+    if rotating and (args.retain_mb or args.retain_hours):
+        limits = []
+        if args.retain_mb:
+            limits.append(f"{args.retain_mb} MB")
+        if args.retain_hours:
+            limits.append(f"{args.retain_hours:g} hours")
+        print(f"  Retention:         {Colors.CYAN}{', '.join(limits)}{Colors.RESET}")
+    if limiter:
+        print(f"  Ingest limits:     {Colors.CYAN}{limiter.describe()}{Colors.RESET}")
+    if stage_pipeline:
+        print(f"  Pipeline stages:   {Colors.CYAN}{stage_pipeline.describe()}{Colors.RESET}")
+    if args.aggregate_window:
+        where = [f"{aggregate_dump_path(args.output)} per file"] if args.output else []
+        if args.stats_port:
+            where.append(f"/aggregates on port {args.stats_port}")
+        print(f"  Aggregates:        {Colors.CYAN}last {args.aggregate_window:g} min in "
+              f"{args.aggregate_bucket}s buckets ({', '.join(where)}){Colors.RESET}")
     print(f"\n  {Colors.YELLOW}Configure iOS app with:{Colors.RESET}")
     print(f"    Host: {Colors.BOLD}{local_ip}{Colors.RESET}")
     print(f"    Log Port: {Colors.BOLD}{args.port}{Colors.RESET}")
     print(f"    Screenshot Port: {Colors.BOLD}{args.screenshot_port}{Colors.RESET}")
     print(f"\n{Colors.GRAY}Waiting for connections... (Ctrl+C to stop){Colors.RESET}\n")
 
+    if args.workers > 1:
+        run_workers(args, compression, dedup)
+        return
+
     # Create servers
-    log_server = LogServer(args.port, args.output, args.quiet, args.rotate)
-    screenshot_server = ScreenshotServer(args.screenshot_port, args.screenshot_dir, args.quiet)
+    tail_server = LogTailServer(args.tail_port, args.tail_buffer, args.quiet) if args.tail_port else None
+    stats = make_stats(args)
+    stats_server = StatsServer(args.stats_port, stats) if args.stats_port else None
+    screenshot_server = make_screenshot_server(args, dedup, args.screenshot_dir, args.screenshot_port)
+    log_server = make_log_server(args, compression, args.output, tail_server,
+                                 screenshot_server, stats, stage_pipeline)
+
+    # Handle graceful shutdown; a second Ctrl+C skips the drain
+    stopping = False
 
-    # Handle graceful shutdown
     def signal_handler(sig, frame):
+        nonlocal stopping
+        if stopping:
+            os._exit(1)
+        stopping = True
         log_server.shutdown()
         screenshot_server.shutdown()
+        if tail_server:
+            tail_server.shutdown()
+        if stats_server:
+            stats_server.shutdown()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
@@ -533,6 +3579,18 @@ Examples:
     screenshot_thread.daemon = True
     screenshot_thread.start()
 
+    # Start live tail server in a thread
+    if tail_server:
+        tail_thread = threading.Thread(target=tail_server.run)
+        tail_thread.daemon = True
+        tail_thread.start()
+
+    # Start stats endpoint in a thread
+    if stats_server:
+        stats_thread = threading.Thread(target=stats_server.run)
+        stats_thread.daemon = True
+        stats_thread.start()
+
     # Run log server in main thread
     log_server.run()
 
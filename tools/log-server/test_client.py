@@ -7,25 +7,65 @@ Run this AFTER starting log_server.py.
 
 Usage:
     python3 test_client.py [--host HOST] [--port PORT]
+    python3 test_client.py --load [--connections N] [--rate LINES_PER_SEC] [--duration SECONDS]
 
 Example:
     python3 test_client.py                    # Test localhost:9999
     python3 test_client.py --host 192.168.1.5 # Test specific host
+    python3 test_client.py --load -n 8 --duration 30 --check-file /tmp/app_logs.txt
 """
 
 import socket
 import argparse
+import struct
 import time
 import sys
+import zlib
+import os
+import random
+import re
+import threading
+import uuid
+
+from log_server import (FRAME_HEADER, FRAME_MAGIC, MSG_LOG_BATCH, MSG_LOG_BATCH_DEFLATE, MSG_LOG_BATCH_ZSTD,
+                        MSG_LOG_LINE, MSG_SCREENSHOT, SCREENSHOT_HEADER,
+                        discover_log_files, discover_shards, open_log_for_read)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BATCH_COMPRESSION = ('none', 'deflate', 'zstd')
 
 
 class LogClient:
-    """TCP client for sending logs to the server."""
+    """
+    TCP client for sending logs to the server.
+
+    With batch_lines > 1 (framed mode), send() buffers lines and ships them as
+    one batch frame, optionally compressed, once batch_lines lines have been
+    collected or the oldest has waited batch_ms; a timer thread sends a
+    partial batch on a connection that has gone quiet. Call flush() to send
+    early; close() flushes too. With a device name, connect() first sends a HELLO
+    line so the server can name this connection's session file after it.
+    """
 
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, framed: bool = False, batch_lines: int = 1,
+                 batch_ms: float = 50, compression: str = 'none', device: str = None):
         self.host = host
         self.port = port
+        self.framed = framed or batch_lines > 1
+        self.batch_lines = batch_lines
+        self.batch_ms = batch_ms
+        self.compression = compression
+        self.device = device
+        self.pending = []
+        self.pending_since = 0.0
         self.sock = None
+        # Serializes frames from send() and the flush timer
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
 
     def connect(self) -> bool:
         """Establish TCP connection to the server."""
@@ -33,6 +73,15 @@ class LogClient:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(5.0)
             self.sock.connect((self.host, self.port))
+            if self.framed:
+                self.sock.sendall(FRAME_MAGIC)
+            if self.device:
+                self.send(f"HELLO {self.device}")
+            if self.batch_lines > 1:
+                self.closed.clear()
+                timer = threading.Thread(target=self._flush_loop)
+                timer.daemon = True
+                timer.start()
             return True
         except socket.timeout:
             print(f"ERROR: Connection timed out to {self.host}:{self.port}")
@@ -46,14 +95,110 @@ class LogClient:
         if not self.sock:
             return False
         try:
-            self.sock.sendall((message + '\n').encode('utf-8'))
+            if self.batch_lines > 1:
+                with self.lock:
+                    if not self.pending:
+                        self.pending_since = time.monotonic()
+                    self.pending.append(message)
+                    if (len(self.pending) >= self.batch_lines
+                            or (time.monotonic() - self.pending_since) * 1000 >= self.batch_ms):
+                        self.flush()
+            elif self.framed:
+                self._send_frame(MSG_LOG_LINE, message.encode('utf-8'))
+            else:
+                self.sock.sendall((message + '\n').encode('utf-8'))
             return True
         except Exception as e:
             print(f"Error sending: {e}")
             return False
 
+    def flush(self):
+        """Send any buffered lines as one (possibly compressed) batch frame."""
+        with self.lock:
+            if not self.pending or not self.sock:
+                return
+            payload = '\n'.join(self.pending).encode('utf-8')
+            self.pending = []
+            if self.compression == 'deflate':
+                self._send_frame(MSG_LOG_BATCH_DEFLATE, zlib.compress(payload, 6))
+            elif self.compression == 'zstd':
+                self._send_frame(MSG_LOG_BATCH_ZSTD, zstandard.ZstdCompressor(level=3).compress(payload))
+            else:
+                self._send_frame(MSG_LOG_BATCH, payload)
+
+    def _flush_loop(self):
+        """Send a partial batch once its oldest line has waited batch_ms."""
+        while not self.closed.wait(self.batch_ms / 1000):
+            with self.lock:
+                if not self.pending or (time.monotonic() - self.pending_since) * 1000 < self.batch_ms:
+                    continue
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"Error sending: {e}")
+                    return
+
+    def send_screenshot(self, timestamp: str, image: bytes) -> bool:
+        """Send a screenshot on the same connection (framed mode only)."""
+        if not self.sock or not self.framed:
+            return False
+        try:
+            with self.lock:
+                self.flush()  # keep lines sent before the screenshot ahead of it
+                ts = timestamp.encode('utf-8')
+                self._send_frame(MSG_SCREENSHOT, SCREENSHOT_HEADER.pack(len(ts)) + ts + image)
+            return True
+        except Exception as e:
+            print(f"Error sending screenshot: {e}")
+            return False
+
+    def _send_frame(self, msg_type: int, payload: bytes):
+        self.sock.sendall(FRAME_HEADER.pack(msg_type, len(payload)) + payload)
+
     def close(self):
         """Close the connection."""
+        self.closed.set()
+        with self.lock:
+            if self.sock:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error flushing: {e}")
+                try:
+                    self.sock.close()
+                except:
+                    pass
+                self.sock = None
+
+
+class ScreenshotClient:
+    """TCP client for the legacy screenshot port (length-prefixed frames)."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.sock = None
+
+    def connect(self) -> bool:
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=5.0)
+            return True
+        except socket.error as e:
+            print(f"ERROR: Could not connect to {self.host}:{self.port} - {e}")
+            return False
+
+    def send(self, timestamp: str, image: bytes) -> bool:
+        if not self.sock:
+            return False
+        try:
+            ts = timestamp.encode('utf-8')
+            self.sock.sendall(struct.pack('>Q', len(ts)) + ts + struct.pack('>Q', len(image)) + image)
+            return True
+        except Exception as e:
+            print(f"Error sending screenshot: {e}")
+            return False
+
+    def close(self):
         if self.sock:
             try:
                 self.sock.close()
@@ -62,13 +207,190 @@ class LogClient:
             self.sock = None
 
 
-def run_tests(host: str, port: int):
+# Load mode traffic mix: (weight, message template), roughly what a busy
+# detection session produces. {n} is filled with a varying number.
+LOAD_MESSAGES = [
+    (30, "[DEBUG] [CameraManager] Frame captured: 1920x1080 #{n}"),
+    (25, "[DEBUG] [GeminiService] Analyzing frame... ({n} ms since last)"),
+    (10, "[DEBUG] [YOLODetector] Inference took {n} ms, 7 boxes"),
+    (12, "[INFO] [GeminiService] Detected: MacBook Pro, Coffee mug, Desk lamp ({n} ms)"),
+    (8, "[INFO] [CameraManager] Exposure adjusted to {n}"),
+    (6, "[NOTICE] [App] Inventory saved, {n} items"),
+    (5, "[WARNING] [NetworkLogger] Send queue at {n} messages"),
+    (3, "[ERROR] [GeminiService] API error: 429 Too Many Requests (retry in {n} ms)"),
+    (1, "[FAULT] [App] Unexpected nil frame buffer at {n}"),
+]
+
+# Every load line ends with this tag so the output file can be checked for loss
+LOAD_TAG_RE = re.compile(r'#load (\w+) c(\d+) s(\d+)')
+
+
+class LoadWorker(threading.Thread):
+    """One simulated device: sends tagged log lines (and screenshots) at a target rate."""
+
+    def __init__(self, args, run_id: str, index: int, deadline: float):
+        super().__init__(daemon=True)
+        self.args = args
+        self.run_id = run_id
+        self.index = index
+        self.deadline = deadline
+        self.lines = 0
+        self.bytes = 0
+        self.screenshots = 0
+        self.screenshot_bytes = 0
+        self.error = None
+
+    def run(self):
+        args = self.args
+        device = f"{args.device}-{self.index}" if args.device else None
+        client = LogClient(args.host, args.port, args.framed, args.batch,
+                           compression=args.compress, device=device)
+        if not client.connect():
+            self.error = 'connect failed'
+            return
+        shots = None
+        if args.screenshot_fps > 0 and not client.framed:
+            shots = ScreenshotClient(args.host, args.screenshot_port)
+            if not shots.connect():
+                self.error = 'screenshot connect failed'
+                client.close()
+                return
+
+        rng = random.Random(self.index)
+        weights = [w for w, _ in LOAD_MESSAGES]
+        templates = [t for _, t in LOAD_MESSAGES]
+        image = b'\xff\xd8\xff\xe0' + os.urandom(max(0, args.screenshot_kb * 1024 - 6)) + b'\xff\xd9'
+        line_rate = args.rate / args.connections if args.rate > 0 else 0
+        start = time.monotonic()
+        next_shot = start
+
+        try:
+            while time.monotonic() < self.deadline:
+                # Pace to the target rate; flat out when no rate is set
+                if line_rate:
+                    due = int((time.monotonic() - start) * line_rate) - self.lines
+                    if due <= 0:
+                        time.sleep(min(0.005, 1 / line_rate))
+                        continue
+                else:
+                    due = 256
+
+                for _ in range(due):
+                    template = rng.choices(templates, weights)[0]
+                    message = template.format(n=rng.randint(1, 9999))
+                    tag = f" #load {self.run_id} c{self.index} s{self.lines}"
+                    pad = args.line_bytes - len(message) - len(tag)
+                    if pad > 0:
+                        message += ' ' + 'x' * (pad - 1)
+                    message += tag
+                    if not client.send(message):
+                        self.error = 'send failed'
+                        return
+                    self.lines += 1
+                    self.bytes += len(message) + 1
+
+                if args.screenshot_fps > 0 and time.monotonic() >= next_shot:
+                    next_shot += 1 / args.screenshot_fps
+                    stamp = time.strftime('%Y-%m-%d %H:%M:%S') + f".c{self.index}-{self.screenshots}"
+                    sender = client.send_screenshot if shots is None else shots.send
+                    if not sender(stamp, image):
+                        self.error = 'screenshot send failed'
+                        return
+                    self.screenshots += 1
+                    self.screenshot_bytes += len(image)
+        finally:
+            client.close()
+            if shots:
+                shots.close()
+
+
+def check_loss(base: str, run_id: str, sent):
+    """
+    Count which tagged lines from this run reached the server's output files.
+
+    base is the server's --output path; its rotated, compressed and archived
+    files and any --workers shards are read the way log_query.py reads them.
+    sent maps connection index -> lines sent. Returns (received, missing,
+    duplicates) totals.
+    """
+    seen = {index: set() for index in sent}
+    duplicates = 0
+    paths = [path for shard in [base, *discover_shards(base)] for path, _ in discover_log_files(shard)]
+    for path in paths:
+        with open_log_for_read(path) as f:
+            for raw in f:
+                if b'#load ' not in raw:
+                    continue
+                match = LOAD_TAG_RE.search(raw.decode('utf-8', errors='replace'))
+                if not match or match.group(1) != run_id:
+                    continue
+                index, seq = int(match.group(2)), int(match.group(3))
+                if seq in seen.setdefault(index, set()):
+                    duplicates += 1
+                seen[index].add(seq)
+
+    received = sum(len(seqs) for seqs in seen.values())
+    missing = sum(max(0, count - len(seen[index])) for index, count in sent.items())
+    return received, missing, duplicates
+
+
+def run_load(args) -> bool:
+    """Drive the server with N concurrent simulated devices and report throughput."""
+    run_id = uuid.uuid4().hex[:8]
+    rate = f"{args.rate:,} lines/s" if args.rate > 0 else "flat out"
+    print(f"\n{'='*50}")
+    print(f"Load test {run_id}: {args.connections} connections, {rate}, {args.duration}s")
+    if args.screenshot_fps > 0:
+        print(f"  + {args.screenshot_kb} KB screenshots at {args.screenshot_fps}/s per connection")
+    print(f"{'='*50}\n")
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    workers = [LoadWorker(args, run_id, i, deadline) for i in range(args.connections)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+
+    lines = sum(w.lines for w in workers)
+    log_mb = sum(w.bytes for w in workers) / (1024 * 1024)
+    shots = sum(w.screenshots for w in workers)
+    shot_mb = sum(w.screenshot_bytes for w in workers) / (1024 * 1024)
+    errors = [f"c{w.index}: {w.error}" for w in workers if w.error]
+
+    print(f"Sent {lines:,} lines in {elapsed:.1f}s: {lines / elapsed:,.0f} lines/s, "
+          f"{log_mb / elapsed:.2f} MB/s")
+    if shots:
+        print(f"Sent {shots:,} screenshots: {shots / elapsed:.1f}/s, {shot_mb / elapsed:.2f} MB/s")
+    for error in errors:
+        print(f"  ERROR {error}")
+
+    if not args.check_file:
+        return not errors
+
+    time.sleep(args.settle)
+    received, missing, duplicates = check_loss(args.check_file, run_id,
+                                               {w.index: w.lines for w in workers})
+    loss = missing / lines * 100 if lines else 0.0
+    print(f"Server wrote {received:,} of {lines:,} lines: {missing:,} missing ({loss:.3f}%), "
+          f"{duplicates:,} duplicated")
+    return not errors and not missing
+
+
+def run_tests(host: str, port: int, framed: bool = False, batch_lines: int = 1,
+              compression: str = 'none', device: str = None):
     """Run a series of test log messages."""
+    mode = ''
+    if batch_lines > 1:
+        mode = f", batches of {batch_lines}, {compression} compression"
+    elif framed:
+        mode = ', framed'
     print(f"\n{'='*50}")
-    print(f"Testing Log Server at {host}:{port} (TCP)")
+    print(f"Testing Log Server at {host}:{port} (TCP{mode})")
     print(f"{'='*50}\n")
 
-    client = LogClient(host, port)
+    client = LogClient(host, port, framed, batch_lines, compression=compression, device=device)
 
     print("Connecting to server...")
     if not client.connect():
@@ -113,7 +435,17 @@ def run_tests(host: str, port: int):
             success_count += 1
         else:
             print("FAILED")
-        time.sleep(0.1)  # Small delay between messages
+        if batch_lines <= 1:
+            time.sleep(0.1)  # Small delay between messages
+
+    if client.framed:
+        # A framed connection can carry screenshots too (a tiny JPEG header as payload)
+        print("  [Screenshot frame] ", end="")
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        if client.send_screenshot(stamp, b'\xff\xd8\xff\xe0' + b'\x00' * 1024 + b'\xff\xd9'):
+            print("sent")
+        else:
+            print("FAILED")
 
     client.close()
 
@@ -131,13 +463,13 @@ def run_tests(host: str, port: int):
         return False
 
 
-def interactive_mode(host: str, port: int):
+def interactive_mode(host: str, port: int, framed: bool = False, device: str = None):
     """Interactive mode - type messages to send."""
     print(f"\n{'='*50}")
     print(f"Interactive Mode - Connecting to {host}:{port}")
     print(f"{'='*50}")
 
-    client = LogClient(host, port)
+    client = LogClient(host, port, framed, device=device)
 
     if not client.connect():
         print("Failed to connect. Make sure the server is running.")
@@ -207,6 +539,13 @@ Examples:
   %(prog)s --host 192.168.1.5       # Test specific host
   %(prog)s -i                       # Interactive mode
   %(prog)s --connectivity           # Just test connectivity
+  %(prog)s --framed                 # Use the framed (multiplexed) protocol
+  %(prog)s --batch 8 --compress deflate
+                                    # Send lines in compressed batches of 8
+  %(prog)s --load -n 16 --duration 30
+                                    # 16 devices flat out for 30 seconds
+  %(prog)s --load -n 8 --rate 20000 --screenshot-fps 2 --check-file /tmp/app_logs.txt
+                                    # 20k lines/s plus screenshots, then check for loss
         """
     )
     parser.add_argument('--host', type=str, default='127.0.0.1',
@@ -217,17 +556,59 @@ Examples:
                         help='Interactive mode - type messages to send')
     parser.add_argument('-c', '--connectivity', action='store_true',
                         help='Just test connectivity, then exit')
+    parser.add_argument('-f', '--framed', action='store_true',
+                        help='Use the framed protocol (logs and screenshots on one connection)')
+    parser.add_argument('-d', '--device', type=str, default=None, metavar='NAME',
+                        help='Send a HELLO line naming this device (server --session-dir); '
+                             'load mode appends -<connection>')
+    parser.add_argument('-b', '--batch', type=int, default=1, metavar='LINES',
+                        help='Send lines in batch frames of up to N lines (implies --framed)')
+    parser.add_argument('--compress', type=str, choices=BATCH_COMPRESSION, default='none',
+                        help='Compress batch frames (default: none)')
+
+    load = parser.add_argument_group('load mode')
+    load.add_argument('--load', action='store_true',
+                      help='Generate load from several concurrent connections')
+    load.add_argument('-n', '--connections', type=int, default=4,
+                      help='Concurrent connections (default: 4)')
+    load.add_argument('--duration', type=float, default=10.0, metavar='SECONDS',
+                      help='How long to send (default: 10)')
+    load.add_argument('--rate', type=int, default=0, metavar='LINES_PER_SEC',
+                      help='Total target lines/s across connections (default: 0, flat out)')
+    load.add_argument('--line-bytes', type=int, default=0, metavar='BYTES',
+                      help='Pad lines to about this size (default: natural size)')
+    load.add_argument('--screenshot-fps', type=float, default=0, metavar='FPS',
+                      help='Screenshots per second per connection (default: 0, none)')
+    load.add_argument('--screenshot-kb', type=int, default=200, metavar='KB',
+                      help='Screenshot size (default: 200)')
+    load.add_argument('-s', '--screenshot-port', type=int, default=9998,
+                      help='Screenshot port when not using --framed (default: 9998)')
+    load.add_argument('--check-file', type=str, default=None, metavar='OUTPUT',
+                      help="Server --output path to check for lost lines, e.g. /tmp/app_logs.txt "
+                           "(rotated, compressed and --workers files included)")
+    load.add_argument('--settle', type=float, default=2.0, metavar='SECONDS',
+                      help='Wait before checking the output file (default: 2)')
 
     args = parser.parse_args()
 
+    if args.compress == 'zstd' and zstandard is None:
+        parser.error("--compress zstd requires the zstandard module (pip install zstandard)")
+    if args.compress != 'none' and args.batch <= 1:
+        parser.error("--compress applies to batches; use it with --batch N")
+
+    if args.load:
+        success = run_load(args)
+        sys.exit(0 if success else 1)
+
     if args.connectivity:
         success = connectivity_test(args.host, args.port)
         sys.exit(0 if success else 1)
 
     if args.interactive:
-        interactive_mode(args.host, args.port)
+        interactive_mode(args.host, args.port, args.framed, args.device)
     else:
-        success = run_tests(args.host, args.port)
+        success = run_tests(args.host, args.port, args.framed, args.batch, args.compress,
+                            args.device)
         sys.exit(0 if success else 1)
 
 
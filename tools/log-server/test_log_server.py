@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+"""
+Tests for log_server.py and its companions (log_query, log_archive,
+test_client), mostly run against in-process servers.
+
+Usage:
+    python3 -m unittest test_log_server      # from tools/log-server
+"""
+
+import datetime
+import glob
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from log_archive import ArchiveLineStream, pack_file
+from log_query import LogQuery, _pooled_scan, file_chunks, find_screenshots_near, run_query, select_files
+from test_client import LogClient
+from log_server import (FRAME_HEADER, FRAME_MAGIC, MSG_LOG_BATCH, MSG_SCREENSHOT, SCREENSHOT_HEADER,
+                        HeavyHitters, IngestLimiter, LogServer, PipelineStage, ScreenshotServer,
+                        ScreenshotStore, ScreenshotSweeper, ScreenshotWriterPool, ServerStats,
+                        StagePipeline, WriteAheadRing, discover_log_files)
+
+
+def wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def start_thread(target):
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def reset_connection(sock):
+    """Close with an RST instead of a FIN, like a device dropping off Wi-Fi."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    sock.close()
+
+
+def legacy_frame(timestamp: str, image_len: int) -> bytes:
+    ts = timestamp.encode('utf-8')
+    return struct.pack('>Q', len(ts)) + ts + struct.pack('>Q', image_len)
+
+
+def framed_screenshot(timestamp: str, image_len: int) -> bytes:
+    ts = timestamp.encode('utf-8')
+    payload_len = SCREENSHOT_HEADER.size + len(ts) + image_len
+    return FRAME_HEADER.pack(MSG_SCREENSHOT, payload_len) + SCREENSHOT_HEADER.pack(len(ts)) + ts
+
+
+class WriterPoolBudgetTest(unittest.TestCase):
+    """Receivers wait for in-flight bytes to be written before reading more."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ScreenshotStore(self.tmp.name)
+        self.pool = ScreenshotWriterPool(self.store, workers=1, max_inflight_bytes=100)
+
+    def tearDown(self):
+        self.pool.stop()
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_reserve_waits_for_room(self):
+        self.pool.reserve(80)
+        reserved = threading.Event()
+        start_thread(lambda: (self.pool.reserve(50), reserved.set()))
+        self.assertFalse(reserved.wait(0.2), "reserve went over the budget")
+        self.pool.release(80)
+        self.assertTrue(reserved.wait(2))
+        self.assertEqual(self.pool.inflight_bytes, 50)
+
+    def test_oversized_frame_still_fits_an_empty_budget(self):
+        self.pool.reserve(500)  # would deadlock if it had to fit under max_inflight_bytes
+        self.assertEqual(self.pool.inflight_bytes, 500)
+
+    def test_written_frames_give_their_bytes_back(self):
+        data = b'\xff' * 60
+        self.pool.reserve(len(data))
+        self.pool.submit(os.path.join(self.tmp.name, 'a.jpg'), data, 'ts', 'c')
+        self.assertTrue(wait_for(lambda: self.pool.inflight_bytes == 0))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'a.jpg')))
+
+
+class ScreenshotStoreTest(unittest.TestCase):
+    """Exact dedup, the time-ordered manifest and its lookup by log time."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _manifest(self):
+        with open(os.path.join(self.dir, ScreenshotStore.MANIFEST_NAME)) as f:
+            return [json.loads(line) for line in f]
+
+    def test_exact_dedup_within_and_across_runs(self):
+        store = ScreenshotStore(self.dir, dedup='exact')
+        store.save(os.path.join(self.dir, 'a.jpg'), b'same', 't1', 'c')
+        store.save(os.path.join(self.dir, 'b.jpg'), b'same', 't2', 'c')
+        store.save(os.path.join(self.dir, 'c.jpg'), b'other', 't3', 'c')
+        self.assertEqual(store.duplicates, 1)
+        store.close()
+
+        # A new run rebuilds the digest index from the manifest
+        store = ScreenshotStore(self.dir, dedup='exact')
+        store.save(os.path.join(self.dir, 'd.jpg'), b'same', 't4', 'c')
+        store.close()
+
+        self.assertEqual(sorted(name for name in os.listdir(self.dir) if name.endswith('.jpg')),
+                         ['a.jpg', 'c.jpg'])
+        self.assertEqual([(entry['path'], entry['duplicate_of']) for entry in self._manifest()],
+                         [('a.jpg', None), ('a.jpg', 'a.jpg'), ('c.jpg', None), ('a.jpg', 'a.jpg')])
+
+    def test_screenshots_near_a_log_time(self):
+        store = ScreenshotStore(self.dir)
+        for i in range(10):
+            store.save(os.path.join(self.dir, f"{i}.jpg"), bytes([i]), f"t{i}", 'c')
+            time.sleep(0.01)
+        store.close()
+
+        entries = self._manifest()
+        self.assertEqual(entries, sorted(entries, key=lambda entry: entry['received']))
+        when = datetime.datetime.strptime(entries[4]['received'], '%Y-%m-%d %H:%M:%S.%f')
+        self.assertEqual([entry['ts'] for entry in find_screenshots_near(self.dir, when, 1)], ['t4'])
+        self.assertEqual([entry['ts'] for entry in find_screenshots_near(self.dir, when, 3)],
+                         ['t3', 't4', 't5'])
+
+
+class ScreenshotSweeperTest(unittest.TestCase):
+    """Hour shards are removed oldest first, but never the one being written."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ScreenshotStore(self.tmp.name, layout='hour')
+        for shard in ('20200101/00', '20200101/01', '20200102/00'):
+            os.makedirs(os.path.join(self.tmp.name, shard))
+            with open(os.path.join(self.tmp.name, shard, 'a.jpg'), 'wb') as f:
+                f.write(b'\0' * 1000)
+        self.current = self.store.path_for('now.jpg')
+        with open(self.current, 'wb') as f:
+            f.write(b'\0' * 1000)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def _shards(self):
+        return [shard for shard, _ in ScreenshotSweeper(self.store)._shards()]
+
+    def test_size_limit_removes_oldest_first(self):
+        ScreenshotSweeper(self.store, max_total_bytes=2500, quiet=True).sweep()
+        self.assertEqual(self._shards(), ['20200102/00', self.store.current_shard])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, '20200101')))
+
+    def test_age_limit_keeps_current_shard(self):
+        ScreenshotSweeper(self.store, max_age_seconds=1, quiet=True).sweep()
+        self.assertEqual(self._shards(), [self.store.current_shard])
+        self.assertTrue(os.path.exists(self.current))
+
+
+class TemplateArchiveTest(unittest.TestCase):
+    """A packed log reads back byte for byte."""
+
+    def test_round_trip(self):
+        lines = [
+            "2026-02-05 19:53:00.001 V4MinimalApp <Info> [Camera] took 12ms for frame 4031",
+            "2026-02-05 19:53:00.002 V4MinimalApp <Info> [Camera] took 9ms for frame 4032",
+            "2026-02-05 19:53:00.010 V4MinimalApp <Error> [GeminiService] API error: 429 (retry in 5867 ms)",
+            "not a log line at all",
+            "2026-02-05 19:53:01.500 V4MinimalApp <Debug> [Détection] 🎥 iPhone-ラボ3 id=9f1c2a",
+        ] * 50
+        original = ('\n'.join(lines)).encode('utf-8')  # no final newline
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'app_logs_20260205_195300.txt')
+            with open(path, 'wb') as f:
+                f.write(original)
+            archive = pack_file(path, block_lines=64)
+            with ArchiveLineStream(archive) as stream:
+                self.assertEqual(b''.join(stream), original)
+
+
+class QueryJobsTest(unittest.TestCase):
+    """--jobs scans line-aligned chunks with a bounded number in flight, in file order."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'app_logs.txt')
+        start = datetime.datetime(2026, 2, 5, 19, 0)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for i in range(2000):
+                when = (start + datetime.timedelta(milliseconds=50 * i)).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+                level = 'Error' if i % 7 == 0 else 'Info'
+                f.write(f"{when} V4MinimalApp <{level}> [Camera] frame {i} ✓\n")
+
+    def test_chunks_cover_the_same_lines(self):
+        for query in (LogQuery(),
+                      LogQuery(since=datetime.datetime(2026, 2, 5, 19, 0, 20),
+                               until=datetime.datetime(2026, 2, 5, 19, 1, 10), min_level='error')):
+            chunks = list(file_chunks(query, self.path, size=4096))
+            self.assertGreater(len(chunks), 3)
+            if query.until is None:
+                self.assertIsNone(chunks[-1][1])
+            chunked = [item for chunk in chunks for item in query.scan(self.path, chunk)]
+            self.assertEqual(chunked, list(query.scan(self.path)))
+
+    def test_until_stops_chunking(self):
+        query = LogQuery(until=datetime.datetime(2026, 2, 5, 19, 0, 5))
+        self.assertLess(len(list(file_chunks(query, self.path, size=4096))), 5)
+
+    def test_in_flight_chunks_are_bounded(self):
+        class Pool:
+            def __init__(self):
+                self.pending = self.peak = 0
+
+            def submit(pool, fn, *args):
+                pool.pending += 1
+                pool.peak = max(pool.peak, pool.pending)
+
+                class Future:
+                    def result(self):
+                        pool.pending -= 1
+                        return fn(*args)
+                return Future()
+
+        pool, query = Pool(), LogQuery()
+        results = list(_pooled_scan(pool, query, [self.path, self.path], depth=3))
+        self.assertEqual(results, list(query.scan(self.path)) * 2)
+        self.assertLessEqual(pool.peak, 3)
+
+    def test_parallel_matches_serial(self):
+        query = LogQuery(min_level='error')
+        self.assertEqual(list(run_query(query, [self.path], jobs=2)), list(run_query(query, [self.path])))
+
+
+class PipelineStageTest(unittest.TestCase):
+    """A failing stage passes its batch through and is counted, never raised."""
+
+    RECORDS = [(datetime.datetime.now(), 'info', 'Camera', 'x', 'c')] * 3
+
+    def test_failing_transform_passes_batch_through(self):
+        def boom(records):
+            raise RuntimeError("boom")
+        stage = PipelineStage('filter', boom, 'boom')
+        self.assertEqual(stage(self.RECORDS), self.RECORDS)
+        self.assertEqual(stage.snapshot()['errors'], 1)
+
+    def test_failing_pooled_sink_is_counted(self):
+        def boom(records):
+            raise RuntimeError("boom")
+        stage = PipelineStage('sink', boom, 'boom', pool='thread')
+        stage.start()
+        self.assertEqual(stage(self.RECORDS), self.RECORDS)
+        stage.close()
+        self.assertEqual(stage.errors, 1)
+
+    def test_stages_run_in_kind_order(self):
+        pipeline = StagePipeline.from_specs(quick=['sink=example_stages:drop_heartbeats',
+                                                   'sample=example_stages:drop_heartbeats',
+                                                   'enrich=example_stages:gemini_latency'])
+        self.assertEqual([stage.kind for stage in pipeline.stages], ['enrich', 'sample', 'sink'])
+
+    def test_bad_specs_are_rejected(self):
+        for quick in (['enrich'], ['bogus=example_stages:drop_heartbeats'], ['enrich=no_such_module:x']):
+            with self.assertRaises(ValueError, msg=quick):
+                StagePipeline.from_specs(quick=quick)
+
+
+class ScreenshotReservationTest(unittest.TestCase):
+    """A connection reset mid-image must give back its in-flight reservation."""
+
+    BUDGET = 4 * 1024 * 1024
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.screenshots = ScreenshotServer(0, os.path.join(self.tmp.name, 'shots'), quiet=True,
+                                            max_inflight_bytes=self.BUDGET, stats_interval=0)
+        start_thread(self.screenshots.run)
+        self.assertTrue(wait_for(lambda: self.screenshots.running))
+
+    def tearDown(self):
+        self.screenshots.shutdown()
+        self.tmp.cleanup()
+
+    def _saved(self):
+        return [name for name in os.listdir(self.screenshots.output_dir) if name.endswith('.jpg')]
+
+    def _assert_budget_recovers_and_saves(self, send_valid):
+        self.assertTrue(wait_for(lambda: self.screenshots.writer.inflight_bytes == 0),
+                        f"{self.screenshots.writer.inflight_bytes} bytes still reserved")
+        # Would block forever in reserve() if the resets had leaked their reservations
+        send_valid(b'\xff' * (2 * 1024 * 1024))
+        self.assertTrue(wait_for(lambda: len(self._saved()) == 1), "valid screenshot was not saved")
+
+    def test_legacy_port_reset_mid_image(self):
+        for i in range(3):
+            sock = socket.create_connection(('127.0.0.1', self.screenshots.port))
+            sock.sendall(legacy_frame(f"reset-{i}", 1024 * 1024) + b'\x00' * 64 * 1024)
+            time.sleep(0.1)
+            reset_connection(sock)
+
+        def send_valid(image):
+            with socket.create_connection(('127.0.0.1', self.screenshots.port)) as sock:
+                sock.sendall(legacy_frame("valid", len(image)) + image)
+                time.sleep(0.2)
+
+        self._assert_budget_recovers_and_saves(send_valid)
+
+    def test_framed_connection_reset_mid_image(self):
+        server = LogServer(0, quiet=True, screenshots=self.screenshots)
+        start_thread(server.run)
+        self.assertTrue(wait_for(lambda: server.running and server.port))
+        try:
+            for i in range(3):
+                sock = socket.create_connection(('127.0.0.1', server.port))
+                sock.sendall(FRAME_MAGIC + framed_screenshot(f"reset-{i}", 1024 * 1024) + b'\x00' * 64 * 1024)
+                time.sleep(0.1)
+                reset_connection(sock)
+
+            def send_valid(image):
+                with socket.create_connection(('127.0.0.1', server.port)) as sock:
+                    sock.sendall(FRAME_MAGIC + framed_screenshot("valid", len(image)) + image)
+                    time.sleep(0.2)
+
+            self._assert_budget_recovers_and_saves(send_valid)
+        finally:
+            server.shutdown()
+
+
+class BatchFlushTest(unittest.TestCase):
+    """A partial batch is sent once it has waited batch_ms, even if no more lines come."""
+
+    def test_idle_connection_flushes_partial_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'app_logs.txt')
+            server = LogServer(0, output, quiet=True)
+            start_thread(server.run)
+            self.assertTrue(wait_for(lambda: server.running and server.port))
+            client = LogClient('127.0.0.1', server.port, batch_lines=100, batch_ms=50)
+            try:
+                self.assertTrue(client.connect())
+                for i in range(3):
+                    client.send(f"[Camera] idle tail {i}")
+
+                def logged():
+                    with open(output) as f:
+                        return f.read().count('idle tail')
+                self.assertTrue(wait_for(lambda: logged() == 3, timeout=2), "partial batch was never sent")
+            finally:
+                client.close()
+                server.shutdown()
+
+
+class RotationTest(unittest.TestCase):
+    """--rotate-mb counts encoded bytes, so non-ASCII lines rotate on time."""
+
+    def test_rotate_bytes_counts_utf8(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'app_logs.txt')
+            server = LogServer(0, base, quiet=True, rotate_bytes=4096)
+            start_thread(server.run)
+            self.assertTrue(wait_for(lambda: server.running and server.port))
+            try:
+                with socket.create_connection(('127.0.0.1', server.port)) as sock:
+                    for i in range(3):
+                        # 1,100 characters but 4,400 bytes: each line fills a file
+                        sock.sendall(f"[Camera] {i} {'🎥' * 1100}\n".encode('utf-8'))
+                        time.sleep(0.2)
+            finally:
+                server.shutdown()
+            self.assertEqual(len(discover_log_files(base)), 3)
+
+
+class WorkerScreenshotTest(unittest.TestCase):
+    """--workers processes must keep receiving a framed screenshot that stalls."""
+
+    def test_slow_framed_screenshot_is_saved(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, 'log_server.py', '-p', str(port), '-s', str(free_port()), '--workers', '2',
+                 '--quiet', '--output', os.path.join(tmp, 'app_logs.txt'),
+                 '--screenshot-dir', os.path.join(tmp, 'shots')],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                def connect():
+                    try:
+                        return socket.create_connection(('127.0.0.1', port), timeout=1)
+                    except OSError:
+                        return None
+                self.assertTrue(wait_for(lambda: connect() is not None, timeout=10))
+
+                image = b'\xff' * (256 * 1024)
+                with socket.create_connection(('127.0.0.1', port)) as sock:
+                    sock.sendall(FRAME_MAGIC + framed_screenshot("slow", len(image)) + image[:1024])
+                    time.sleep(2.5)  # longer than the workers' 1 s receive timeout
+                    sock.sendall(image[1024:])
+                    self.assertTrue(wait_for(lambda: glob.glob(os.path.join(tmp, 'shots', 'w*', '*.jpg'))),
+                                    "stalled screenshot was not saved")
+            finally:
+                server.send_signal(signal.SIGINT)
+                server.wait(10)
+
+
+class ScreenshotFrameValidationTest(unittest.TestCase):
+    """Frames whose lengths don't add up are refused before anything is reserved."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.screenshots = ScreenshotServer(0, os.path.join(self.tmp.name, 'shots'), quiet=True,
+                                            stats_interval=0, max_image_bytes=1024 * 1024)
+        start_thread(self.screenshots.run)
+        self.assertTrue(wait_for(lambda: self.screenshots.running))
+        self.server = LogServer(0, quiet=True, screenshots=self.screenshots)
+        start_thread(self.server.run)
+        self.assertTrue(wait_for(lambda: self.server.running and self.server.port))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.screenshots.shutdown()
+        self.tmp.cleanup()
+
+    def _assert_rejected(self, frame: bytes):
+        with socket.create_connection(('127.0.0.1', self.server.port)) as sock:
+            sock.settimeout(5)
+            sock.sendall(FRAME_MAGIC + frame)
+            # The server closes the connection instead of waiting for the rest
+            self.assertEqual(sock.recv(1), b'')
+        self.assertEqual(self.screenshots.writer.inflight_bytes, 0)
+
+    def test_timestamp_longer_than_frame(self):
+        ts = b'2024-01-01 00:00:00'
+        self._assert_rejected(FRAME_HEADER.pack(MSG_SCREENSHOT, SCREENSHOT_HEADER.size + 4)
+                              + SCREENSHOT_HEADER.pack(len(ts)) + ts)
+
+    def test_image_over_max_size(self):
+        self._assert_rejected(framed_screenshot("too-big", 2 * 1024 * 1024))
+
+    def test_legacy_image_over_max_size(self):
+        with socket.create_connection(('127.0.0.1', self.screenshots.port)) as sock:
+            sock.settimeout(5)
+            sock.sendall(legacy_frame("too-big", 2 * 1024 * 1024))
+            self.assertEqual(sock.recv(1), b'')
+        self.assertEqual(self.screenshots.writer.inflight_bytes, 0)
+
+
+class FramedScreenshotLabelTest(unittest.TestCase):
+    """A framed screenshot is labeled with the HELLO device and counted in the connection's bytes."""
+
+    def test_screenshot_after_hello(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            screenshots = ScreenshotServer(0, os.path.join(tmp, 'shots'), quiet=True, stats_interval=0)
+            screenshots.start()
+            stats = ServerStats(60, print_summary=False)
+            server = LogServer(0, quiet=True, screenshots=screenshots, stats=stats)
+            start_thread(server.run)
+            self.assertTrue(wait_for(lambda: server.running and server.port))
+            try:
+                hello = b"HELLO iPhone-lab3"
+                image = b'\xff' * 4096
+                frame = framed_screenshot("t1", len(image)) + image
+                with socket.create_connection(('127.0.0.1', server.port)) as sock:
+                    sock.sendall(FRAME_MAGIC + FRAME_HEADER.pack(MSG_LOG_BATCH, len(hello)) + hello + frame)
+                    self.assertTrue(wait_for(lambda: screenshots.writer.inflight_bytes == 0
+                                             and screenshots.screenshot_count == 1))
+                    counters = list(stats.clients.values())
+                self.assertEqual(counters[0].bytes, FRAME_HEADER.size + len(hello) + len(frame))
+            finally:
+                server.shutdown()
+                screenshots.shutdown()
+            with open(os.path.join(tmp, 'shots', ScreenshotStore.MANIFEST_NAME)) as f:
+                entry = json.loads(f.readline())
+            self.assertTrue(entry['client'].startswith('iPhone-lab3@127.0.0.1:'), entry['client'])
+
+
+class IngestLimiterTest(unittest.TestCase):
+    """Client-supplied categories must not grow the limiter without bound."""
+
+    def test_buckets_fold_into_other_at_cap(self):
+        limiter = IngestLimiter(limits={(None, 'debug'): 5})
+        now = datetime.datetime.now()
+        records = [(now, 'debug', f"Category{i}", 'x', 'c') for i in range(3 * IngestLimiter.MAX_BUCKETS)]
+        kept = limiter.admit(records)
+
+        self.assertLessEqual(len(limiter.buckets), IngestLimiter.MAX_BUCKETS + 1)
+        self.assertLessEqual(len(limiter.suppressed), IngestLimiter.MAX_BUCKETS + 1)
+        # Categories past the cap share one bucket: one second's burst, then suppressed
+        self.assertEqual(len(kept), IngestLimiter.MAX_BUCKETS + 5)
+        self.assertEqual(sum(limiter.suppressed.values()), 2 * IngestLimiter.MAX_BUCKETS - 5)
+        self.assertIn(('(other)', 'debug'), limiter.suppressed)
+
+
+class HeavyHittersTest(unittest.TestCase):
+    """Weighted adds must count the same as that many single adds."""
+
+    def test_weighted_add_matches_repeated_adds(self):
+        stream = [('a', 5), ('b', 3), ('c', 1), ('d', 7), ('a', 2), ('e', 4), ('d', 1), ('f', 9)]
+        weighted, single = HeavyHitters(3), HeavyHitters(3)
+        for key, n in stream:
+            weighted.add(key, n)
+            for _ in range(n):
+                single.add(key)
+        self.assertEqual(weighted.counts, single.counts)
+        self.assertEqual(weighted.error, single.error)
+
+    def test_heavy_key_survives_when_full(self):
+        hitters = HeavyHitters(2)
+        hitters.add('x', 1)
+        hitters.add('y', 1)
+        hitters.add('big', 10)
+        self.assertEqual(hitters.counts, {'big': 9})
+        self.assertEqual(hitters.error, 1)
+
+
+class WalRecoveryTest(unittest.TestCase):
+    """Recovered lines must be found by log_query's name-stamp pruning."""
+
+    def test_recovered_lines_get_their_own_stamped_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'app_logs.txt')
+            crashed_at = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(hours=1)
+            ring = WriteAheadRing(f"{base}.wal", 64 * 1024)
+            for i in range(3):
+                ring.append((crashed_at + datetime.timedelta(seconds=i), 'info', 'Camera', f"frame {i}", 'c'))
+            ring.close()
+
+            server = LogServer(0, base, quiet=True, rotate_bytes=1024 * 1024, wal_bytes=64 * 1024)
+            start_thread(server.run)
+            self.assertTrue(wait_for(lambda: server.running and server.port))
+            server.shutdown()
+
+            files = discover_log_files(base)
+            self.assertEqual(len(files), 2)
+            recovered = select_files(files, crashed_at, crashed_at + datetime.timedelta(seconds=5))
+            self.assertEqual(recovered, [files[0][0]])
+            self.assertEqual(files[0][1], crashed_at)
+            with open(files[0][0]) as f:
+                self.assertEqual(len(f.read().splitlines()), 3)
+            with open(files[1][0]) as f:
+                self.assertIn(f"saved to {files[0][0]}", f.read())
+
+    def test_recovery_keeps_fields_containing_control_characters(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'app_logs.txt.wal')
+            now = datetime.datetime.now()
+            records = [(now, 'info', 'Cam\x1fera', 'a\x1fb\nc', '10.0.0.5:1'),
+                       (now, 'error', 'Gemini', 'plain é 🎥', 'lab3@10.0.0.6:2')]
+            ring = WriteAheadRing(path, 64 * 1024)
+            for record in records:
+                ring.append(record)
+            ring.close()
+            self.assertEqual(WriteAheadRing.recover(path), records)
+
+    def test_shutdown_during_a_slow_commit(self):
+        errors = []
+        previous_hook = threading.excepthook
+        threading.excepthook = lambda hook_args: errors.append(hook_args.exc_value)
+        self.addCleanup(setattr, threading, 'excepthook', previous_hook)
+        with tempfile.TemporaryDirectory() as tmp:
+            server = LogServer(0, os.path.join(tmp, 'app_logs.txt'), quiet=True,
+                               wal_bytes=64 * 1024, drain_seconds=0.1)
+            start_thread(server.run)
+            self.assertTrue(wait_for(lambda: server.running and server.port and server.ingest.wal))
+
+            ring = server.ingest.wal
+            commit = ring.commit
+            committing = threading.Event()
+
+            def slow_commit(offset):
+                committing.set()
+                time.sleep(0.5)  # outlives the drain timeout, so shutdown races it
+                commit(offset)
+            ring.commit = slow_commit
+
+            with socket.create_connection(('127.0.0.1', server.port)) as sock:
+                sock.sendall(b"[Camera] one line\n")
+                self.assertTrue(committing.wait(5))
+            server.shutdown()
+            server.output_thread.join(5)
+        self.assertEqual(errors, [])
+
+
+class HelloTest(unittest.TestCase):
+    """Without --session-dir, a HELLO line labels the connection and is not logged."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, 'app_logs.txt')
+        self.stats = ServerStats(60, print_summary=False)
+        self.server = LogServer(0, self.output, quiet=True, stats=self.stats)
+        start_thread(self.server.run)
+        self.assertTrue(wait_for(lambda: self.server.running and self.server.port))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.tmp.cleanup()
+
+    def _logged(self):
+        with open(self.output) as f:
+            return f.read()
+
+    def _assert_hello_consumed(self, send):
+        with socket.create_connection(('127.0.0.1', self.server.port)) as sock:
+            send(sock, "HELLO iPhone-lab3\n[Camera] first line\n")
+            self.assertTrue(wait_for(lambda: 'first line' in self._logged()))
+            devices = [c['device'] for c in self.stats.snapshot()['clients'].values()]
+        self.assertNotIn('HELLO', self._logged())
+        self.assertEqual(devices, ['iPhone-lab3'])
+
+    def test_text_connection(self):
+        self._assert_hello_consumed(lambda sock, text: sock.sendall(text.encode('utf-8')))
+
+    def test_framed_connection(self):
+        def send(sock, text):
+            payload = text.encode('utf-8')
+            sock.sendall(FRAME_MAGIC + FRAME_HEADER.pack(MSG_LOG_BATCH, len(payload)) + payload)
+        self._assert_hello_consumed(send)
+
+
+if __name__ == '__main__':
+    unittest.main()